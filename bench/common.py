@@ -0,0 +1,52 @@
+"""Shared helpers for the benchmarks: import path, sample images and timing."""
+
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot")
+if BOT_DIR not in sys.path:
+    sys.path.insert(0, BOT_DIR)
+# Keep benchmark blobs and cached downloads/renders out of the bot's real stores.
+_BENCH_DIR = tempfile.mkdtemp(prefix="pixelate_bench_")
+os.environ.setdefault("BLOB_STORE_DIR", os.path.join(_BENCH_DIR, "blobs"))
+os.environ.setdefault("SHARED_CACHE_DIR", os.path.join(_BENCH_DIR, "shared"))
+
+import numpy as np
+from PIL import Image
+
+def sample_jpeg(long_side: int, seed: int = 0) -> bytes:
+    """A 4:3 photo-like JPEG: smooth colour regions plus a little noise."""
+    width, height = long_side, long_side * 3 // 4
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (max(1, height // 32), max(1, width // 32), 3), dtype=np.uint8)
+    img = Image.fromarray(coarse).resize((width, height), Image.BICUBIC)
+    noise = rng.integers(-8, 9, (height, width, 3))
+    img = Image.fromarray(np.clip(np.asarray(img, dtype=np.int16) + noise, 0, 255).astype(np.uint8))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+def summarize(samples) -> Dict[str, float]:
+    samples = sorted(samples)
+    return {
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        "min_ms": samples[0] * 1000,
+        "runs": len(samples),
+    }
+
+def measure(func: Callable[[], object], min_runs: int = 5, min_time: float = 0.5, max_runs: int = 200) -> Dict[str, float]:
+    """Call func until both min_runs and min_time are reached; one warm-up call is discarded."""
+    func()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_runs and (len(samples) < min_runs or time.perf_counter() - started < min_time):
+        t = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t)
+    return summarize(samples)
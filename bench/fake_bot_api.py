@@ -0,0 +1,85 @@
+"""
+A local stand-in for the Telegram Bot API, for driving the bot end to end.
+
+Point the bot at it with BOT_API_URL=<FakeBotAPI.url>. Every method succeeds
+with a minimal, well-formed result, and files registered in `files` can be
+downloaded by file_id. Tests observe the bot through `calls` and `on_call`.
+"""
+
+import itertools
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+
+# Methods whose result is the sent or edited Message
+MESSAGE_METHODS = {
+    "sendphoto", "sendmessage", "senddocument", "editmessagemedia", "editmessagecaption", "editmessagetext",
+}
+
+class FakeBotAPI:
+    def __init__(self, files: Dict[str, bytes]):
+        self.files = files
+        self.calls: Counter = Counter()
+        # Called with (method, params) after each request has been answered
+        self.on_call: Optional[Callable[[str, Dict[str, str]], None]] = None
+        self._message_ids = itertools.count(1000)
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    def _message(self, params: Dict[str, str]) -> dict:
+        message_id = next(self._message_ids)
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "photo": [{"file_id": f"sent-{message_id}", "file_unique_id": f"sent-{message_id}", "width": 1, "height": 1}],
+        }
+
+    def _result(self, method: str, params: Dict[str, str]):
+        method = method.lower()
+        if method == "getfile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": file_id, "file_path": file_id}
+        if method in MESSAGE_METHODS:
+            return self._message(params)
+        if method == "sendmediagroup":
+            return [self._message(params) for _ in range(params.get("media", "").count('"type"') or 1)]
+        if method == "getme":
+            return {"id": 42, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        return True
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        params = {key: value for key, value in form.items() if isinstance(value, str)}
+        result = self._result(method, params)
+        self.calls[method] += 1
+        if self.on_call is not None:
+            self.on_call(method, params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _handle_file(self, request: web.Request) -> web.Response:
+        data = self.files.get(request.match_info["path"])
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data, content_type="application/octet-stream")
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle_method)
+        app.router.add_get("/file/bot{token}/{path}", self._handle_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_host, bound_port = self._runner.addresses[0][:2]
+        self.url = f"http://{bound_host}:{bound_port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,105 @@
+"""
+End-to-end handler latency: updates are fed through the real Dispatcher from
+bot.create_dispatcher(), with a Bot whose session answers API calls locally.
+"""
+
+import datetime
+import itertools
+import time
+from typing import Dict
+
+from common import sample_jpeg, summarize
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageCaption, EditMessageMedia, GetFile, SendPhoto
+from aiogram.types import CallbackQuery, Chat, File, Message, PhotoSize, Update, User
+
+from bot import create_dispatcher
+from services.shared_cache import download_cache, render_cache
+
+CHAT = Chat(id=1, type="private")
+USER = User(id=1, is_bot=False, first_name="bench")
+FILE_ID = "bench-photo"
+
+class StubSession(BaseSession):
+    """Answers Bot API calls without network access."""
+
+    def __init__(self, files: Dict[str, bytes]):
+        super().__init__()
+        self.files = files
+        self.message_ids = itertools.count(1000)
+
+    async def close(self):
+        pass
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, GetFile):
+            return File(file_id=method.file_id, file_unique_id=method.file_id, file_path=method.file_id)
+        if isinstance(method, (SendPhoto, EditMessageMedia, EditMessageCaption)):
+            return _photo_message(next(self.message_ids), f"sent-{next(self.message_ids)}")
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield self.files[url.rsplit("/", 1)[-1]]
+
+def _photo_message(message_id: int, file_id: str) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.datetime.now(),
+        chat=CHAT,
+        from_user=USER,
+        photo=[PhotoSize(file_id=file_id, file_unique_id=file_id, width=1, height=1)],
+    )
+
+class _Updates:
+    def __init__(self):
+        self.ids = itertools.count(1)
+
+    def photo(self) -> Update:
+        return Update(update_id=next(self.ids), message=_photo_message(next(self.ids), FILE_ID))
+
+    def callback(self, data: str) -> Update:
+        return Update(
+            update_id=next(self.ids),
+            callback_query=CallbackQuery(
+                id=str(next(self.ids)), from_user=USER, chat_instance="bench", data=data,
+                message=_photo_message(1, FILE_ID),
+            ),
+        )
+
+async def run(long_side: int = 1280, runs: int = 10) -> Dict[str, dict]:
+    bot = Bot(token="42:bench", session=StubSession({FILE_ID: sample_jpeg(long_side)}))
+    dp = create_dispatcher()
+    state = dp.fsm.get_context(bot, CHAT.id, USER.id)
+    preview_cache = dp["preview_cache"]
+    updates = _Updates()
+    samples = {name: [] for name in ("photo", "pixel_plus", "pixel_preview_cold", "pixel_preview_cached", "pixel_save", "undo")}
+
+    async def timed(name, update: Update, record: bool):
+        t = time.perf_counter()
+        await dp.feed_update(bot, update)
+        if name and record:
+            samples[name].append(time.perf_counter() - t)
+
+    try:
+        # The first round warms up worker processes and is not recorded.
+        for i in range(runs + 1):
+            record = i > 0
+            # Each round repeats the same edit; measure it uncached.
+            await download_cache.clear()
+            await render_cache.clear()
+            await timed("photo", updates.photo(), record)
+            await timed(None, updates.callback("menu_pixelate"), record)
+            await timed("pixel_plus", updates.callback("pixel_plus"), record)
+            preview_cache.drop_session(CHAT.id)
+            await timed("pixel_preview_cold", updates.callback("pixel_preview"), record)
+            await state.update_data(pixelate_preview_stage=0)
+            await timed("pixel_preview_cached", updates.callback("pixel_preview"), record)
+            await timed("pixel_save", updates.callback("pixel_preview"), record)
+            await timed(None, updates.callback("pixel_back_to_main"), record)
+            await timed("undo", updates.callback("undo"), record)
+    finally:
+        await dp.emit_shutdown()
+        await bot.session.close()
+    return {f"handlers/{long_side}px/{name}": summarize(values) for name, values in samples.items()}
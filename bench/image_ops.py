@@ -0,0 +1,54 @@
+"""Per-op benchmarks for services/image_utils.py and the edit pipeline."""
+
+from typing import Dict, Iterable
+
+from common import measure, sample_jpeg
+
+from services.image_utils import (
+    apply_brightness,
+    apply_contrast,
+    decode_jpg_to_array,
+    encode_array_to_jpg,
+    pixelate_array,
+)
+from services.encoding import PROFILES
+from services.quantize import PaletteFit, quantize_array, sample_pixels, threshold_array
+from services.render_jobs import render_contact_sheet, render_pipeline, render_preview
+
+RESOLUTIONS = (320, 640, 1280, 2048, 4096)
+QUICK_RESOLUTIONS = (320, 1280)
+BLOCK_SIZES = (2, 8, 32)
+# A typical saved edit chain: pixelate, then the two point ops
+PIPELINE = [["pixelate", {"block_size": 8}], ["brightness", {"value": 20}], ["contrast", {"value": 20}]]
+# Compare mode: six pixel sizes in one sheet
+SHEET_VARIANTS = [["pixelate", {"block_size": size}] for size in (2, 4, 6, 8, 10, 12)]
+# Pixel art: pixelate to a dithered 16 colour palette
+PIXEL_ART = [["pixelate", {"block_size": 8, "colors": 16, "dither": "fs"}]]
+
+def run(resolutions: Iterable[int] = RESOLUTIONS, block_sizes: Iterable[int] = BLOCK_SIZES) -> Dict[str, dict]:
+    results = {}
+    for side in resolutions:
+        image = sample_jpeg(side)
+        width, height, arr = decode_jpg_to_array(image)
+        prefix = f"ops/{side}px"
+        results[f"{prefix}/decode"] = measure(lambda: decode_jpg_to_array(image))
+        results[f"{prefix}/decode_proxy"] = measure(lambda: decode_jpg_to_array(image, 2))
+        results[f"{prefix}/brightness"] = measure(lambda: apply_brightness(arr, 40))
+        results[f"{prefix}/contrast"] = measure(lambda: apply_contrast(arr, 40))
+        for block_size in block_sizes:
+            results[f"{prefix}/pixelate_{block_size}"] = measure(lambda: pixelate_array(arr, block_size))
+        fit = PaletteFit(sample_pixels(arr))
+        results[f"{prefix}/palette_fit"] = measure(lambda: PaletteFit(sample_pixels(arr)))
+        for dither in ("none", "ordered", "fs"):
+            results[f"{prefix}/quantize_16_{dither}"] = measure(lambda: quantize_array(arr, 16, dither, fit))
+            results[f"{prefix}/bw_{dither}"] = measure(lambda: threshold_array(arr, 128, dither))
+        for profile in PROFILES:
+            results[f"{prefix}/encode_{profile}"] = measure(lambda: encode_array_to_jpg(width, height, arr, profile))
+
+        results[f"{prefix}/render_full"] = measure(lambda: render_pipeline(image, PIPELINE))
+        results[f"{prefix}/render_preview"] = measure(lambda: render_preview(image, PIPELINE))
+        results[f"{prefix}/render_pixel_art"] = measure(lambda: render_pipeline(image, PIXEL_ART))
+        results[f"{prefix}/render_sheet"] = measure(
+            lambda: render_contact_sheet(image, PIPELINE[1:], SHEET_VARIANTS, [str(i + 1) for i in range(6)])
+        )
+    return results
@@ -0,0 +1,224 @@
+"""
+Load test: many simulated users against the real Dispatcher.
+
+The bot is built with bot.create_bot()/create_dispatcher() and talks HTTP to a
+local fake Bot API, so downloads, uploads and edits go through aiogram's real
+client session. Each simulated user sends a photo, then pixelates,
+brightens and adjusts contrast (open menu, tap +/-, Preview, Save), then
+undoes and redoes, with a short random pause between taps.
+
+    python bench/load_test.py --users 200
+    python bench/load_test.py --users 50 100 200 --output load.json
+
+Reports updates/s, p50/p99 latency per callback and peak RSS of the bot
+process plus its render workers. Outbound requests are paced as in
+production; raise OUTBOUND_CHAT_RATE to measure the bot without Telegram's
+per-chat limit. Each run starts with empty shared caches, so users sharing a
+photo hit them as they would in production; --images sets how many share.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from common import sample_jpeg
+
+from fake_bot_api import FakeBotAPI
+
+import settings
+from bot import create_bot, create_dispatcher
+from services.shared_cache import download_cache, render_cache
+
+SESSION = [
+    "photo",
+    "menu_pixelate", "pixel_plus", "pixel_plus", "pixel_preview", "pixel_preview",
+    "menu_brightness", "brightness_plus", "brightness_preview", "brightness_preview",
+    "menu_contrast", "contrast_minus", "contrast_preview", "contrast_preview",
+    "undo", "redo",
+]
+
+def _rss_bytes(pid: int) -> int:
+    """Resident set size from /proc; 0 where that isn't available."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+class RssSampler:
+    """Polls the RSS of this process and its children, keeping the peak of the sum."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    def sample(self) -> None:
+        pids = [os.getpid()] + [child.pid for child in multiprocessing.active_children()]
+        self.peak = max(self.peak, sum(_rss_bytes(pid) for pid in pids))
+
+    async def _run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        self.sample()
+        if not self.peak:
+            # No /proc: fall back to the largest single process seen by the kernel.
+            usage = max(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            )
+            self.peak = usage * 1024
+
+class SimulatedUsers:
+    def __init__(self, dp, bot, image_count: int, think_time: float):
+        self.dp = dp
+        self.bot = bot
+        self.image_count = image_count
+        self.think_time = think_time
+        self._ids = itertools.count(1)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors = 0
+
+    def _update(self, chat_id: int, step: str) -> dict:
+        user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+        file_id = f"photo-{chat_id % self.image_count}"
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": user,
+            "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}],
+        }
+        if step == "photo":
+            return {"update_id": next(self._ids), "message": message}
+        callback = {"id": str(next(self._ids)), "from": user, "chat_instance": "load", "data": step, "message": message}
+        return {"update_id": next(self._ids), "callback_query": callback}
+
+    async def run_user(self, chat_id: int, rounds: int) -> None:
+        rng = random.Random(chat_id)
+        await asyncio.sleep(rng.uniform(0, self.think_time))
+        for step in SESSION * rounds:
+            started = time.perf_counter()
+            try:
+                await self.dp.feed_raw_update(self.bot, self._update(chat_id, step))
+            except Exception:
+                self.errors += 1
+                continue
+            self.latencies[step].append(time.perf_counter() - started)
+            if self.think_time:
+                await asyncio.sleep(rng.expovariate(1 / self.think_time))
+
+def _percentile(samples: List[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+
+async def measure(users: int, rounds: int, images: List[bytes], think_time: float) -> dict:
+    api = FakeBotAPI({f"photo-{i}": image for i, image in enumerate(images)})
+    alerts = 0
+
+    def on_call(method: str, params: Dict[str, str]) -> None:
+        nonlocal alerts
+        if method == "answerCallbackQuery" and params.get("show_alert") == "true":
+            alerts += 1
+
+    api.on_call = on_call
+    os.environ["BOT_TOKEN"] = "42:load"
+    settings.BOT_API_URL = await api.start()
+
+    await download_cache.clear()
+    await render_cache.clear()
+    bot = create_bot()
+    dp = create_dispatcher()
+    sampler = RssSampler()
+    sim = SimulatedUsers(dp, bot, len(images), think_time)
+    try:
+        # Warm-up: start the render workers before the clock runs.
+        await sim.run_user(-1, 1)
+        sim.latencies.clear()
+        sampler.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(sim.run_user(chat_id, rounds) for chat_id in range(1, users + 1)))
+        elapsed = time.perf_counter() - started
+        await sampler.stop()
+    finally:
+        await dp.emit_shutdown()
+        await bot.session.close()
+        await api.stop()
+
+    updates = sum(len(samples) for samples in sim.latencies.values())
+    return {
+        "users": users,
+        "updates": updates,
+        "seconds": elapsed,
+        "updates_per_second": updates / elapsed,
+        "errors": sim.errors,
+        "alerts": alerts,
+        "peak_rss_mb": sampler.peak / (1024 * 1024),
+        "download_cache_hit_ratio": download_cache.hit_ratio,
+        "render_cache_hit_ratio": render_cache.hit_ratio,
+        "latency_ms": {
+            step: {"p50": _percentile(samples, 0.5), "p99": _percentile(samples, 0.99), "count": len(samples)}
+            for step, samples in sim.latencies.items()
+        },
+    }
+
+def _measure_in_process(users: int, rounds: int, images: List[bytes], think_time: float) -> dict:
+    return asyncio.run(measure(users, rounds, images, think_time))
+
+def measure_isolated(users: int, rounds: int, images: List[bytes], think_time: float) -> dict:
+    """measure() in a fresh process, so runs don't share caches or peak RSS."""
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(_measure_in_process, users, rounds, images, think_time).result()
+
+def print_result(result: dict) -> None:
+    print(
+        f"users={result['users']:<4d} {result['updates_per_second']:8.1f} updates/s  "
+        f"peak RSS {result['peak_rss_mb']:7.1f} MB  errors {result['errors']}  alerts {result['alerts']}"
+    )
+    print(
+        f"  shared cache hits: downloads {result['download_cache_hit_ratio']:.0%}, "
+        f"renders {result['render_cache_hit_ratio']:.0%}"
+    )
+    print(f"  {'callback':22s} {'p50 ms':>9s} {'p99 ms':>9s} {'count':>7s}")
+    for step, latency in result["latency_ms"].items():
+        print(f"  {step:22s} {latency['p50']:9.1f} {latency['p99']:9.1f} {latency['count']:7d}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[100], help="simulated users, one run each")
+    parser.add_argument("--rounds", type=int, default=1, help="edit sessions per user")
+    parser.add_argument("--images", type=int, default=8, help="distinct photos shared out between users")
+    parser.add_argument("--size", type=int, default=1280, help="long side of the test photos")
+    parser.add_argument("--think", type=float, default=0.2, help="mean seconds between a user's taps")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    images = [sample_jpeg(args.size, seed) for seed in range(args.images)]
+    results = []
+    for users in args.users:
+        result = measure_isolated(users, args.rounds, images, args.think)
+        print_result(result)
+        results.append(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Run the benchmarks, write the results as JSON and compare them with a baseline.
+
+    python bench/run.py                      # full run, compare with bench/baseline.json
+    python bench/run.py --quick              # fewer resolutions and handler runs
+    python bench/run.py --update-baseline    # store this run as the new baseline
+
+Exits with status 1 when any benchmark's median is slower than the baseline
+by more than --tolerance.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import sys
+
+import common  # noqa: F401  (sets up the import path)
+
+import numpy as np
+import PIL
+
+import handlers
+import image_ops
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+def collect(quick: bool) -> dict:
+    results = image_ops.run(image_ops.QUICK_RESOLUTIONS if quick else image_ops.RESOLUTIONS)
+    results.update(asyncio.run(handlers.run(runs=3 if quick else 10)))
+    return {
+        "meta": {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Print a comparison table and return the names of regressed benchmarks."""
+    regressions = []
+    print(f"{'benchmark':44s} {'baseline':>10s} {'current':>10s} {'ratio':>7s}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:44s} {'-':>10s} {result['median_ms']:9.2f}ms {'new':>7s}")
+            continue
+        ratio = result["median_ms"] / base["median_ms"] if base["median_ms"] else 1.0
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:44s} {base['median_ms']:9.2f}ms {result['median_ms']:9.2f}ms {ratio:6.2f}x{flag}")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="fewer resolutions and handler runs")
+    parser.add_argument("--output", default="bench_results.json", help="where to write this run's results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown of the median, e.g. 0.25 = 25%%")
+    parser.add_argument("--update-baseline", action="store_true", help="write this run to --baseline")
+    args = parser.parse_args()
+
+    current = collect(args.quick)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2, sort_keys=True)
+    print(f"Results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than baseline by more than {args.tolerance:.0%}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Webhook throughput versus worker count.
+
+Starts bot/webhook.py against a local fake Bot API for each worker count and
+has simulated users run an edit session each: send a photo, open the
+pixelate menu, step the block size, preview and save. Each user waits
+for the bot's answer before the next tap, like a real one would.
+
+    python bench/webhook_scaling.py --workers 1 2 4 --chats 32
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from common import BOT_DIR, sample_jpeg
+
+import aiohttp
+
+from fake_bot_api import FakeBotAPI
+
+PHOTO_FILE_ID = "load-photo"
+# Saving (the second pixel_preview) returns to the main menu.
+SESSION = ["photo", "menu_pixelate", "pixel_plus", "pixel_preview", "pixel_preview"]
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class LoadClient:
+    """Posts synthetic updates and waits for the bot's answer to each one."""
+
+    def __init__(self, api: FakeBotAPI, webhook_url: str):
+        self.webhook_url = webhook_url
+        self._ids = itertools.count(1)
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self.latencies: List[float] = []
+        api.on_call = self._on_call
+
+    def _on_call(self, method: str, params: Dict[str, str]) -> None:
+        if method == "answerCallbackQuery":
+            key = "cb:" + params["callback_query_id"]
+        elif method == "sendPhoto":
+            key = "photo:" + params["chat_id"]
+        else:
+            return
+        waiter = self._waiters.pop(key, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _update(self, chat_id: int, step: str):
+        user = {"id": chat_id, "is_bot": False, "first_name": "load"}
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": user,
+            "photo": [{"file_id": PHOTO_FILE_ID, "file_unique_id": PHOTO_FILE_ID, "width": 1, "height": 1}],
+        }
+        if step == "photo":
+            return f"photo:{chat_id}", {"update_id": next(self._ids), "message": message}
+        callback_id = str(next(self._ids))
+        callback = {"id": callback_id, "from": user, "chat_instance": "load", "data": step, "message": message}
+        return f"cb:{callback_id}", {"update_id": next(self._ids), "callback_query": callback}
+
+    async def send(self, http: aiohttp.ClientSession, chat_id: int, step: str, timeout: float = 60.0) -> None:
+        key, update = self._update(chat_id, step)
+        waiter = self._waiters[key] = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        async with http.post(self.webhook_url, json=update) as response:
+            response.raise_for_status()
+        await asyncio.wait_for(waiter, timeout)
+        self.latencies.append(time.perf_counter() - started)
+
+    async def run_session(self, http: aiohttp.ClientSession, chat_id: int, steps: List[str]) -> None:
+        for step in steps:
+            await self.send(http, chat_id, step)
+
+async def _wait_for_port(port: int, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+async def measure(workers: int, chats: int, rounds: int, image: bytes) -> dict:
+    api = FakeBotAPI({PHOTO_FILE_ID: image})
+    api_url = await api.start()
+    port = _free_port()
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "42:load",
+        "BOT_API_URL": api_url,
+        "METRICS_PORT": "0",
+        "BLOB_STORE_DIR": tempfile.mkdtemp(prefix="pixelate_webhook_"),
+        # Every chat edits the same photo; measure rendering, not the shared caches.
+        "DOWNLOAD_CACHE_BUDGET": "0",
+        "RENDER_CACHE_BUDGET": "0",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "webhook.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=BOT_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        await _wait_for_port(port)
+        client = LoadClient(api, f"http://127.0.0.1:{port}/webhook")
+        async with aiohttp.ClientSession() as http:
+            # Warm-up: every worker imports, starts its render pool and sees each chat once.
+            await asyncio.gather(*(client.run_session(http, chat_id, SESSION) for chat_id in range(1, chats + 1)))
+            client.latencies.clear()
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                client.run_session(http, chat_id, SESSION * rounds) for chat_id in range(1, chats + 1)
+            ))
+            elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(30)
+        await api.stop()
+
+    latencies = sorted(client.latencies)
+    return {
+        "workers": workers,
+        "updates": len(latencies),
+        "seconds": elapsed,
+        "updates_per_second": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+async def main_async(args) -> List[dict]:
+    image = sample_jpeg(args.size)
+    results = []
+    for workers in args.workers:
+        result = await measure(workers, args.chats, args.rounds, image)
+        results.append(result)
+        print(
+            f"workers={workers:<3d} {result['updates_per_second']:8.1f} updates/s  "
+            f"p50 {result['p50_ms']:7.1f}ms  p99 {result['p99_ms']:7.1f}ms"
+        )
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chats", type=int, default=32, help="simulated users")
+    parser.add_argument("--rounds", type=int, default=3, help="edit sessions per user")
+    parser.add_argument("--size", type=int, default=1280, help="long side of the test photo")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+    results = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,168 @@
 import asyncio
 import logging
+import os
 import sys
+from typing import Optional
 
-from config import BOT_TOKEN
+from controllers.album_controller import album_router
 from controllers.menu_controller import menu_router
 from controllers.pixelate_controller import pixelate_router
 from controllers.brightness_controller import brightness_router
 from controllers.contrast_controller import contrast_router
+from middlewares import register_before_fsm
+from middlewares.album import AlbumMiddleware
+from middlewares.metrics import MetricsMiddleware
+from middlewares.outbound import OutboundRequestMiddleware
+from middlewares.tap_coalescing import TapCoalescingMiddleware
+from services.blob_store import blob_store
+from services.metrics import registry, start_metrics_server
+from services.preview_cache import PreviewCache
+from services.render_jobs import cache_salt
+from services.render_scheduler import RenderScheduler
+from services.render_service import RenderService
+from services.session_storage import SpillingMemoryStorage
+from services.shared_cache import download_cache, render_cache
+import settings
 
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import Message
 from aiogram.filters import CommandStart
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.memory import SimpleEventIsolation
 
-async def main() -> None:
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+# Preview/Save/Compare taps, contact sheet picks and album steps: a newer one
+# supersedes the render of an older one
+PREVIEW_CALLBACKS = {
+    "pixel_preview", "brightness_preview", "contrast_preview",
+    "pixel_compare", "brightness_compare", "contrast_compare",
+    "pixel_pick", "brightness_pick", "contrast_pick",
+    "album_pixel_plus", "album_pixel_minus", "album_brightness_plus", "album_brightness_minus",
+    "album_contrast_plus", "album_contrast_minus", "album_reset",
+}
+# +/- and option taps: their caption edits are debounced
+STEP_CALLBACKS = {
+    "pixel_plus", "pixel_minus", "pixel_colors", "pixel_dither", "pixel_bw",
+    "brightness_plus", "brightness_minus",
+    "contrast_plus", "contrast_minus",
+}
+
+def create_bot(processes: int = 1) -> Bot:
+    """
+    Bot for BOT_TOKEN (from the environment or config.py) on the configured API
+    server. All requests share one connection pool and are paced to
+    Telegram's flood limits; with several processes sending for the same
+    token, e.g. webhook workers, each gets an equal share of the global limit.
+    """
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        from config import BOT_TOKEN as token
+    session = AiohttpSession(limit=settings.BOT_API_CONNECTIONS)
+    if settings.BOT_API_URL:
+        session.api = TelegramAPIServer.from_base(settings.BOT_API_URL)
+    session.middleware(OutboundRequestMiddleware(
+        chat_rate=settings.OUTBOUND_CHAT_RATE,
+        chat_burst=settings.OUTBOUND_CHAT_BURST,
+        global_rate=settings.OUTBOUND_GLOBAL_RATE / processes,
+        global_burst=max(1.0, settings.OUTBOUND_GLOBAL_BURST / processes),
+        max_retries=settings.OUTBOUND_MAX_RETRIES,
+    ))
+    return Bot(token=token, session=session)
+
+def create_dispatcher(render_workers: Optional[int] = None) -> Dispatcher:
+    """
+    Dispatcher with all routers, middlewares and shared services wired in.
+    render_workers overrides settings.RENDER_WORKERS, e.g. to split the cores
+    between several webhook worker processes.
+    """
+    render_workers = render_workers or settings.RENDER_WORKERS
+    storage = SpillingMemoryStorage(
+        blob_store,
+        directory=os.path.join(blob_store.directory, "sessions"),
+        idle_ttl=settings.SESSION_IDLE_TTL,
+        session_quota=settings.SESSION_MEMORY_QUOTA,
+        memory_budget=settings.SESSION_MEMORY_BUDGET,
+        sweep_interval=settings.SESSION_SWEEP_INTERVAL,
+    )
+    # Updates from the same chat are handled one at a time.
+    dp = Dispatcher(storage=storage, events_isolation=SimpleEventIsolation())
+    # Sessions don't survive a restart: drop those an earlier run spilled and
+    # let the blobs it left behind expire.
+    dp.startup.register(storage.clear_spilled)
+    dp.startup.register(blob_store.adopt_orphans)
+    dp.shutdown.register(blob_store.flush)
+    for cache in (download_cache, render_cache):
+        dp.startup.register(cache.load)
+        dp.shutdown.register(cache.flush)
+    # Before menu_router, whose photo handler would take album photos too
+    dp.include_router(album_router)
     dp.include_router(menu_router)
     dp.include_router(pixelate_router)
     dp.include_router(brightness_router)
     dp.include_router(contrast_router)
+
+    render_service = RenderService(
+        max_workers=render_workers,
+        use_processes=settings.RENDER_USE_PROCESSES,
+        default_timeout=settings.RENDER_TIMEOUT,
+    )
+    render_service.start()
+    render_scheduler = RenderScheduler(
+        render_service,
+        concurrency=render_workers,
+        max_queue_depth=settings.RENDER_MAX_QUEUE_DEPTH,
+        # Identical renders, from any chat, are served from disk.
+        cache=render_cache,
+        cache_salt=cache_salt(),
+    )
+    # Injected into handlers as the `render_scheduler` argument.
+    dp["render_scheduler"] = render_scheduler
+    dp.shutdown.register(render_scheduler.shutdown)
+    dp.shutdown.register(render_service.shutdown)
+    preview_cache = PreviewCache(
+        session_budget=settings.PREVIEW_CACHE_SESSION_BUDGET,
+        total_budget=settings.PREVIEW_CACHE_TOTAL_BUDGET,
+    )
+    dp["preview_cache"] = preview_cache
+    # A spilled session's previews would only be found again by chance.
+    storage.on_spill.append(lambda key: preview_cache.drop_session(key.chat_id))
+
+    registry.gauge("pixelate_bot_render_queue_depth", "Render jobs waiting for a slot", lambda: render_scheduler.queue_depth)
+    registry.gauge("pixelate_bot_renders_running", "Render jobs running", lambda: render_scheduler.running)
+    registry.gauge("pixelate_bot_preview_cache_bytes", "Bytes of cached previews", lambda: preview_cache.nbytes)
+    registry.gauge("pixelate_bot_blob_memory_bytes", "Bytes of images in the blob store memory tier", lambda: blob_store.memory_bytes)
+    registry.gauge("pixelate_bot_sessions_resident", "FSM sessions held in memory", lambda: storage.resident_sessions)
+    registry.gauge("pixelate_bot_sessions_spilled", "FSM sessions spilled to disk", lambda: storage.spilled_sessions)
+    registry.gauge("pixelate_bot_session_memory_bytes", "Bytes of images in memory held by sessions", lambda: storage.memory_bytes)
+    registry.gauge(
+        "pixelate_bot_session_memory_max_bytes", "Bytes of images in memory held by the largest session",
+        lambda: storage.stats()["largest_session_bytes"],
+    )
+    registry.gauge("pixelate_bot_download_cache_hit_ratio", "Share of downloads served from the shared cache", lambda: download_cache.hit_ratio)
+    registry.gauge("pixelate_bot_download_cache_bytes", "Bytes of downloads in the shared cache", lambda: download_cache.nbytes)
+    registry.gauge("pixelate_bot_render_cache_hit_ratio", "Share of render jobs served from the shared cache", lambda: render_cache.hit_ratio)
+    registry.gauge("pixelate_bot_render_cache_bytes", "Bytes of render results in the shared cache", lambda: render_cache.nbytes)
+
+    register_before_fsm(dp, [
+        # Times the whole update, including the wait for the chat's lock
+        MetricsMiddleware(),
+        # Holds an album's first photo without locking the chat, drops the rest
+        AlbumMiddleware(settings.ALBUM_COLLECT_DELAY),
+        # Supersedes stale renders before the tap queues on the chat's lock
+        TapCoalescingMiddleware(
+            cancellable_data=PREVIEW_CALLBACKS,
+            debounced_data=STEP_CALLBACKS,
+            debounce_delay=settings.CAPTION_DEBOUNCE_DELAY,
+        ),
+    ])
+    return dp
+
+async def main() -> None:
+    bot = create_bot()
+    dp = create_dispatcher()
+    if settings.METRICS_PORT:
+        metrics_runner = await start_metrics_server(settings.METRICS_HOST, settings.METRICS_PORT)
+        dp.shutdown.register(metrics_runner.cleanup)
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+import logging
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from aiogram.types import CallbackQuery, Message
+
+from middlewares.tap_coalescing import SupersededError
+from services.render_jobs import render_display
+from services.render_scheduler import BUSY_MESSAGE, Priority, RenderScheduler, SchedulerBusyError
+from services.render_service import RenderTimeoutError
+from utils.file_utils import fits_photo
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_MESSAGE = "Rendering took too long, please try again."
+
+# Bounds of each setting, shared by the single-image and album menus. The
+# contrast menu's +/- are not bounded; its Compare window and the album are.
+PIXEL_SIZE_RANGE = (1, 40)
+BRIGHTNESS_RANGE = (-255, 255)
+CONTRAST_RANGE = (-100, 200)
+
+def clamp(value: int, bounds: Tuple[int, int]) -> int:
+    low, high = bounds
+    return max(low, min(high, value))
+
+def picked_value(callback_data: str) -> Optional[int]:
+    """The value of a contact sheet button, "<prefix>_pick:<value>", or None if malformed."""
+    try:
+        return int(callback_data.split(":", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+async def display_image(chat_id: int, image_bytes: bytes, render_scheduler: RenderScheduler) -> bytes:
+    """image_bytes, or a reduced copy if they are too big to show as a photo."""
+    if fits_photo(image_bytes):
+        return image_bytes
+    return await render_scheduler.submit(chat_id, Priority.SAVE, render_display, image_bytes)
+
+async def _answer(event: Any, text: Optional[str] = None) -> None:
+    if isinstance(event, Message):
+        if text:
+            await event.answer(text)
+    else:
+        await event.answer(text, show_alert=bool(text))
+
+def answers_render_errors(handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Answer the callback or message when a render the handler awaits fails:
+    timeouts and a full scheduler get an alert, superseded taps a silent
+    answer. Apply below the router decorator; aiogram reads the handler's own
+    signature.
+    """
+    @wraps(handler)
+    async def wrapper(event: Any, *args: Any, **kwargs: Any) -> Any:
+        chat_id = event.chat.id if isinstance(event, Message) else event.message.chat.id
+        try:
+            return await handler(event, *args, **kwargs)
+        except RenderTimeoutError:
+            logger.warning("Render timed out in %s for chat %s", handler.__name__, chat_id)
+            await _answer(event, TIMEOUT_MESSAGE)
+        except SupersededError:
+            await _answer(event)
+        except SchedulerBusyError:
+            logger.info("Scheduler busy in %s for chat %s", handler.__name__, chat_id)
+            await _answer(event, BUSY_MESSAGE)
+    return wrapper
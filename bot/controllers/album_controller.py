@@ -0,0 +1,143 @@
+import asyncio
+from typing import Optional
+
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery
+from aiogram.fsm.context import FSMContext
+
+from controllers import BRIGHTNESS_RANGE, CONTRAST_RANGE, PIXEL_SIZE_RANGE, answers_render_errors, clamp
+from middlewares.album import Album
+from middlewares.tap_coalescing import RenderTicket
+from models.states import BotStates
+from models.user_data import UserData
+from utils.file_utils import download_photo_to_bytes, edit_photo_from_bytes, send_album_from_bytes, send_photo_from_bytes
+from utils.state_utils import load_user_data, save_user_data
+from views.keyboards import album_menu_keyboard
+from views.messages import album_menu_caption
+from services.render_jobs import render_pipeline, render_preview
+from services.render_scheduler import Priority, RenderScheduler
+
+album_router = Router(name="album_router")
+
+# callback -> (op, step); a step on the op applied last adjusts it instead of
+# stacking another one
+ALBUM_STEPS = {
+    "album_pixel_plus": ("pixelate", 2),
+    "album_pixel_minus": ("pixelate", -2),
+    "album_brightness_plus": ("brightness", 10),
+    "album_brightness_minus": ("brightness", -10),
+    "album_contrast_plus": ("contrast", 10),
+    "album_contrast_minus": ("contrast", -10),
+}
+
+# (param, start value, bounds) per op; the bounds are the single-image menus',
+# for contrast its Compare window's
+_OP_RANGES = {
+    "pixelate": ("block_size", 1, PIXEL_SIZE_RANGE),
+    "brightness": ("value", 0, BRIGHTNESS_RANGE),
+    "contrast": ("value", 0, CONTRAST_RANGE),
+}
+
+def _step_ops(ops: list, name: str, step: int) -> list:
+    param, start, bounds = _OP_RANGES[name]
+    if ops and ops[-1][0] == name:
+        ops, value = ops[:-1], ops[-1][1][param]
+    else:
+        value = start
+    value = clamp(value + step, bounds)
+    return ops + [[name, {param: value}]] if value != start else ops
+
+async def _render_album(chat_id: int, user_data: UserData, render_scheduler: RenderScheduler) -> list:
+    """
+    Render every album photo from its original, in parallel on all of the
+    scheduler's render slots: the album takes about as long as its slowest
+    photo when it has no more photos than slots. Holding no more jobs than
+    there are slots keeps a large album from filling the render queue. The
+    first failure cancels the renders still queued or waiting.
+    """
+    slots = asyncio.Semaphore(render_scheduler.concurrency)
+
+    async def render(source: bytes, ops: list) -> bytes:
+        async with slots:
+            return await render_scheduler.submit(chat_id, Priority.SAVE, render_pipeline, source, ops)
+
+    await user_data.prefetch(user_data.album_keys)
+    tasks = [asyncio.ensure_future(render(source, ops)) for source, ops in user_data.album_plan()]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@album_router.message(F.photo, F.media_group_id)
+async def handle_album(message: Message, state: FSMContext, album: Optional[Album] = None):
+    user_data = await load_user_data(state)
+    if album is not None:
+        images = await album.images()
+    else:
+        images = [await download_photo_to_bytes(message)]
+    user_data.reset_album(images)
+    await save_user_data(state, user_data)
+
+    # The menu shows the first photo; edits are previewed on it in place.
+    await send_photo_from_bytes(
+        message,
+        images[0],
+        caption=album_menu_caption(len(images), user_data.album_ops),
+        reply_markup=album_menu_keyboard(has_edits=False),
+    )
+    await state.set_state(BotStates.ALBUM_MENU)
+
+@album_router.callback_query(F.data.in_(ALBUM_STEPS.keys() | {"album_reset"}), BotStates.ALBUM_MENU)
+@answers_render_errors
+async def album_step_callback(
+    callback: CallbackQuery, state: FSMContext, render_scheduler: RenderScheduler, render_ticket: RenderTicket
+):
+    user_data = await load_user_data(state)
+    if not user_data.album_keys:
+        await callback.answer("Send an album to edit first.", show_alert=True)
+        return
+    if callback.data == "album_reset":
+        ops = []
+    else:
+        ops = _step_ops(user_data.album_ops, *ALBUM_STEPS[callback.data])
+    if ops == user_data.album_ops:
+        await callback.answer("Nothing to change.")
+        return
+    user_data.album_ops = ops
+    # Saved first: a newer tap supersedes this preview but builds on these ops.
+    await save_user_data(state, user_data)
+
+    await user_data.prefetch(user_data.album_keys[:1])
+    [(source, ops)] = user_data.album_plan(photos=1)
+    preview = await render_ticket.run(render_scheduler.submit(
+        callback.message.chat.id, Priority.PREVIEW, render_preview, source, ops
+    ))
+    await edit_photo_from_bytes(
+        callback.message,
+        preview,
+        caption=album_menu_caption(len(user_data.album_keys), user_data.album_ops),
+        reply_markup=album_menu_keyboard(has_edits=bool(user_data.album_ops)),
+        filename="preview.jpg",
+    )
+    await callback.answer()
+
+@album_router.callback_query(F.data == "album_save", BotStates.ALBUM_MENU)
+@answers_render_errors
+async def album_save_callback(callback: CallbackQuery, state: FSMContext, render_scheduler: RenderScheduler):
+    user_data = await load_user_data(state)
+    if not user_data.album_keys:
+        await callback.answer("Send an album to edit first.", show_alert=True)
+        return
+    images = await _render_album(callback.message.chat.id, user_data, render_scheduler)
+    await callback.answer()
+
+    await send_album_from_bytes(callback.message, images)
+    # A fresh menu below the album; the old one would scroll away.
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await send_photo_from_bytes(
+        callback.message,
+        images[0],
+        caption=album_menu_caption(len(images), user_data.album_ops),
+        reply_markup=album_menu_keyboard(has_edits=bool(user_data.album_ops)),
+    )
@@ -1,18 +1,39 @@
 import io
+from functools import partial
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, InputMediaPhoto, FSInputFile, BufferedInputFile
+from aiogram.types import CallbackQuery, FSInputFile
 from aiogram.fsm.context import FSMContext
 
+from controllers import BRIGHTNESS_RANGE, answers_render_errors, clamp, display_image, picked_value
+from middlewares.tap_coalescing import CaptionDebouncer, RenderTicket
 from models.states import BotStates
+from models.user_data import UserData
+from utils.file_utils import edit_photo_from_bytes
 from utils.state_utils import load_user_data, save_user_data
-from views.keyboards import brightness_menu_keyboard, main_menu_keyboard
-from views.messages import brightness_menu_caption, main_menu_caption
-from services.image_utils import decode_jpg_to_array, encode_array_to_jpg, apply_brightness
+from views.keyboards import compare_keyboard, brightness_menu_keyboard, main_menu_keyboard
+from views.messages import compare_caption, brightness_menu_caption, main_menu_caption
+from services.preview_cache import PreviewCache
+from services.contact_sheet import value_window
+from services.render_jobs import render_contact_sheet, render_pipeline
+from services.render_scheduler import Priority, RenderScheduler
+import settings
 
 brightness_router = Router(name="brightness_router")
 
+def _brightness_op(brightness_value: int) -> list:
+    return ["brightness", {"value": brightness_value}]
+
+def _prefetch_neighbours(callback: CallbackQuery, user_data: UserData, preview_cache: PreviewCache, render_scheduler: RenderScheduler):
+    """Warm the preview cache for the current value and one step either way."""
+    values = dict.fromkeys((user_data.brightness_value, clamp(user_data.brightness_value + 10, BRIGHTNESS_RANGE), clamp(user_data.brightness_value - 10, BRIGHTNESS_RANGE)))
+    preview_cache.prefetch(
+        callback.message.chat.id, user_data, [_brightness_op(v) for v in values], render_scheduler
+    )
+
 @brightness_router.callback_query(F.data == "menu_brightness", BotStates.MAIN_MENU)
-async def open_brightness_menu(callback: CallbackQuery, state: FSMContext):
+async def open_brightness_menu(
+    callback: CallbackQuery, state: FSMContext, preview_cache: PreviewCache, render_scheduler: RenderScheduler
+):
     user_data = await load_user_data(state)
     user_data.brightness_preview_stage = 0
     user_data.preview_image_data = None
@@ -25,36 +46,67 @@ async def open_brightness_menu(callback: CallbackQuery, state: FSMContext):
     )
 
     await state.set_state(BotStates.BRIGHTNESS_MENU)
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
     await callback.answer()
 
 @brightness_router.callback_query(F.data == "brightness_plus", BotStates.BRIGHTNESS_MENU)
-async def brightness_plus_callback(callback: CallbackQuery, state: FSMContext):
+async def brightness_plus_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+):
     user_data = await load_user_data(state)
-    user_data.brightness_value = min(255, user_data.brightness_value + 10)
+    user_data.brightness_value = clamp(user_data.brightness_value + 10, BRIGHTNESS_RANGE)
     user_data.brightness_preview_stage = 0
     await save_user_data(state, user_data)
 
-    await callback.message.edit_caption(
-        caption=f"Brightness: {user_data.brightness_value} (unsaved). Press Preview.",
-        reply_markup=brightness_menu_keyboard(preview_stage=0)
+    # Rapid taps collapse into a single caption edit.
+    caption_debouncer.schedule(
+        callback.message.chat.id,
+        partial(
+            callback.message.edit_caption,
+            caption=f"Brightness: {user_data.brightness_value} (unsaved). Press Preview.",
+            reply_markup=brightness_menu_keyboard(preview_stage=0)
+        )
     )
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
     await callback.answer()
 
 @brightness_router.callback_query(F.data == "brightness_minus", BotStates.BRIGHTNESS_MENU)
-async def brightness_minus_callback(callback: CallbackQuery, state: FSMContext):
+async def brightness_minus_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+):
     user_data = await load_user_data(state)
-    user_data.brightness_value = max(-255, user_data.brightness_value - 10)
+    user_data.brightness_value = clamp(user_data.brightness_value - 10, BRIGHTNESS_RANGE)
     user_data.brightness_preview_stage = 0
     await save_user_data(state, user_data)
 
-    await callback.message.edit_caption(
-        caption=f"Brightness: {user_data.brightness_value} (unsaved). Press Preview.",
-        reply_markup=brightness_menu_keyboard(preview_stage=0)
+    caption_debouncer.schedule(
+        callback.message.chat.id,
+        partial(
+            callback.message.edit_caption,
+            caption=f"Brightness: {user_data.brightness_value} (unsaved). Press Preview.",
+            reply_markup=brightness_menu_keyboard(preview_stage=0)
+        )
     )
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
     await callback.answer()
 
 @brightness_router.callback_query(F.data == "brightness_preview", BotStates.BRIGHTNESS_MENU)
-async def brightness_preview_callback(callback: CallbackQuery, state: FSMContext):
+@answers_render_errors
+async def brightness_preview_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    render_ticket: RenderTicket,
+):
     user_data = await load_user_data(state)
 
     if user_data.brightness_preview_stage == 0:
@@ -62,21 +114,20 @@ async def brightness_preview_callback(callback: CallbackQuery, state: FSMContext
             await callback.answer("No current image found.", show_alert=True)
             return
         
-        width, height, arr = decode_jpg_to_array(user_data.current_image_data)
-        new_arr = apply_brightness(arr, user_data.brightness_value)
-        preview_img = encode_array_to_jpg(width, height, new_arr)
+        preview_img = await render_ticket.run(preview_cache.render(
+            callback.message.chat.id, user_data, _brightness_op(user_data.brightness_value), render_scheduler
+        ))
 
         user_data.preview_image_data = preview_img
         user_data.brightness_preview_stage = 1
         await save_user_data(state, user_data)
 
-        input_file = BufferedInputFile(preview_img, filename="preview.jpg")
-        await callback.message.edit_media(
-            media=InputMediaPhoto(
-                media=input_file,
-                caption=f"Brightness: {user_data.brightness_value} (preview)"
-            ),
-            reply_markup=brightness_menu_keyboard(preview_stage=1)
+        await edit_photo_from_bytes(
+            callback.message,
+            preview_img,
+            caption=f"Brightness: {user_data.brightness_value} (preview)",
+            reply_markup=brightness_menu_keyboard(preview_stage=1),
+            filename="preview.jpg"
         )
         await callback.answer()
 
@@ -86,7 +137,12 @@ async def brightness_preview_callback(callback: CallbackQuery, state: FSMContext
             await callback.answer("No preview image found.", show_alert=True)
             return
 
-        user_data.push_undo_data(preview_img)
+        # The preview was rendered on a proxy; render the full image now.
+        source, ops = user_data.render_plan(_brightness_op(user_data.brightness_value))
+        new_img = await render_ticket.run(render_scheduler.submit(
+            callback.message.chat.id, Priority.SAVE, render_pipeline, source, ops
+        ))
+        user_data.push_undo_data(new_img, _brightness_op(user_data.brightness_value))
 
         user_data.brightness_value = 0
         user_data.brightness_preview_stage = 0
@@ -94,32 +150,88 @@ async def brightness_preview_callback(callback: CallbackQuery, state: FSMContext
 
         await save_user_data(state, user_data)
 
-        can_undo = len(user_data.undo_stack) > 0
-        can_redo = len(user_data.redo_stack) > 0
-        new_file = BufferedInputFile(user_data.current_image_data, filename="edited.jpg")
+        can_undo = user_data.can_undo
+        can_redo = user_data.can_redo
 
-        await callback.message.edit_media(
-            media=InputMediaPhoto(media=new_file, caption=main_menu_caption()),
+        shown = await display_image(callback.message.chat.id, user_data.current_image_data, render_scheduler)
+        await edit_photo_from_bytes(
+            callback.message,
+            shown,
+            caption=main_menu_caption(),
             reply_markup=main_menu_keyboard(can_undo, can_redo)
         )
         await state.set_state(BotStates.MAIN_MENU)
         await callback.answer()
 
+@brightness_router.callback_query(F.data == "brightness_compare", BotStates.BRIGHTNESS_MENU)
+@answers_render_errors
+async def brightness_compare_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    render_scheduler: RenderScheduler,
+    render_ticket: RenderTicket,
+):
+    """Show values around the current one side by side, one upload for all of them."""
+    user_data = await load_user_data(state)
+    if not user_data.current_image_data:
+        await callback.answer("No current image found.", show_alert=True)
+        return
+    values = value_window(user_data.brightness_value, 20, *BRIGHTNESS_RANGE, settings.COMPARE_CELLS)
+    source, ops = user_data.render_plan()
+    sheet = await render_ticket.run(render_scheduler.submit(
+        callback.message.chat.id, Priority.PREVIEW, render_contact_sheet,
+        source, ops, [_brightness_op(v) for v in values], [str(i + 1) for i in range(len(values))]
+    ))
+
+    user_data.brightness_preview_stage = 0
+    user_data.preview_image_data = None
+    await save_user_data(state, user_data)
+
+    await edit_photo_from_bytes(
+        callback.message,
+        sheet,
+        caption=compare_caption("Brightness", values),
+        reply_markup=compare_keyboard("brightness", values),
+        filename="compare.jpg"
+    )
+    await callback.answer()
+
+@brightness_router.callback_query(F.data.startswith("brightness_pick:"), BotStates.BRIGHTNESS_MENU)
+async def brightness_pick_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    render_ticket: RenderTicket,
+):
+    """A contact sheet cell was picked: preview that value as if reached with +/-."""
+    value = picked_value(callback.data)
+    if value is None:
+        await callback.answer("Nothing to change.")
+        return
+    user_data = await load_user_data(state)
+    user_data.brightness_value = clamp(value, BRIGHTNESS_RANGE)
+    user_data.brightness_preview_stage = 0
+    await save_user_data(state, user_data)
+    await brightness_preview_callback(callback, state, preview_cache, render_scheduler, render_ticket)
+
 @brightness_router.callback_query(F.data == "brightness_back_to_main", BotStates.BRIGHTNESS_MENU)
-async def brightness_back_to_main_callback(callback: CallbackQuery, state: FSMContext):
+@answers_render_errors
+async def brightness_back_to_main_callback(callback: CallbackQuery, state: FSMContext, render_scheduler: RenderScheduler):
     user_data = await load_user_data(state)
     user_data.brightness_value = 0
     user_data.brightness_preview_stage = 0
     user_data.preview_image_data = None
     await save_user_data(state, user_data)
 
-    raw_data = user_data.current_image_data
-    new_file = BufferedInputFile(raw_data, filename="edited.jpg")
-    can_undo = len(user_data.undo_stack) > 0
-    can_redo = len(user_data.redo_stack) > 0
+    raw_data = await display_image(callback.message.chat.id, user_data.current_image_data, render_scheduler)
+    can_undo = user_data.can_undo
+    can_redo = user_data.can_redo
 
-    await callback.message.edit_media(
-        media=InputMediaPhoto(media=new_file, caption=main_menu_caption()),
+    await edit_photo_from_bytes(
+        callback.message,
+        raw_data,
+        caption=main_menu_caption(),
         reply_markup=main_menu_keyboard(can_undo, can_redo)
     )
     await state.set_state(BotStates.MAIN_MENU)
@@ -1,25 +1,40 @@
 import logging
+from functools import partial
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 
+from controllers import CONTRAST_RANGE, answers_render_errors, clamp, display_image, picked_value
+from middlewares.tap_coalescing import CaptionDebouncer, RenderTicket
 from models.states import BotStates
 from models.user_data import UserData
+from utils.file_utils import edit_photo_from_bytes
 from utils.state_utils import load_user_data, save_user_data
-from views.keyboards import contrast_menu_keyboard, main_menu_keyboard
-from views.messages import main_menu_caption
+from views.keyboards import compare_keyboard, contrast_menu_keyboard, main_menu_keyboard
+from views.messages import compare_caption, main_menu_caption
 
-from services.image_utils import (
-    decode_jpg_to_array,
-    encode_array_to_jpg,
-    apply_contrast
-)
-from aiogram.types import InputMediaPhoto, BufferedInputFile
+from services.preview_cache import PreviewCache
+from services.contact_sheet import value_window
+from services.render_jobs import render_contact_sheet, render_pipeline
+from services.render_scheduler import Priority, RenderScheduler
+import settings
 
 contrast_router = Router(name="contrast_router")
 
+def _contrast_op(contrast_value: int) -> list:
+    return ["contrast", {"value": contrast_value}]
+
+def _prefetch_neighbours(callback: CallbackQuery, user_data: UserData, preview_cache: PreviewCache, render_scheduler: RenderScheduler):
+    """Warm the preview cache for the current value and one step either way."""
+    values = dict.fromkeys((user_data.contrast_value, user_data.contrast_value + 10, user_data.contrast_value - 10))
+    preview_cache.prefetch(
+        callback.message.chat.id, user_data, [_contrast_op(v) for v in values], render_scheduler
+    )
+
 @contrast_router.callback_query(F.data == "menu_contrast", BotStates.MAIN_MENU)
-async def open_contrast_menu(callback: CallbackQuery, state: FSMContext):
+async def open_contrast_menu(
+    callback: CallbackQuery, state: FSMContext, preview_cache: PreviewCache, render_scheduler: RenderScheduler
+):
     """
     Open contrast menu from the main menu.
     """
@@ -33,10 +48,17 @@ async def open_contrast_menu(callback: CallbackQuery, state: FSMContext):
     )
 
     await state.set_state(BotStates.CONTRAST_MENU)
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
     await callback.answer()
 
 @contrast_router.callback_query(F.data == "contrast_plus", BotStates.CONTRAST_MENU)
-async def contrast_plus_callback(callback: CallbackQuery, state: FSMContext):
+async def contrast_plus_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+):
     """
     Increase contrast (by +10, for example).
     """
@@ -45,14 +67,26 @@ async def contrast_plus_callback(callback: CallbackQuery, state: FSMContext):
     user_data.contrast_preview_stage = 0
     await save_user_data(state, user_data)
 
-    await callback.message.edit_caption(
-        caption=f"Contrast: {user_data.contrast_value} (unsaved). Press Preview.",
-        reply_markup=contrast_menu_keyboard(preview_stage=0)
+    # Rapid taps collapse into a single caption edit.
+    caption_debouncer.schedule(
+        callback.message.chat.id,
+        partial(
+            callback.message.edit_caption,
+            caption=f"Contrast: {user_data.contrast_value} (unsaved). Press Preview.",
+            reply_markup=contrast_menu_keyboard(preview_stage=0)
+        )
     )
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
     await callback.answer()
 
 @contrast_router.callback_query(F.data == "contrast_minus", BotStates.CONTRAST_MENU)
-async def contrast_minus_callback(callback: CallbackQuery, state: FSMContext):
+async def contrast_minus_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+):
     """
     Decrease contrast (by -10, for example).
     """
@@ -61,14 +95,26 @@ async def contrast_minus_callback(callback: CallbackQuery, state: FSMContext):
     user_data.contrast_preview_stage = 0
     await save_user_data(state, user_data)
 
-    await callback.message.edit_caption(
-        caption=f"Contrast: {user_data.contrast_value} (unsaved). Press Preview.",
-        reply_markup=contrast_menu_keyboard(preview_stage=0)
+    caption_debouncer.schedule(
+        callback.message.chat.id,
+        partial(
+            callback.message.edit_caption,
+            caption=f"Contrast: {user_data.contrast_value} (unsaved). Press Preview.",
+            reply_markup=contrast_menu_keyboard(preview_stage=0)
+        )
     )
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
     await callback.answer()
 
 @contrast_router.callback_query(F.data == "contrast_preview", BotStates.CONTRAST_MENU)
-async def contrast_preview_callback(callback: CallbackQuery, state: FSMContext):
+@answers_render_errors
+async def contrast_preview_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    render_ticket: RenderTicket,
+):
     """
     Preview -> Save toggle for contrast.
     """
@@ -79,21 +125,20 @@ async def contrast_preview_callback(callback: CallbackQuery, state: FSMContext):
             await callback.answer("No current image found.", show_alert=True)
             return
         
-        width, height, arr = decode_jpg_to_array(user_data.current_image_data)
-        arr2 = apply_contrast(arr, user_data.contrast_value)
-        preview_img = encode_array_to_jpg(width, height, arr2)
+        preview_img = await render_ticket.run(preview_cache.render(
+            callback.message.chat.id, user_data, _contrast_op(user_data.contrast_value), render_scheduler
+        ))
 
         user_data.preview_image_data = preview_img
         user_data.contrast_preview_stage = 1
         await save_user_data(state, user_data)
 
-        input_file = BufferedInputFile(preview_img, filename="preview.jpg")
-        await callback.message.edit_media(
-            media=InputMediaPhoto(
-                media=input_file,
-                caption=f"Contrast: {user_data.contrast_value} (preview)"
-            ),
-            reply_markup=contrast_menu_keyboard(preview_stage=1)
+        await edit_photo_from_bytes(
+            callback.message,
+            preview_img,
+            caption=f"Contrast: {user_data.contrast_value} (preview)",
+            reply_markup=contrast_menu_keyboard(preview_stage=1),
+            filename="preview.jpg"
         )
         await callback.answer()
     else:
@@ -102,26 +147,86 @@ async def contrast_preview_callback(callback: CallbackQuery, state: FSMContext):
             await callback.answer("No preview image found.", show_alert=True)
             return
 
-        user_data.push_undo_data(preview_img)
+        # The preview was rendered on a proxy; render the full image now.
+        source, ops = user_data.render_plan(_contrast_op(user_data.contrast_value))
+        new_img = await render_ticket.run(render_scheduler.submit(
+            callback.message.chat.id, Priority.SAVE, render_pipeline, source, ops
+        ))
+        user_data.push_undo_data(new_img, _contrast_op(user_data.contrast_value))
         user_data.contrast_value = 0
         user_data.contrast_preview_stage = 0
         user_data.preview_image_data = None
 
         await save_user_data(state, user_data)
 
-        can_undo = len(user_data.undo_stack) > 0
-        can_redo = len(user_data.redo_stack) > 0
-        new_file = BufferedInputFile(user_data.current_image_data, filename="edited.jpg")
+        can_undo = user_data.can_undo
+        can_redo = user_data.can_redo
 
-        await callback.message.edit_media(
-            media=InputMediaPhoto(media=new_file, caption=main_menu_caption()),
+        shown = await display_image(callback.message.chat.id, user_data.current_image_data, render_scheduler)
+        await edit_photo_from_bytes(
+            callback.message,
+            shown,
+            caption=main_menu_caption(),
             reply_markup=main_menu_keyboard(can_undo, can_redo)
         )
         await state.set_state(BotStates.MAIN_MENU)
         await callback.answer()
 
+@contrast_router.callback_query(F.data == "contrast_compare", BotStates.CONTRAST_MENU)
+@answers_render_errors
+async def contrast_compare_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    render_scheduler: RenderScheduler,
+    render_ticket: RenderTicket,
+):
+    """Show values around the current one side by side, one upload for all of them."""
+    user_data = await load_user_data(state)
+    if not user_data.current_image_data:
+        await callback.answer("No current image found.", show_alert=True)
+        return
+    values = value_window(user_data.contrast_value, 20, *CONTRAST_RANGE, settings.COMPARE_CELLS)
+    source, ops = user_data.render_plan()
+    sheet = await render_ticket.run(render_scheduler.submit(
+        callback.message.chat.id, Priority.PREVIEW, render_contact_sheet,
+        source, ops, [_contrast_op(v) for v in values], [str(i + 1) for i in range(len(values))]
+    ))
+
+    user_data.contrast_preview_stage = 0
+    user_data.preview_image_data = None
+    await save_user_data(state, user_data)
+
+    await edit_photo_from_bytes(
+        callback.message,
+        sheet,
+        caption=compare_caption("Contrast", values),
+        reply_markup=compare_keyboard("contrast", values),
+        filename="compare.jpg"
+    )
+    await callback.answer()
+
+@contrast_router.callback_query(F.data.startswith("contrast_pick:"), BotStates.CONTRAST_MENU)
+async def contrast_pick_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    render_ticket: RenderTicket,
+):
+    """A contact sheet cell was picked: preview that value as if reached with +/-."""
+    value = picked_value(callback.data)
+    if value is None:
+        await callback.answer("Nothing to change.")
+        return
+    user_data = await load_user_data(state)
+    user_data.contrast_value = clamp(value, CONTRAST_RANGE)
+    user_data.contrast_preview_stage = 0
+    await save_user_data(state, user_data)
+    await contrast_preview_callback(callback, state, preview_cache, render_scheduler, render_ticket)
+
 @contrast_router.callback_query(F.data == "contrast_back_to_main", BotStates.CONTRAST_MENU)
-async def contrast_back_to_main_callback(callback: CallbackQuery, state: FSMContext):
+@answers_render_errors
+async def contrast_back_to_main_callback(callback: CallbackQuery, state: FSMContext, render_scheduler: RenderScheduler):
     """
     Discard any preview changes.
     """
@@ -131,12 +236,14 @@ async def contrast_back_to_main_callback(callback: CallbackQuery, state: FSMCont
     user_data.preview_image_data = None
     await save_user_data(state, user_data)
 
-    can_undo = len(user_data.undo_stack) > 0
-    can_redo = len(user_data.redo_stack) > 0
-    new_file = BufferedInputFile(user_data.current_image_data, filename="edited.jpg")
+    can_undo = user_data.can_undo
+    can_redo = user_data.can_redo
 
-    await callback.message.edit_media(
-        media=InputMediaPhoto(media=new_file, caption=main_menu_caption()),
+    shown = await display_image(callback.message.chat.id, user_data.current_image_data, render_scheduler)
+    await edit_photo_from_bytes(
+        callback.message,
+        shown,
+        caption=main_menu_caption(),
         reply_markup=main_menu_keyboard(can_undo, can_redo)
     )
     await state.set_state(BotStates.MAIN_MENU)
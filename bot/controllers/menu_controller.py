@@ -1,16 +1,39 @@
 import logging
+from PIL import Image, UnidentifiedImageError
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile, InputMediaPhoto
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
+from controllers import answers_render_errors, display_image
 from models.states import BotStates
 from models.user_data import UserData
 from views.keyboards import main_menu_keyboard, confirm_save_keyboard
-from views.messages import main_menu_caption
-from utils.file_utils import download_photo_to_bytes, send_photo_from_bytes
+from views.messages import main_menu_caption, downloaded_image_caption, image_too_large_message
+from utils.file_utils import (
+    download_photo_to_bytes,
+    download_document_to_bytes,
+    send_photo_from_bytes,
+    send_document_from_bytes,
+    edit_photo_from_bytes,
+    fits_photo,
+)
 from utils.state_utils import load_user_data, save_user_data
+from services.render_jobs import render_pipeline
+from services.render_scheduler import Priority, RenderScheduler
+from services.strip_render import MemoryLimitError, check_renderable
+import settings
 
 menu_router = Router(name="menu_router")
+logger = logging.getLogger(__name__)
+
+async def _render_current_image(chat_id: int, user_data: UserData, render_scheduler: RenderScheduler):
+    """Replay history from the nearest keyframe to rebuild current_image_data."""
+    source, ops = user_data.render_plan()
+    # Undo/redo show a committed image, so they share Save's priority.
+    user_data.current_image_data = await render_scheduler.submit(
+        chat_id, Priority.SAVE, render_pipeline, source, ops
+    )
 
 @menu_router.message(Command("start"))
 async def start_command(message: Message, state: FSMContext):
@@ -19,21 +42,46 @@ async def start_command(message: Message, state: FSMContext):
     await message.answer("Welcome! Please send an image to begin editing.")
 
 @menu_router.message(F.photo)
-async def handle_new_photo(message: Message, state: FSMContext):
-    user_data = await load_user_data(state)
-
+@answers_render_errors
+async def handle_new_photo(message: Message, state: FSMContext, render_scheduler: RenderScheduler):
     image_bytes = await download_photo_to_bytes(message)
-    user_data.base_image_data = image_bytes
-    user_data.current_image_data = image_bytes
-    user_data.undo_stack.clear()
-    user_data.redo_stack.clear()
+    await _start_session(message, state, image_bytes, render_scheduler)
 
-    await save_user_data(state, user_data)
+@menu_router.message(F.document.mime_type.startswith("image/"))
+@answers_render_errors
+async def handle_new_document(message: Message, state: FSMContext, render_scheduler: RenderScheduler):
+    """Images sent as files arrive at full resolution, unlike photos."""
+    if message.document.file_size and message.document.file_size > settings.MAX_DOCUMENT_BYTES:
+        await message.answer(image_too_large_message(settings.MAX_DOCUMENT_BYTES))
+        return
+    image_bytes = await download_document_to_bytes(message)
+    try:
+        check_renderable(image_bytes, settings.RENDER_JOB_MEMORY_LIMIT)
+    except UnidentifiedImageError:
+        await message.answer("This file isn't an image I can read.")
+        return
+    except (MemoryLimitError, Image.DecompressionBombError):
+        await message.answer(image_too_large_message(settings.MAX_DOCUMENT_BYTES))
+        return
+    await _start_session(message, state, image_bytes, render_scheduler)
 
+async def _start_session(message: Message, state: FSMContext, image_bytes: bytes, render_scheduler: RenderScheduler):
+    """Show the image with the main menu, then make it the session's original."""
     caption = main_menu_caption()
     menu_markup = main_menu_keyboard(can_undo=False, can_redo=False)
-    sent_msg = await send_photo_from_bytes(message, image_bytes, caption=caption, reply_markup=menu_markup)
+    # Full-resolution documents are shown reduced; renders and Download use image_bytes.
+    shown = await display_image(message.chat.id, image_bytes, render_scheduler)
+    try:
+        sent_msg = await send_photo_from_bytes(message, shown, caption=caption, reply_markup=menu_markup)
+    except TelegramBadRequest as e:
+        # The previous session, if any, is left as it was.
+        logger.warning("Could not show a new image in chat %s: %s", message.chat.id, e.message)
+        await message.answer("Telegram couldn't show this image. Please send another one.")
+        return
 
+    user_data = await load_user_data(state)
+    user_data.reset_history(image_bytes)
+    user_data.clear_album()
     user_data.image_message_id = sent_msg.message_id
     user_data.menu_message_id = sent_msg.message_id
     await save_user_data(state, user_data)
@@ -41,19 +89,23 @@ async def handle_new_photo(message: Message, state: FSMContext):
     await state.set_state(BotStates.MAIN_MENU)
 
 @menu_router.callback_query(F.data == "undo", BotStates.MAIN_MENU)
-async def undo_callback(callback: CallbackQuery, state: FSMContext):
+@answers_render_errors
+async def undo_callback(callback: CallbackQuery, state: FSMContext, render_scheduler: RenderScheduler):
     user_data = await load_user_data(state)
     success = user_data.undo()
+    if success and not user_data.current_image_data:
+        await _render_current_image(callback.message.chat.id, user_data, render_scheduler)
     await save_user_data(state, user_data)
 
     if success and user_data.current_image_data:
-        can_undo = len(user_data.undo_stack) > 0
-        can_redo = len(user_data.redo_stack) > 0
+        can_undo = user_data.can_undo
+        can_redo = user_data.can_redo
 
-        raw_data = user_data.current_image_data
-        new_file = BufferedInputFile(raw_data, filename="edited.jpg")
-        await callback.message.edit_media(
-            media=InputMediaPhoto(media=new_file, caption=main_menu_caption()),
+        raw_data = await display_image(callback.message.chat.id, user_data.current_image_data, render_scheduler)
+        await edit_photo_from_bytes(
+            callback.message,
+            raw_data,
+            caption=main_menu_caption(),
             reply_markup=main_menu_keyboard(can_undo, can_redo)
         )
         await callback.answer("Undo applied.")
@@ -61,30 +113,50 @@ async def undo_callback(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Nothing to undo.", show_alert=True)
 
 @menu_router.callback_query(F.data == "redo", BotStates.MAIN_MENU)
-async def redo_callback(callback: CallbackQuery, state: FSMContext):
+@answers_render_errors
+async def redo_callback(callback: CallbackQuery, state: FSMContext, render_scheduler: RenderScheduler):
     user_data = await load_user_data(state)
     success = user_data.redo()
+    if success and not user_data.current_image_data:
+        await _render_current_image(callback.message.chat.id, user_data, render_scheduler)
     await save_user_data(state, user_data)
 
     if success and user_data.current_image_data:
-        can_undo = len(user_data.undo_stack) > 0
-        can_redo = len(user_data.redo_stack) > 0
+        can_undo = user_data.can_undo
+        can_redo = user_data.can_redo
         
-        raw_data = user_data.current_image_data
-        new_file = BufferedInputFile(raw_data, filename="edited.jpg")
-        await callback.message.edit_media(
-            media=InputMediaPhoto(media=new_file, caption=main_menu_caption()),
+        raw_data = await display_image(callback.message.chat.id, user_data.current_image_data, render_scheduler)
+        await edit_photo_from_bytes(
+            callback.message,
+            raw_data,
+            caption=main_menu_caption(),
             reply_markup=main_menu_keyboard(can_undo, can_redo)
         )
         await callback.answer("Redo applied.")
     else:
         await callback.answer("Nothing to redo.", show_alert=True)
 
-@menu_router.callback_query(F.data == "download_image", BotStates.MAIN_MENU)
-async def download_image_callback(callback: CallbackQuery, state: FSMContext):
+async def _render_download(chat_id: int, user_data: UserData, render_scheduler: RenderScheduler, profile: str) -> bytes:
+    """Render the current edits from the original upload with a download profile."""
+    source, ops = user_data.render_plan(from_base=True)
+    return await render_scheduler.submit(chat_id, Priority.SAVE, render_pipeline, source, ops, profile)
+
+@menu_router.callback_query(F.data.in_({"download_image", "download_lossless"}), BotStates.MAIN_MENU)
+@answers_render_errors
+async def download_image_callback(callback: CallbackQuery, state: FSMContext, render_scheduler: RenderScheduler):
     user_data = await load_user_data(state)
-    if user_data.current_image_data is None:
+    if user_data.base_image_data is None:
         await callback.answer("No image to download.", show_alert=True)
         return
-    await send_photo_from_bytes(callback.message, user_data.current_image_data, caption="Here is your image.")
+    lossless = callback.data == "download_lossless"
+    image_bytes = await _render_download(
+        callback.message.chat.id, user_data, render_scheduler, "download_lossless" if lossless else "download"
+    )
+    if lossless:
+        await send_document_from_bytes(callback.message, image_bytes, "image.png", caption=downloaded_image_caption())
+    elif fits_photo(image_bytes):
+        await send_photo_from_bytes(callback.message, image_bytes, caption="Here is your image.")
+    else:
+        # Too big for a photo; a document keeps the full resolution.
+        await send_document_from_bytes(callback.message, image_bytes, "image.jpg", caption=downloaded_image_caption())
     await callback.answer()
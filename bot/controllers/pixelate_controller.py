@@ -1,18 +1,66 @@
 import io
+from functools import partial
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, InputMediaPhoto, FSInputFile, BufferedInputFile
+from aiogram.types import CallbackQuery, FSInputFile
 from aiogram.fsm.context import FSMContext
 
+from controllers import PIXEL_SIZE_RANGE, answers_render_errors, clamp, display_image, picked_value
+from middlewares.tap_coalescing import CaptionDebouncer, RenderTicket
 from models.states import BotStates
+from models.user_data import UserData
+from utils.file_utils import edit_photo_from_bytes
 from utils.state_utils import load_user_data, save_user_data
-from views.keyboards import pixelate_menu_keyboard, main_menu_keyboard
-from views.messages import pixelate_menu_caption, main_menu_caption
-from services.image_utils import decode_jpg_to_array, encode_array_to_jpg, pixelate_array
+from views.keyboards import compare_keyboard, pixelate_menu_keyboard, main_menu_keyboard
+from views.messages import compare_caption, pixel_settings, pixelate_menu_caption, main_menu_caption
+from services.preview_cache import PreviewCache
+from services.contact_sheet import value_window
+from services.edit_pipeline import PIXEL_STYLE
+from services.quantize import DITHERS
+from services.render_jobs import render_contact_sheet, render_pipeline
+from services.render_scheduler import Priority, RenderScheduler
+import settings
 
 pixelate_router = Router(name="pixelate_router")
 
+# Values the colour buttons cycle through
+COLOR_STEPS = (0, 2, 4, 8, 16, 32)
+BW_LEVEL = 128
+
+def _pixelate_op(user_data: UserData, pixel_size: int = None) -> list:
+    """The pixelate op for the menu's settings, at pixel_size if given."""
+    params = {"block_size": user_data.pixel_size if pixel_size is None else pixel_size}
+    style = {"colors": user_data.pixel_colors, "bw": user_data.pixel_bw}
+    if user_data.pixel_colors or user_data.pixel_bw:
+        style["dither"] = user_data.pixel_dither
+    # Only options that are set, so plain pixelation keeps its op (and cached previews).
+    params.update({name: value for name, value in style.items() if value != PIXEL_STYLE[name]})
+    return ["pixelate", params]
+
+def _settings(user_data: UserData) -> str:
+    return pixel_settings(user_data.pixel_size, user_data.pixel_colors, user_data.pixel_dither, user_data.pixel_bw)
+
+def _menu_keyboard(user_data: UserData, preview_stage: int = 0):
+    return pixelate_menu_keyboard(preview_stage, user_data.pixel_colors, user_data.pixel_dither, user_data.pixel_bw)
+
+def _reset_settings(user_data: UserData) -> None:
+    user_data.pixel_size = 1
+    user_data.pixel_colors = 0
+    user_data.pixel_dither = "none"
+    user_data.pixel_bw = 0
+    user_data.pixelate_preview_stage = 0
+    user_data.preview_image_data = None
+
+def _prefetch_neighbours(callback: CallbackQuery, user_data: UserData, preview_cache: PreviewCache, render_scheduler: RenderScheduler):
+    """Warm the preview cache for the current value and one step either way."""
+    values = dict.fromkeys((user_data.pixel_size, clamp(user_data.pixel_size + 2, PIXEL_SIZE_RANGE), clamp(user_data.pixel_size - 2, PIXEL_SIZE_RANGE)))
+    preview_cache.prefetch(
+        callback.message.chat.id, user_data, [_pixelate_op(user_data, v) for v in values], render_scheduler
+    )
+
 @pixelate_router.callback_query(F.data == "menu_pixelate", BotStates.MAIN_MENU)
-async def open_pixelate_menu(callback: CallbackQuery, state: FSMContext):
+async def open_pixelate_menu(
+    callback: CallbackQuery, state: FSMContext, preview_cache: PreviewCache, render_scheduler: RenderScheduler
+):
     user_data = await load_user_data(state)
     user_data.pixelate_preview_stage = 0
     user_data.preview_image_data = None
@@ -20,41 +68,140 @@ async def open_pixelate_menu(callback: CallbackQuery, state: FSMContext):
     await save_user_data(state, user_data)
 
     await callback.message.edit_caption(
-        caption=f"Pixel size: {user_data.pixel_size}\nPress + or - to change, then Preview.",
-        reply_markup=pixelate_menu_keyboard(preview_stage=0)
+        caption=f"{_settings(user_data)}\n{pixelate_menu_caption()}",
+        reply_markup=_menu_keyboard(user_data)
     )
 
     await state.set_state(BotStates.PIXELATE_MENU)
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
     await callback.answer()
 
 @pixelate_router.callback_query(F.data == "pixel_plus", BotStates.PIXELATE_MENU)
-async def pixel_plus_callback(callback: CallbackQuery, state: FSMContext):
+async def pixel_plus_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+):
     user_data = await load_user_data(state)
-    user_data.pixel_size = min(40, user_data.pixel_size + 2)
+    user_data.pixel_size = clamp(user_data.pixel_size + 2, PIXEL_SIZE_RANGE)
     user_data.pixelate_preview_stage = 0
     await save_user_data(state, user_data)
 
-    await callback.message.edit_caption(
-        caption=f"Pixel size: {user_data.pixel_size} (unsaved). Press Preview.",
-        reply_markup=pixelate_menu_keyboard(preview_stage=0)
+    # Rapid taps collapse into a single caption edit.
+    caption_debouncer.schedule(
+        callback.message.chat.id,
+        partial(
+            callback.message.edit_caption,
+            caption=f"{_settings(user_data)} (unsaved). Press Preview.",
+            reply_markup=_menu_keyboard(user_data)
+        )
     )
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
     await callback.answer()
 
 @pixelate_router.callback_query(F.data == "pixel_minus", BotStates.PIXELATE_MENU)
-async def pixel_minus_callback(callback: CallbackQuery, state: FSMContext):
+async def pixel_minus_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+):
     user_data = await load_user_data(state)
-    user_data.pixel_size = max(1, user_data.pixel_size - 2)
+    user_data.pixel_size = clamp(user_data.pixel_size - 2, PIXEL_SIZE_RANGE)
     user_data.pixelate_preview_stage = 0
     await save_user_data(state, user_data)
 
-    await callback.message.edit_caption(
-        caption=f"Pixel size: {user_data.pixel_size} (unsaved). Press Preview.",
-        reply_markup=pixelate_menu_keyboard(preview_stage=0)
+    caption_debouncer.schedule(
+        callback.message.chat.id,
+        partial(
+            callback.message.edit_caption,
+            caption=f"{_settings(user_data)} (unsaved). Press Preview.",
+            reply_markup=_menu_keyboard(user_data)
+        )
+    )
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
+    await callback.answer()
+
+async def _change_style(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+    **changes,
+):
+    user_data = await load_user_data(state)
+    for name, value in changes.items():
+        setattr(user_data, name, value(getattr(user_data, name)))
+    user_data.pixelate_preview_stage = 0
+    await save_user_data(state, user_data)
+
+    caption_debouncer.schedule(
+        callback.message.chat.id,
+        partial(
+            callback.message.edit_caption,
+            caption=f"{_settings(user_data)} (unsaved). Press Preview.",
+            reply_markup=_menu_keyboard(user_data)
+        )
     )
+    _prefetch_neighbours(callback, user_data, preview_cache, render_scheduler)
     await callback.answer()
 
+def _next(values: tuple, current):
+    return values[(values.index(current) + 1) % len(values)] if current in values else values[0]
+
+@pixelate_router.callback_query(F.data == "pixel_colors", BotStates.PIXELATE_MENU)
+async def pixel_colors_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+):
+    # Picking a colour count leaves B&W.
+    await _change_style(
+        callback, state, preview_cache, render_scheduler, caption_debouncer,
+        pixel_colors=partial(_next, COLOR_STEPS), pixel_bw=lambda bw: 0,
+    )
+
+@pixelate_router.callback_query(F.data == "pixel_dither", BotStates.PIXELATE_MENU)
+async def pixel_dither_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+):
+    await _change_style(
+        callback, state, preview_cache, render_scheduler, caption_debouncer,
+        pixel_dither=partial(_next, DITHERS),
+    )
+
+@pixelate_router.callback_query(F.data == "pixel_bw", BotStates.PIXELATE_MENU)
+async def pixel_bw_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    caption_debouncer: CaptionDebouncer,
+):
+    await _change_style(
+        callback, state, preview_cache, render_scheduler, caption_debouncer,
+        pixel_bw=lambda bw: 0 if bw else BW_LEVEL,
+    )
+
 @pixelate_router.callback_query(F.data == "pixel_preview", BotStates.PIXELATE_MENU)
-async def pixel_preview_callback(callback: CallbackQuery, state: FSMContext):
+@answers_render_errors
+async def pixel_preview_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    render_ticket: RenderTicket,
+):
     user_data = await load_user_data(state)
 
     if user_data.pixelate_preview_stage == 0:
@@ -62,21 +209,20 @@ async def pixel_preview_callback(callback: CallbackQuery, state: FSMContext):
             await callback.answer("No current image found.", show_alert=True)
             return
         
-        width, height, arr = decode_jpg_to_array(user_data.current_image_data)
-        new_arr = pixelate_array(arr, user_data.pixel_size)
-        preview_img = encode_array_to_jpg(width, height, new_arr)
+        preview_img = await render_ticket.run(preview_cache.render(
+            callback.message.chat.id, user_data, _pixelate_op(user_data), render_scheduler
+        ))
 
         user_data.preview_image_data = preview_img
         user_data.pixelate_preview_stage = 1
         await save_user_data(state, user_data)
 
-        input_file = BufferedInputFile(preview_img, filename="preview.jpg")
-        await callback.message.edit_media(
-            media=InputMediaPhoto(
-                media=input_file,
-                caption=f"Pixel size: {user_data.pixel_size} (preview)"
-            ),
-            reply_markup=pixelate_menu_keyboard(preview_stage=1)
+        await edit_photo_from_bytes(
+            callback.message,
+            preview_img,
+            caption=f"{_settings(user_data)} (preview)",
+            reply_markup=_menu_keyboard(user_data, preview_stage=1),
+            filename="preview.jpg"
         )
         await callback.answer()
 
@@ -86,41 +232,98 @@ async def pixel_preview_callback(callback: CallbackQuery, state: FSMContext):
             await callback.answer("No preview image found.", show_alert=True)
             return
 
-        user_data.push_undo_data(preview_img)
-        
-        user_data.pixel_size = 1
-        user_data.pixelate_preview_stage = 0
-        user_data.preview_image_data = None
+        # The preview was rendered on a proxy; render the full image now.
+        op = _pixelate_op(user_data)
+        source, ops = user_data.render_plan(op)
+        new_img = await render_ticket.run(render_scheduler.submit(
+            callback.message.chat.id, Priority.SAVE, render_pipeline, source, ops
+        ))
+        user_data.push_undo_data(new_img, op)
+        _reset_settings(user_data)
 
         await save_user_data(state, user_data)
 
-        can_undo = len(user_data.undo_stack) > 0
-        can_redo = len(user_data.redo_stack) > 0
-        new_file = BufferedInputFile(user_data.current_image_data, filename="edited.jpg")
+        can_undo = user_data.can_undo
+        can_redo = user_data.can_redo
 
-        await callback.message.edit_media(
-            media=InputMediaPhoto(media=new_file, caption=main_menu_caption()),
+        shown = await display_image(callback.message.chat.id, user_data.current_image_data, render_scheduler)
+        await edit_photo_from_bytes(
+            callback.message,
+            shown,
+            caption=main_menu_caption(),
             reply_markup=main_menu_keyboard(can_undo, can_redo)
         )
         await state.set_state(BotStates.MAIN_MENU)
         await callback.answer()
 
 
-@pixelate_router.callback_query(F.data == "pixel_back_to_main", BotStates.PIXELATE_MENU)
-async def pixel_back_to_main_callback(callback: CallbackQuery, state: FSMContext):
+@pixelate_router.callback_query(F.data == "pixel_compare", BotStates.PIXELATE_MENU)
+@answers_render_errors
+async def pixel_compare_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    render_scheduler: RenderScheduler,
+    render_ticket: RenderTicket,
+):
+    """Show values around the current one side by side, one upload for all of them."""
     user_data = await load_user_data(state)
-    user_data.pixel_size = 1
+    if not user_data.current_image_data:
+        await callback.answer("No current image found.", show_alert=True)
+        return
+    values = value_window(user_data.pixel_size, 2, *PIXEL_SIZE_RANGE, settings.COMPARE_CELLS)
+    source, ops = user_data.render_plan()
+    sheet = await render_ticket.run(render_scheduler.submit(
+        callback.message.chat.id, Priority.PREVIEW, render_contact_sheet,
+        source, ops, [_pixelate_op(user_data, v) for v in values], [str(i + 1) for i in range(len(values))]
+    ))
+
     user_data.pixelate_preview_stage = 0
     user_data.preview_image_data = None
     await save_user_data(state, user_data)
 
-    raw_data = user_data.current_image_data
-    new_file = BufferedInputFile(raw_data, filename="edited.jpg")
-    can_undo = len(user_data.undo_stack) > 0
-    can_redo = len(user_data.redo_stack) > 0
+    await edit_photo_from_bytes(
+        callback.message,
+        sheet,
+        caption=compare_caption("Pixel size", values),
+        reply_markup=compare_keyboard("pixel", values),
+        filename="compare.jpg"
+    )
+    await callback.answer()
+
+@pixelate_router.callback_query(F.data.startswith("pixel_pick:"), BotStates.PIXELATE_MENU)
+async def pixel_pick_callback(
+    callback: CallbackQuery,
+    state: FSMContext,
+    preview_cache: PreviewCache,
+    render_scheduler: RenderScheduler,
+    render_ticket: RenderTicket,
+):
+    """A contact sheet cell was picked: preview that value as if reached with +/-."""
+    value = picked_value(callback.data)
+    if value is None:
+        await callback.answer("Nothing to change.")
+        return
+    user_data = await load_user_data(state)
+    user_data.pixel_size = clamp(value, PIXEL_SIZE_RANGE)
+    user_data.pixelate_preview_stage = 0
+    await save_user_data(state, user_data)
+    await pixel_preview_callback(callback, state, preview_cache, render_scheduler, render_ticket)
+
+@pixelate_router.callback_query(F.data == "pixel_back_to_main", BotStates.PIXELATE_MENU)
+@answers_render_errors
+async def pixel_back_to_main_callback(callback: CallbackQuery, state: FSMContext, render_scheduler: RenderScheduler):
+    user_data = await load_user_data(state)
+    _reset_settings(user_data)
+    await save_user_data(state, user_data)
+
+    raw_data = await display_image(callback.message.chat.id, user_data.current_image_data, render_scheduler)
+    can_undo = user_data.can_undo
+    can_redo = user_data.can_redo
 
-    await callback.message.edit_media(
-        media=InputMediaPhoto(media=new_file, caption=main_menu_caption()),
+    await edit_photo_from_bytes(
+        callback.message,
+        raw_data,
+        caption=main_menu_caption(),
         reply_markup=main_menu_keyboard(can_undo, can_redo)
     )
     await state.set_state(BotStates.MAIN_MENU)
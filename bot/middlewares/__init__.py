@@ -0,0 +1,14 @@
+from typing import Sequence
+
+from aiogram import BaseMiddleware, Dispatcher
+
+def register_before_fsm(dp: Dispatcher, middlewares: Sequence[BaseMiddleware]) -> None:
+    """
+    Register outer update middlewares to run in the given order, all before
+    the FSM middleware loads the context and takes the chat's lock. The
+    Dispatcher registers FSM on creation, so it is taken out and put back last.
+    """
+    dp.update.outer_middleware.unregister(dp.fsm)
+    for middleware in middlewares:
+        dp.update.outer_middleware(middleware)
+    dp.update.outer_middleware(dp.fsm)
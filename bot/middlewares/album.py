@@ -0,0 +1,70 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject, Update
+
+from utils.file_utils import download_photo_to_bytes
+
+class Album:
+    """The photo messages of one media group, in the order they were sent."""
+
+    def __init__(self, messages: List[Message], downloads: List[asyncio.Task]):
+        self.messages = messages
+        self.downloads = downloads
+
+    async def images(self) -> List[bytes]:
+        return list(await asyncio.gather(*self.downloads))
+
+class _Collector:
+    __slots__ = ("items", "last_seen")
+
+    def __init__(self):
+        self.items: List[Tuple[Message, asyncio.Task]] = []
+        self.last_seen = time.monotonic()
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Update middleware that gathers the photos of a media group into one update.
+
+    Telegram delivers an album as one message per photo. Each photo starts
+    downloading as soon as its message arrives; the first message of the group
+    is then held until no further one came for `delay` seconds and handled with
+    an `album` argument, and the others are dropped. Runs before the FSM
+    context is loaded, so the held message doesn't lock the chat.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._groups: Dict[Tuple[int, str], _Collector] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        message: Optional[Message] = event.message if isinstance(event, Update) else None
+        if message is None or not message.media_group_id or not message.photo:
+            return await handler(event, data)
+
+        group_key = (message.chat.id, message.media_group_id)
+        download = asyncio.create_task(download_photo_to_bytes(message))
+        collector = self._groups.get(group_key)
+        if collector is not None:
+            collector.items.append((message, download))
+            collector.last_seen = time.monotonic()
+            return None
+
+        collector = self._groups[group_key] = _Collector()
+        collector.items.append((message, download))
+        try:
+            while (remaining := collector.last_seen + self.delay - time.monotonic()) > 0:
+                await asyncio.sleep(remaining)
+        finally:
+            del self._groups[group_key]
+
+        items = sorted(collector.items, key=lambda item: item[0].message_id)
+        data["album"] = Album([m for m, _ in items], [d for _, d in items])
+        return await handler(event, data)
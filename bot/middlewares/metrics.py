@@ -0,0 +1,48 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from services.metrics import handler_label, observe_stage
+
+# Commands the bot handles; anything else a user types shares one label.
+KNOWN_COMMANDS = frozenset({"/start"})
+
+def handler_name(update: Update) -> str:
+    """
+    Metrics label for the handler an update is meant for. Labels come from a
+    fixed set, since every distinct label keeps its own samples.
+    """
+    if update.callback_query:
+        # Drop the argument of parameterised buttons, e.g. "pixel_pick:12".
+        return (update.callback_query.data or "callback_query").split(":")[0]
+    message = update.message
+    if message:
+        if message.photo:
+            return "photo"
+        if message.text and message.text.startswith("/"):
+            command = message.text.split()[0].split("@")[0]
+            return command if command in KNOWN_COMMANDS else "other_command"
+        return "message"
+    return update.event_type
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Labels everything recorded while an update is handled with its handler
+    name, and times the whole update, including the wait for the chat's lock.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        token = handler_label.set(handler_name(event))
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            observe_stage("update", time.perf_counter() - start)
+            handler_label.reset(token)
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    TelegramMethod,
+)
+from aiogram.methods.base import Response, TelegramType
+
+from services.metrics import observe_stage, outbound_coalesced_total, outbound_retries_total
+
+logger = logging.getLogger(__name__)
+
+# What a message edit overwrites: an edit replaces every pending edit of the
+# same message that ranks the same or lower (editing media also sets the
+# caption and keyboard, editing a caption also sets the keyboard).
+EDIT_RANKS = {
+    EditMessageReplyMarkup: 0,
+    EditMessageCaption: 1,
+    EditMessageText: 1,
+    EditMessageMedia: 2,
+}
+
+# What the caller of an edit dropped for a newer one gets instead of a result
+REPLACED_EDIT = object()
+
+class TokenBucket:
+    """`rate` tokens a second, holding up to `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def drain(self) -> None:
+        """Spend the saved-up burst, so requests go out no faster than `rate`."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0)
+
+    @property
+    def idle(self) -> bool:
+        return self.delay() == 0 and self.tokens >= self.burst
+
+class _PendingEdit:
+    __slots__ = ("rank", "replaced", "replacement", "result")
+
+    def __init__(self, rank: int):
+        self.rank = rank
+        self.replaced = asyncio.Event()
+        self.replacement: Optional[asyncio.Future] = None
+        # Resolved with what the caller of this edit gets
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+
+class OutboundRequestMiddleware(BaseRequestMiddleware):
+    """
+    Session middleware pacing Bot API requests to Telegram's flood limits.
+
+    Requests addressed to a chat wait for a token from that chat's bucket and
+    from the global one. Requests answered with RetryAfter are retried after
+    the time Telegram asks for, during which the chat's bucket is paused, or
+    the global one for requests to no chat; a chat's RetryAfter also drains
+    the global bucket's burst. A message edit still waiting for its turn is
+    dropped when a newer edit of the same message replaces it; its caller
+    gets REPLACED_EDIT once the newer edit is done.
+    """
+
+    # Idle per-chat buckets are forgotten past this many chats
+    MAX_CHAT_BUCKETS = 10_000
+
+    def __init__(self, chat_rate: float, chat_burst: float, global_rate: float, global_burst: float, max_retries: int):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_retries = max_retries
+        self._chat_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._pending_edits: Dict[Tuple[int, int], _PendingEdit] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self._chat_buckets) > self.MAX_CHAT_BUCKETS:
+                oldest_id, oldest = next(iter(self._chat_buckets.items()))
+                if oldest.idle:
+                    del self._chat_buckets[oldest_id]
+        self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            # Callback answers, file lookups, usernames: not paced per chat.
+            return await self._send(make_request, bot, method)
+
+        edit_key = None
+        pending = None
+        if type(method) in EDIT_RANKS and getattr(method, "message_id", None):
+            edit_key = (chat_id, method.message_id)
+            pending = _PendingEdit(EDIT_RANKS[type(method)])
+            previous = self._pending_edits.get(edit_key)
+            if previous is not None and previous.rank <= pending.rank:
+                previous.replacement = pending.result
+                previous.replaced.set()
+            self._pending_edits[edit_key] = pending
+
+        try:
+            replaced = await self._wait_turn(chat_id, pending)
+            if edit_key is not None and self._pending_edits.get(edit_key) is pending:
+                del self._pending_edits[edit_key]
+            if replaced:
+                outbound_coalesced_total.inc(method=type(method).__name__)
+                # The newer edit's outcome is its caller's: it carries other content.
+                await asyncio.wait({pending.replacement})
+                result = REPLACED_EDIT
+            else:
+                result = await self._send(make_request, bot, method)
+        except BaseException as e:
+            if pending is not None and not pending.result.done():
+                if isinstance(e, Exception):
+                    pending.result.set_exception(e)
+                else:
+                    pending.result.cancel()
+            raise
+        if pending is not None and not pending.result.done():
+            pending.result.set_result(result)
+        return result
+
+    async def _wait_turn(self, chat_id: int, pending: Optional[_PendingEdit]) -> bool:
+        """Wait for a token from the chat's and the global bucket; True if the edit was replaced instead."""
+        chat_bucket = self._chat_bucket(chat_id)
+        started = time.monotonic()
+        try:
+            while True:
+                wait = max(chat_bucket.delay(), self.global_bucket.delay())
+                if wait <= 0:
+                    chat_bucket.take()
+                    self.global_bucket.take()
+                    return False
+                if pending is None:
+                    await asyncio.sleep(wait)
+                    continue
+                try:
+                    await asyncio.wait_for(pending.replaced.wait(), wait)
+                    return True
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            observe_stage("throttle", time.monotonic() - started)
+
+    async def _send(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot, method: TelegramMethod[TelegramType]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                chat_id = getattr(method, "chat_id", None)
+                if isinstance(chat_id, int):
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                    self.global_bucket.drain()
+                else:
+                    self.global_bucket.pause(e.retry_after)
+                outbound_retries_total.inc(method=type(method).__name__)
+                logger.info("Flood control on %s, retrying in %ss", type(method).__name__, e.retry_after)
+                await asyncio.sleep(e.retry_after)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Collection, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+class SupersededError(Exception):
+    """A newer request for the same chat replaced this render."""
+
+class RenderTicket:
+    """
+    Runs a handler's render so a newer request from the same chat can cancel
+    it. The render result is then dropped before anything is uploaded.
+    """
+
+    def __init__(self):
+        self.superseded = False
+        self._task: Optional[asyncio.Future] = None
+
+    async def run(self, awaitable: Awaitable[Any]) -> Any:
+        task = asyncio.ensure_future(awaitable)
+        if self.superseded:
+            task.cancel()
+            raise SupersededError
+        self._task = task
+        try:
+            # wait() doesn't propagate the inner task's cancellation, so a
+            # superseded render is told apart from this handler being cancelled.
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            self._task = None
+        if task.cancelled() or self.superseded:
+            raise SupersededError
+        return task.result()
+
+    def supersede(self) -> None:
+        self.superseded = True
+        if self._task is not None:
+            self._task.cancel()
+
+class CaptionDebouncer:
+    """
+    Collapses bursts of caption edits for a chat into the last one, sent after
+    `delay` seconds without a newer tap.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._pending: Dict[int, asyncio.Task] = {}
+        self._sending: Dict[int, asyncio.Task] = {}
+
+    def schedule(self, chat_id: int, edit: Callable[[], Awaitable[Any]]) -> None:
+        pending = self._pending.pop(chat_id, None)
+        if pending is not None:
+            pending.cancel()
+        self._pending[chat_id] = asyncio.create_task(self._send_later(chat_id, edit))
+
+    async def _send_later(self, chat_id: int, edit: Callable[[], Awaitable[Any]]) -> None:
+        await asyncio.sleep(self.delay)
+        task = self._pending.pop(chat_id)
+        self._sending[chat_id] = task
+        try:
+            await edit()
+        except TelegramBadRequest as e:
+            logger.debug("Debounced caption edit failed: %s", e.message)
+        finally:
+            if self._sending.get(chat_id) is task:
+                del self._sending[chat_id]
+
+    async def settle(self, chat_id: int) -> None:
+        """Drop a pending edit and wait for one already being sent."""
+        pending = self._pending.pop(chat_id, None)
+        if pending is not None:
+            pending.cancel()
+        sending = self._sending.get(chat_id)
+        if sending is not None:
+            await asyncio.wait({sending})
+
+class TapCoalescingMiddleware(BaseMiddleware):
+    """
+    Update middleware that runs before the FSM context is loaded, i.e. before
+    the per-chat event isolation lock is taken:
+
+    - a callback in `cancellable_data` supersedes the render of the previous
+      such callback from the same chat, so it doesn't wait for a stale render;
+    - any other update than a `debounced_data` tap settles the chat's pending
+      debounced caption edit, so it can't overwrite what the handler shows.
+
+    Callback data is matched up to its first ":", so "pixel_pick" covers
+    every "pixel_pick:<value>" button.
+
+    Handlers receive `render_ticket` and `caption_debouncer` arguments.
+    """
+
+    def __init__(self, cancellable_data: Collection[str], debounced_data: Collection[str], debounce_delay: float):
+        self.cancellable_data = frozenset(cancellable_data)
+        self.debounced_data = frozenset(debounced_data)
+        self.caption_debouncer = CaptionDebouncer(debounce_delay)
+        self._tickets: Dict[int, RenderTicket] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        data["caption_debouncer"] = self.caption_debouncer
+        ticket = data["render_ticket"] = RenderTicket()
+        if chat is None:
+            return await handler(event, data)
+
+        callback_data = None
+        if isinstance(event, Update) and event.callback_query is not None and event.callback_query.data:
+            # Parameterised buttons, e.g. "pixel_pick:12", match by their prefix.
+            callback_data = event.callback_query.data.split(":", 1)[0]
+
+        if callback_data in self.cancellable_data:
+            previous = self._tickets.get(chat.id)
+            if previous is not None:
+                previous.supersede()
+            self._tickets[chat.id] = ticket
+        if callback_data not in self.debounced_data:
+            await self.caption_debouncer.settle(chat.id)
+
+        try:
+            return await handler(event, data)
+        finally:
+            if self._tickets.get(chat.id) is ticket:
+                del self._tickets[chat.id]
@@ -6,4 +6,5 @@ class BotStates(StatesGroup):
     PIXELATE_MENU = State()
     BRIGHTNESS_MENU = State()
     CONTRAST_MENU = State()
-    SAVE_MENU = State()
\ No newline at end of file
+    SAVE_MENU = State()
+    ALBUM_MENU = State()
\ No newline at end of file
@@ -1,21 +1,78 @@
 # models/user_data.py
 
-from dataclasses import dataclass, field
-from typing import Optional, List
+from collections import Counter
+from dataclasses import dataclass, field, fields
+from typing import Any, Optional, Iterable, List, Dict, Set, Tuple
 
-@dataclass
+import settings
+from services.blob_store import blob_store
+from services.edit_pipeline import EditPipeline
+
+# Fields holding blob-store keys; "keyframes" maps history positions to keys
+# and "album_keys" lists the photos of an album session.
+BLOB_FIELDS = (
+    "base_image_key", "current_image_key", "preview_image_key", "new_image_key", "keyframes", "album_keys",
+)
+
+def blob_keys_of(data: Dict[str, Any]) -> Counter:
+    """Blob keys referenced by the BLOB_FIELDS present in data, with multiplicity."""
+    keys = Counter((data.get("keyframes") or {}).values())
+    keys.update(data.get("album_keys") or ())
+    for name in BLOB_FIELDS[:4]:
+        if data.get(name):
+            keys[data[name]] += 1
+    return keys
+
+def _int_keys(keyframes: Dict[Any, str]) -> Dict[int, str]:
+    """Keyframes with int positions; JSON-backed FSM storages hand dict keys back as str."""
+    return {int(pos): key for pos, key in keyframes.items()}
+
+def _blob_property(key_field: str) -> property:
+    """
+    Expose a blob-store key field as the image bytes it refers to.
+    Bytes are only fetched on first access and then kept on the instance.
+    """
+    def getter(self) -> Optional[bytes]:
+        key = getattr(self, key_field)
+        return self._blob(key) if key else None
+
+    def setter(self, data: Optional[bytes]):
+        key = blob_store.put(data) if data else None
+        if key:
+            self._blobs[key] = data
+        setattr(self, key_field, key)
+
+    return property(getter, setter)
+
+@dataclass(slots=True)
 class UserData:
-    base_image_data: Optional[bytes] = None
-    current_image_data: Optional[bytes] = None
-    
-    undo_stack: List[bytes] = field(default_factory=list)
-    redo_stack: List[bytes] = field(default_factory=list)
+    # Names of fields assigned since load; save_user_data writes only these.
+    # Declared first so every field set by __init__ counts as changed.
+    _dirty: Set[str] = field(default_factory=set, init=False, repr=False, compare=False)
+    # Image bytes fetched or put through the *_data properties, by blob key
+    _blobs: Dict[str, bytes] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    # Images are kept in the blob store; state only holds their content keys.
+    base_image_key: Optional[str] = None
+    # Rendered image at history_pos
+    current_image_key: Optional[str] = None
+
+    # Edit history: one [op, params] entry per saved edit, replayed from
+    # base_image_data. Entries past history_pos are the redo tail.
+    history_ops: List[list] = field(default_factory=list)
+    history_pos: int = 0
+    # Blob keys of rendered images at some history positions, so replays stay short
+    keyframes: Dict[int, str] = field(default_factory=dict)
 
     image_message_id: int = -1
     menu_message_id: int = -1
 
     # Pixelation
     pixel_size: int = 1
+    # Colour options: palette size (0 = all colours), dithering, B&W threshold (0 = off)
+    pixel_colors: int = 0
+    pixel_dither: str = "none"
+    pixel_bw: int = 0
     pixelate_preview_stage: int = 0
     
     # Brightness
@@ -27,34 +84,166 @@ class UserData:
     contrast_preview_stage: int = 0
 
     # Temporary storage for any preview image
-    preview_image_data: Optional[bytes] = None
+    preview_image_key: Optional[str] = None
+
+    new_image_key: Optional[str] = None
+
+    # Album session: the original photos and the ops applied to all of them
+    album_keys: List[str] = field(default_factory=list)
+    album_ops: List[list] = field(default_factory=list)
+
+    base_image_data = _blob_property("base_image_key")
+    current_image_data = _blob_property("current_image_key")
+    preview_image_data = _blob_property("preview_image_key")
+    new_image_bytes = _blob_property("new_image_key")
+
+    def __setattr__(self, name: str, value: Any):
+        object.__setattr__(self, name, value)
+        if name in STATE_FIELDS:
+            self._dirty.add(name)
+
+    @classmethod
+    def from_state(cls, data: Dict[str, Any]) -> "UserData":
+        """
+        Build from stored FSM data with nothing marked as changed. Containers
+        are shared with the stored data, so methods replace them, never mutate.
+        """
+        values = {k: v for k, v in data.items() if k in STATE_FIELDS}
+        if values.get("keyframes"):
+            values["keyframes"] = _int_keys(values["keyframes"])
+        user_data = cls(**values)
+        user_data._dirty.clear()
+        return user_data
 
-    new_image_bytes: Optional[bytes] = None
+    def pop_changes(self) -> Dict[str, Any]:
+        """Fields assigned since load or the previous call, with their values."""
+        changes = {name: getattr(self, name) for name in self._dirty}
+        self._dirty.clear()
+        return changes
 
-    def push_undo_data(self, new_image: bytes):
-        if self.current_image_data is not None:
-            self.undo_stack.append(self.current_image_data)
+    def blob_keys(self) -> Counter:
+        """Blob keys referenced by this session, with multiplicity."""
+        return blob_keys_of({name: getattr(self, name) for name in BLOB_FIELDS})
+
+    @property
+    def can_undo(self) -> bool:
+        return self.history_pos > 0
+
+    @property
+    def can_redo(self) -> bool:
+        return self.history_pos < len(self.history_ops)
+
+    @property
+    def edit_ops(self) -> List[list]:
+        """Ops applied to base_image_data to produce current_image_data."""
+        return self.history_ops[:self.history_pos]
+
+    def reset_history(self, image: Optional[bytes]):
+        self.base_image_data = image
+        self.current_image_data = image
+        self.history_ops = []
+        self.history_pos = 0
+        self.keyframes = {}
+
+    def reset_album(self, images: List[bytes]):
+        keys = []
+        for image in images:
+            key = blob_store.put(image)
+            self._blobs[key] = image
+            keys.append(key)
+        self.album_keys = keys
+        self.album_ops = []
+
+    def clear_album(self):
+        if self.album_keys or self.album_ops:
+            self.album_keys = []
+            self.album_ops = []
+
+    def album_plan(self, *extra_ops: list, photos: Optional[int] = None) -> List[Tuple[bytes, List[list]]]:
+        """(source, ops) per album photo, or the first `photos`, for the album ops plus extra_ops."""
+        ops = EditPipeline.from_list(self.album_ops + list(extra_ops)).to_list()
+        return [(self._blob(key), ops) for key in self.album_keys[:photos]]
+
+    def push_undo_data(self, new_image: bytes, op: list):
+        """Record a saved edit; new_image is the render of the history with op appended."""
+        self.history_ops = self.history_ops[:self.history_pos] + [op]
+        keyframes = {pos: key for pos, key in self.keyframes.items() if pos <= self.history_pos}
+        self.history_pos += 1
         self.current_image_data = new_image
-        self.redo_stack.clear()
-        print(len(self.undo_stack))
-        print(len(self.redo_stack))
+        if self.history_pos % settings.HISTORY_KEYFRAME_INTERVAL == 0:
+            keyframes[self.history_pos] = self.current_image_key
+        self.keyframes = keyframes
+        if self.history_pos in keyframes:
+            self._trim_keyframes()
 
     def undo(self) -> bool:
-        if not self.undo_stack:
+        """Step back; current_image_data must then be re-rendered from render_plan()."""
+        if not self.can_undo:
             return False
-        if self.current_image_data:
-            self.redo_stack.append(self.current_image_data)
-        self.current_image_data = self.undo_stack.pop()
-        print(len(self.undo_stack))
-        print(len(self.redo_stack))
+        self.history_pos -= 1
+        self.current_image_data = self._image_at(self.history_pos)
         return True
 
     def redo(self) -> bool:
-        if not self.redo_stack:
+        """Step forward; current_image_data must then be re-rendered from render_plan()."""
+        if not self.can_redo:
             return False
-        if self.current_image_data:
-            self.undo_stack.append(self.current_image_data)
-        self.current_image_data = self.redo_stack.pop()
-        print(len(self.undo_stack))
-        print(len(self.redo_stack))
+        self.history_pos += 1
+        self.current_image_data = self._image_at(self.history_pos)
         return True
+
+    def render_plan(self, *extra_ops: list, from_base: bool = False) -> Tuple[bytes, List[list]]:
+        """
+        Source image and ops that render the current history position plus
+        extra_ops, starting from the nearest keyframe at or before it.
+        from_base skips the keyframes, which are already re-encoded, e.g. for
+        a download at the best quality.
+        """
+        start = 0
+        if not from_base:
+            start = max((pos for pos in self.keyframes if pos <= self.history_pos), default=0)
+        source = self._blob(self.keyframes[start]) if start else self.base_image_data
+        ops = self.history_ops[start:self.history_pos] + list(extra_ops)
+        return source, EditPipeline.from_list(ops).to_list()
+
+    def working_keys(self) -> List[str]:
+        """
+        Blob keys of the images handlers use on most taps: the current,
+        preview and new images, the render_plan() source, and the keyframes
+        an undo or redo steps to.
+        """
+        start = max((pos for pos in self.keyframes if pos <= self.history_pos), default=0)
+        keys = [self.current_image_key, self.preview_image_key, self.new_image_key]
+        keys.append(self.keyframes[start] if start else self.base_image_key)
+        keys += [self.keyframes.get(self.history_pos - 1), self.keyframes.get(self.history_pos + 1)]
+        return [key for key in keys if key]
+
+    async def prefetch(self, keys: Iterable[str]) -> None:
+        """Read the blobs behind keys off the event loop, so the *_data properties don't block."""
+        self._blobs.update(await blob_store.fetch(key for key in keys if key not in self._blobs))
+
+    def _image_at(self, pos: int) -> Optional[bytes]:
+        if pos == 0:
+            return self.base_image_data
+        key = self.keyframes.get(pos)
+        return self._blob(key) if key else None
+
+    def _blob(self, key: str) -> bytes:
+        data = self._blobs.get(key)
+        if data is None:
+            data = self._blobs[key] = blob_store.get(key)
+        return data
+
+    def _trim_keyframes(self):
+        sizes = {pos: len(self._blob(key)) for pos, key in self.keyframes.items()}
+        total = sum(sizes.values())
+        keyframes = dict(self.keyframes)
+        # Drop the keyframes furthest from the current position first.
+        for pos in sorted(keyframes, key=lambda p: abs(p - self.history_pos), reverse=True):
+            if total <= settings.HISTORY_KEYFRAME_BUDGET:
+                break
+            del keyframes[pos]
+            total -= sizes[pos]
+        self.keyframes = keyframes
+
+STATE_FIELDS = frozenset(f.name for f in fields(UserData) if not f.name.startswith("_"))
@@ -0,0 +1,255 @@
+"""
+Content-addressed storage for image bytes.
+
+Blobs are keyed by their SHA-256 and kept in two tiers: a bounded in-memory
+LRU and a directory on local disk that every blob is written through to.
+Sessions reference blobs by key, and reference counts decide when a blob can
+be deleted from both tiers. Inside an event loop, disk writes run in a thread;
+until a write lands, the blob is served from memory. fetch() likewise reads
+blobs that are only on disk in a thread.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class BlobStore:
+    def __init__(self, directory: str, memory_budget: int, orphan_grace: float = 600.0):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        # Blobs nobody references (a render whose session was never saved,
+        # or one whose last reference was dropped) are deleted after this long.
+        self.orphan_grace = orphan_grace
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._refcounts: Dict[str, int] = {}
+        self._orphans: Dict[str, float] = {}
+        # Blobs still being written to disk
+        self._pending: Dict[str, bytes] = {}
+        self._writes: Set[asyncio.Task] = set()
+        self._last_sweep = time.monotonic()
+        self._lock = threading.RLock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def put(self, data: bytes) -> str:
+        key = content_key(data)
+        with self._lock:
+            if key not in self._refcounts:
+                if key not in self._orphans:
+                    self._write_behind(key, data)
+                self._orphans[key] = time.monotonic()
+            self._remember(key, data)
+            self._maybe_sweep()
+        return key
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+            data = self._pending.get(key)
+            if data is not None:
+                self.memory_hits += 1
+                return data
+        data = self._read_disk(key)
+        if data is None:
+            raise KeyError(key)
+        return data
+
+    async def fetch(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """
+        Like get() for several blobs, with the ones only on disk read in a
+        thread; blobs that don't exist are left out.
+        """
+        found: Dict[str, bytes] = {}
+        missing = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                data = self._memory.get(key)
+                if data is not None:
+                    self._memory.move_to_end(key)
+                else:
+                    data = self._pending.get(key)
+                if data is not None:
+                    self.memory_hits += 1
+                    found[key] = data
+                else:
+                    missing.append(key)
+        if missing:
+            read = await asyncio.to_thread(lambda: {key: self._read_disk(key) for key in missing})
+            found.update((key, data) for key, data in read.items() if data is not None)
+        return found
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, data)
+        return data
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._memory or key in self._pending:
+                return True
+        return os.path.exists(self._path(key))
+
+    def incref(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._refcounts[key] = self._refcounts.get(key, 0) + 1
+                self._orphans.pop(key, None)
+
+    def decref(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                count = self._refcounts.get(key, 0) - 1
+                if count > 0:
+                    self._refcounts[key] = count
+                else:
+                    # Keep the file for the grace period: another handler may
+                    # have just put the same content without saving yet.
+                    self._refcounts.pop(key, None)
+                    self._orphans[key] = time.monotonic()
+                    self.evict_from_memory([key])
+
+    def refcount(self, key: str) -> int:
+        with self._lock:
+            return self._refcounts.get(key, 0)
+
+    def evict_from_memory(self, keys: Iterable[str]) -> None:
+        """Drop blobs from the memory tier only; they stay readable from disk."""
+        with self._lock:
+            for key in keys:
+                data = self._memory.pop(key, None)
+                if data is not None:
+                    self._memory_bytes -= len(data)
+
+    def resident_size(self, key: str) -> int:
+        """Bytes the blob takes in the memory tier; 0 if it is only on disk."""
+        with self._lock:
+            data = self._memory.get(key)
+            return len(data) if data is not None else 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    def sweep(self) -> None:
+        """Delete unreferenced blobs older than the orphan grace period."""
+        with self._lock:
+            deadline = time.monotonic() - self.orphan_grace
+            for key, created in list(self._orphans.items()):
+                if created < deadline:
+                    self._delete(key)
+            self._last_sweep = time.monotonic()
+
+    def _maybe_sweep(self) -> None:
+        if time.monotonic() - self._last_sweep > self.orphan_grace:
+            self.sweep()
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        if len(data) > self.memory_budget:
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _write_behind(self, key: str, data: bytes) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_disk(key, data)
+            return
+        self._pending[key] = data
+        task = loop.create_task(asyncio.to_thread(self._write_pending, key, data))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def _write_pending(self, key: str, data: bytes) -> None:
+        try:
+            self._write_disk(key, data)
+        except OSError:
+            logger.error("Could not write blob %s to disk", key, exc_info=True)
+        with self._lock:
+            self._pending.pop(key, None)
+            if key not in self._refcounts and key not in self._orphans:
+                # Deleted while it was being written
+                self._delete(key)
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def flush(self) -> None:
+        """Wait for the disk writes in progress."""
+        while self._writes:
+            await asyncio.wait(set(self._writes))
+
+    def adopt_orphans(self) -> None:
+        """
+        Treat blobs on disk that nothing here references, e.g. left by an
+        earlier run, as orphans, deleted after the grace period; call at startup.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        now = time.monotonic()
+        with self._lock:
+            for prefix in os.listdir(self.directory):
+                folder = os.path.join(self.directory, prefix)
+                # Blob folders are named by the first two hex digits of the key.
+                if len(prefix) != 2 or not os.path.isdir(folder):
+                    continue
+                for name in os.listdir(folder):
+                    if name.startswith("tmp"):
+                        # Partial write from an interrupted put()
+                        os.remove(os.path.join(folder, name))
+                    elif name not in self._refcounts:
+                        self._orphans.setdefault(name, now)
+
+    def _delete(self, key: str) -> None:
+        self._orphans.pop(key, None)
+        self.evict_from_memory([key])
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+blob_store = BlobStore(
+    directory=settings.BLOB_STORE_DIR,
+    memory_budget=settings.BLOB_MEMORY_BUDGET,
+    orphan_grace=settings.BLOB_ORPHAN_GRACE,
+)
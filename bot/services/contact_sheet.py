@@ -0,0 +1,61 @@
+"""
+Contact sheets: several renders of one image side by side in a numbered grid,
+so a parameter value can be picked from a single upload.
+"""
+
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from services.image_buffer import ImageBuffer
+
+GAP = 4
+BACKGROUND = (255, 255, 255)
+
+def value_window(current: int, step: int, low: int, high: int, count: int) -> List[int]:
+    """`count` values `step` apart around `current`, shifted to stay in [low, high]."""
+    start = current - step * ((count - 1) // 2)
+    start = min(start, high - step * (count - 1))
+    start = max(start, low)
+    return [value for value in range(start, start + step * count, step) if low <= value <= high]
+
+def grid_shape(width: int, height: int, count: int) -> Tuple[int, int]:
+    """(columns, rows) for `count` cells that make the squarest sheet."""
+    def squareness(columns: int) -> float:
+        rows = math.ceil(count / columns)
+        return abs(math.log((columns * width) / (rows * height)))
+    columns = min(range(1, count + 1), key=squareness)
+    return columns, math.ceil(count / columns)
+
+def cell_size(width: int, height: int, count: int, long_side: int) -> Tuple[int, int]:
+    """Size of each cell for a sheet whose longer side is about `long_side`."""
+    columns, rows = grid_shape(width, height, count)
+    factor = min((long_side - GAP * (columns - 1)) / (columns * width), (long_side - GAP * (rows - 1)) / (rows * height))
+    return max(1, int(width * factor)), max(1, int(height * factor))
+
+def resize(pixel_array: ImageBuffer, width: int, height: int) -> ImageBuffer:
+    if (pixel_array.width, pixel_array.height) == (width, height):
+        return pixel_array
+    return ImageBuffer.from_pil(pixel_array.to_pil().resize((width, height), Image.Resampling.BOX))
+
+def compose(cells: Sequence[ImageBuffer], labels: Sequence[str]) -> ImageBuffer:
+    """Lay equally sized cells out in a grid, each numbered in its corner."""
+    cell_w, cell_h = cells[0].width, cells[0].height
+    columns, rows = grid_shape(cell_w, cell_h, len(cells))
+    sheet = np.empty((rows * cell_h + GAP * (rows - 1), columns * cell_w + GAP * (columns - 1), 3), dtype=np.uint8)
+    sheet[:] = BACKGROUND
+    for i, cell in enumerate(cells):
+        top, left = (i // columns) * (cell_h + GAP), (i % columns) * (cell_w + GAP)
+        sheet[top:top + cell_h, left:left + cell_w] = cell.pixels
+
+    img = Image.fromarray(sheet)
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=max(12, cell_h // 10))
+    for i, label in enumerate(labels):
+        top, left = (i // columns) * (cell_h + GAP), (i % columns) * (cell_w + GAP)
+        box = draw.textbbox((left + 6, top + 4), label, font=font)
+        draw.rectangle((box[0] - 4, box[1] - 3, box[2] + 4, box[3] + 3), fill=(0, 0, 0))
+        draw.text((left + 6, top + 4), label, fill=(255, 255, 255), font=font)
+    return ImageBuffer.from_pil(img)
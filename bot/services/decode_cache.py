@@ -0,0 +1,100 @@
+"""
+Decoded images kept per process, keyed by the content hash of the encoded
+bytes and the decode scale, so trying several values on the same image
+decodes it once.
+
+Buffers handed out are read-only; ops always return new buffers. When a job
+runs on behalf of an owner (a chat), the images that owner decoded before are
+dropped once it moves on to different ones, rather than waiting for LRU
+eviction.
+"""
+
+import contextvars
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Optional, Tuple
+
+from services.image_buffer import ImageBuffer
+from services.image_utils import decode_jpg_to_array
+import settings
+
+# Set by the RenderService for the job being run (the chat it renders for)
+job_owner: contextvars.ContextVar[Optional[Hashable]] = contextvars.ContextVar("job_owner", default=None)
+
+CacheKey = Tuple[str, int]
+
+def image_key(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+class DecodeCache:
+    # Images per owner kept while it works, e.g. a keyframe and the original
+    OWNER_KEYS = 2
+    # Owners remembered; past this the least recently seen are forgotten
+    MAX_OWNERS = 10_000
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self._entries: "OrderedDict[CacheKey, ImageBuffer]" = OrderedDict()
+        self._owners: "OrderedDict[Hashable, Deque[str]]" = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def decode(self, image_bytes: bytes, scale: int = 1, key: Optional[str] = None) -> Tuple[int, int, ImageBuffer]:
+        """decode_jpg_to_array(image_bytes, scale), from the cache when possible."""
+        key = key or image_key(image_bytes)
+        self._touch_owner(key)
+        with self._lock:
+            arr = self._entries.get((key, scale))
+            if arr is not None:
+                self._entries.move_to_end((key, scale))
+                self.hits += 1
+                return arr.width, arr.height, arr
+            self.misses += 1
+        width, height, arr = decode_jpg_to_array(image_bytes, scale)
+        arr.pixels.flags.writeable = False
+        with self._lock:
+            if arr.nbytes <= self.budget and (key, scale) not in self._entries:
+                self._entries[(key, scale)] = arr
+                self._nbytes += arr.nbytes
+                while self._nbytes > self.budget:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._nbytes -= evicted.nbytes
+        return width, height, arr
+
+    def invalidate(self, key: str) -> None:
+        """Drop every decoded scale of the image with this content key."""
+        with self._lock:
+            for entry in [entry for entry in self._entries if entry[0] == key]:
+                self._nbytes -= self._entries.pop(entry).nbytes
+
+    def _touch_owner(self, key: str) -> None:
+        owner = job_owner.get()
+        if owner is None:
+            return
+        with self._lock:
+            keys = self._owners.setdefault(owner, deque())
+            self._owners.move_to_end(owner)
+            if len(self._owners) > self.MAX_OWNERS:
+                self._owners.popitem(last=False)
+            if key in keys:
+                keys.remove(key)
+                keys.append(key)
+                return
+            keys.append(key)
+            stale = keys.popleft() if len(keys) > self.OWNER_KEYS else None
+            if stale is not None and any(stale in other for other in self._owners.values()):
+                stale = None
+        if stale is not None:
+            self.invalidate(stale)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self._nbytes, "hits": self.hits, "misses": self.misses}
+
+decode_cache = DecodeCache(settings.DECODE_CACHE_BUDGET)
@@ -0,0 +1,243 @@
+"""
+Edit pipeline: an ordered list of (op, params) applied to a source image in a
+single decode/encode. Consecutive per-channel point ops (brightness, contrast,
+gamma, levels) are composed into one 3x256 lookup table, so stacking several
+adjustments costs one table lookup per pixel.
+"""
+
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+import numpy as np
+
+import settings
+from services.encoding import EncodingProfile, get_profile
+from services.image_buffer import ImageBuffer
+from services.decode_cache import decode_cache, image_key
+from services.metrics import observe_stage, timed_stage
+from services.pixelate_engine import engine_cache
+from services.quantize import palette_cache, stylize
+from services.strip_render import fits_whole, render_in_strips
+from services import contact_sheet
+from services.image_utils import (
+    encode_array_to_jpg,
+    image_size,
+    proxy_scale,
+    apply_lut,
+    brightness_lut,
+    contrast_lut,
+    pixelate_array,
+)
+
+def gamma_lut(gamma: float) -> np.ndarray:
+    if gamma <= 0:
+        raise ValueError("gamma must be positive")
+    values = 255.0 * (np.arange(256, dtype=np.float64) / 255.0) ** (1.0 / gamma)
+    return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+def levels_lut(in_black: int = 0, in_white: int = 255, out_black: int = 0, out_white: int = 255) -> np.ndarray:
+    if in_white <= in_black:
+        raise ValueError("in_white must be greater than in_black")
+    values = np.clip((np.arange(256, dtype=np.float64) - in_black) / (in_white - in_black), 0.0, 1.0)
+    values = out_black + values * (out_white - out_black)
+    return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+# op name -> (builder of a (256,) or (3, 256) table, params that make it a no-op)
+POINT_OPS: Dict[str, Tuple[Callable[..., np.ndarray], Dict[str, Any]]] = {
+    "brightness": (lambda value: brightness_lut(value), {"value": 0}),
+    "contrast": (lambda value: contrast_lut(value), {"value": 0}),
+    "gamma": (gamma_lut, {"gamma": 1.0}),
+    "levels": (levels_lut, {"in_black": 0, "in_white": 255, "out_black": 0, "out_white": 255}),
+}
+
+def _scale_block_size(params: Dict[str, Any], factor: float) -> Dict[str, Any]:
+    scaled = {**params, "block_size": max(1, round(params["block_size"] / factor))}
+    if params.get("block_height"):
+        scaled["block_height"] = max(1, round(params["block_height"] / factor))
+    return scaled
+
+# Colour options of a pixelate op, applied to the pixelated image: a palette
+# of `colors` colours, or black and white split at luma `bw`, either dithered
+PIXEL_STYLE = {"colors": 0, "dither": "none", "bw": 0}
+
+def split_pixel_style(params: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(block params, colour params) of a pixelate op."""
+    block = {name: value for name, value in params.items() if name not in PIXEL_STYLE}
+    return block, {name: params.get(name, default) for name, default in PIXEL_STYLE.items()}
+
+def pixelate_styled(pixel_array: ImageBuffer, colors: int = 0, dither: str = "none", bw: int = 0, **block) -> ImageBuffer:
+    return stylize(pixelate_array(pixel_array, **block), colors, dither, bw)
+
+# op name -> (function(ImageBuffer, **params) -> ImageBuffer, no-op params,
+#             params for an image downscaled by a factor)
+SPATIAL_OPS: Dict[str, Tuple[Callable[..., ImageBuffer], Dict[str, Any], Callable[..., Dict[str, Any]]]] = {
+    "pixelate": (
+        pixelate_styled,
+        {"block_size": 1, "block_height": None, "anchor": "top-left", **PIXEL_STYLE},
+        _scale_block_size,
+    ),
+}
+
+def _as_channel_lut(lut: np.ndarray) -> np.ndarray:
+    lut = np.asarray(lut, dtype=np.uint8)
+    return np.tile(lut, (3, 1)) if lut.ndim == 1 else lut
+
+def _stage_key(op: str, arg: Any) -> Hashable:
+    if op == "lut":
+        return op, arg.tobytes()
+    return op, tuple(sorted(arg.items()))
+
+class EditPipeline:
+    def __init__(self, ops: List[Tuple[str, Dict[str, Any]]] = None):
+        self.ops: List[Tuple[str, Dict[str, Any]]] = []
+        for op, params in ops or []:
+            self.add(op, **params)
+
+    @classmethod
+    def from_list(cls, ops: List[list]) -> "EditPipeline":
+        return cls([(op, dict(params)) for op, params in ops or []])
+
+    def to_list(self) -> List[list]:
+        """Plain, picklable form suitable for FSM state and worker processes."""
+        return [[op, dict(params)] for op, params in self.ops]
+
+    def add(self, op: str, **params) -> "EditPipeline":
+        if op in POINT_OPS:
+            identity = POINT_OPS[op][1]
+        elif op in SPATIAL_OPS:
+            identity = SPATIAL_OPS[op][1]
+        else:
+            raise ValueError(f"Unknown edit op: {op}")
+        # Drop no-op entries so they never cost a pass.
+        if {**identity, **params} != identity:
+            self.ops.append((op, params))
+        return self
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def stages(self) -> List[Tuple[str, Any]]:
+        """
+        Group the ops into render stages: runs of point ops become a single
+        ("lut", table) stage, spatial ops stay in place.
+        """
+        stages: List[Tuple[str, Any]] = []
+        lut = None
+        for op, params in self.ops:
+            if op in POINT_OPS:
+                table = _as_channel_lut(POINT_OPS[op][0](**params))
+                # Applying `table` after `lut` is table[lut], per channel.
+                lut = table if lut is None else np.take_along_axis(table, lut.astype(np.intp), axis=1)
+                continue
+            if lut is not None:
+                stages.append(("lut", lut))
+                lut = None
+            stages.append((op, params))
+        if lut is not None:
+            stages.append(("lut", lut))
+        return stages
+
+    def apply(self, pixel_array: ImageBuffer, cache_key: Optional[Hashable] = None) -> ImageBuffer:
+        """
+        cache_key identifies pixel_array's content; with it, pixelation reuses
+        a cached summed-area table of the same intermediate image.
+        """
+        for op, arg in self.stages():
+            with timed_stage("op", op):
+                if op == "lut":
+                    pixel_array = apply_lut(pixel_array, arg)
+                elif op == "pixelate" and cache_key is not None:
+                    pixel_array = self._pixelate(pixel_array, arg, cache_key)
+                else:
+                    pixel_array = SPATIAL_OPS[op][0](pixel_array, **arg)
+            if cache_key is not None:
+                cache_key = (cache_key, _stage_key(op, arg))
+        return pixel_array
+
+    @staticmethod
+    def _pixelate(pixel_array: ImageBuffer, params: Dict[str, Any], cache_key: Hashable) -> ImageBuffer:
+        """
+        Pixelate through the cached engine of the input, then apply the colour
+        options with a palette fitted once per pixelated image: changing only
+        the colour count or dithering reuses the fit.
+        """
+        block, style = split_pixel_style(params)
+        if max(block.get("block_size", 1), block.get("block_height") or 1) > 1:
+            pixel_array = engine_cache.get(cache_key, pixel_array).pixelate(**block)
+        fit = None
+        if style["colors"] and not style["bw"]:
+            fit = palette_cache.get((cache_key, _stage_key("pixelate", block)), pixel_array)
+        return stylize(pixel_array, fit=fit, **style)
+
+    def scaled(self, factor: float) -> "EditPipeline":
+        """Equivalent pipeline for an image downscaled by `factor`."""
+        pipeline = EditPipeline()
+        for op, params in self.ops:
+            if op in SPATIAL_OPS:
+                params = SPATIAL_OPS[op][2](params, factor)
+            pipeline.add(op, **params)
+        return pipeline
+
+    @staticmethod
+    def _decode(image_bytes: bytes, scale: int, key: str) -> Tuple[int, int, ImageBuffer]:
+        start, hits = time.perf_counter(), decode_cache.hits
+        decoded = decode_cache.decode(image_bytes, scale, key)
+        observe_stage("decode", time.perf_counter() - start, "hit" if decode_cache.hits > hits else "miss")
+        return decoded
+
+    def render(self, image_bytes: bytes, scale: int = 1, profile: Union[str, EncodingProfile] = "working") -> bytes:
+        """
+        Decode, apply and encode once with the given encoding profile. With
+        scale > 1 the work is done on a reduced proxy, with spatial ops scaled
+        to keep the same look. Full-size images too big to render whole within
+        RENDER_JOB_MEMORY_LIMIT are rendered in strips.
+        """
+        profile = get_profile(profile)
+        if scale <= 1 and not self.ops and profile.format == "JPEG" and not profile.target_bytes:
+            # Nothing to do: the source (a Telegram JPEG) is as good as it gets.
+            return image_bytes
+        if scale <= 1 and not fits_whole(*image_size(image_bytes), settings.RENDER_JOB_MEMORY_LIMIT):
+            return render_in_strips(image_bytes, self.stages(), profile, settings.RENDER_JOB_MEMORY_LIMIT)
+        key = image_key(image_bytes)
+        width, height, arr = self._decode(image_bytes, max(1, scale), key)
+        pipeline = self
+        if scale > 1:
+            full_width, _ = image_size(image_bytes)
+            pipeline = self.scaled(full_width / width)
+        arr = pipeline.apply(arr, (key, width, height))
+        with timed_stage("encode", profile.name):
+            return encode_array_to_jpg(arr.width, arr.height, arr, profile)
+
+    def render_sheet(
+        self,
+        image_bytes: bytes,
+        variants: List[list],
+        labels: List[str],
+        long_side: int,
+        profile: Union[str, EncodingProfile] = "preview",
+    ) -> bytes:
+        """
+        Contact sheet of this pipeline followed by each of `variants` (one op
+        each). The image is decoded and run through this pipeline once, at
+        the smallest proxy that covers a cell, then every variant is applied
+        to that shared cell-sized result.
+        """
+        profile = get_profile(profile)
+        full_width, full_height = image_size(image_bytes)
+        cell_width, cell_height = contact_sheet.cell_size(full_width, full_height, len(variants), long_side)
+        key = image_key(image_bytes)
+        scale = proxy_scale(full_width, full_height, 8, max(cell_width, cell_height))
+        width, height, arr = self._decode(image_bytes, scale, key)
+        arr = self.scaled(full_width / width).apply(arr, (key, width, height))
+        with timed_stage("op", "resize"):
+            arr = contact_sheet.resize(arr, cell_width, cell_height)
+        # Pixelation variants share one summed-area table of the cell.
+        cell_key = (key, cell_width, cell_height, repr(self.to_list()))
+        cells = [
+            EditPipeline.from_list([variant]).scaled(full_width / cell_width).apply(arr, cell_key)
+            for variant in variants
+        ]
+        with timed_stage("op", "compose"):
+            sheet = contact_sheet.compose(cells, labels)
+        with timed_stage("encode", profile.name):
+            return encode_array_to_jpg(sheet.width, sheet.height, sheet, profile)
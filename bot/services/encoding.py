@@ -0,0 +1,107 @@
+"""
+Output encoding profiles.
+
+Each kind of output gets its own trade-off: previews only have to look right
+in a chat bubble, working copies are decoded again for later edits, and
+downloads are what the user keeps. A profile may set a byte-size target, which
+is met by searching for the highest quality that fits.
+"""
+
+import io
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+
+from PIL import Image
+
+from services.image_buffer import ImageBuffer
+import settings
+
+# PIL subsampling values
+SUBSAMPLING_444 = 0
+SUBSAMPLING_422 = 1
+SUBSAMPLING_420 = 2
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    name: str
+    format: str = "JPEG"  # JPEG, WEBP or PNG
+    quality: int = 85
+    subsampling: int = SUBSAMPLING_420
+    optimize: bool = False
+    progressive: bool = False
+    # WebP only
+    lossless: bool = False
+    # PNG only: zlib level; PNG is always lossless, lower is much faster
+    compress_level: int = 6
+    # Largest encoded size wanted; quality is lowered, down to min_quality, to fit
+    target_bytes: Optional[int] = None
+    min_quality: int = 40
+
+    def save_options(self, quality: Optional[int] = None) -> dict:
+        quality = self.quality if quality is None else quality
+        if self.format == "JPEG":
+            return {
+                "quality": quality,
+                "subsampling": self.subsampling,
+                "optimize": self.optimize,
+                "progressive": self.progressive,
+            }
+        if self.format == "WEBP":
+            return {"quality": quality, "lossless": self.lossless, "method": 4}
+        return {"optimize": self.optimize, "compress_level": self.compress_level}
+
+PROFILES: Dict[str, EncodingProfile] = {
+    # Shown while adjusting; small uploads matter more than fine detail.
+    "preview": EncodingProfile(
+        "preview",
+        format=settings.PREVIEW_FORMAT,
+        quality=settings.PREVIEW_QUALITY,
+        target_bytes=settings.PREVIEW_TARGET_BYTES or None,
+    ),
+    # Saved edits; re-decoded for every later edit, so keep generation loss low.
+    # Stays JPEG so proxy previews can use draft decoding.
+    "working": EncodingProfile(
+        "working",
+        quality=settings.WORKING_QUALITY,
+        subsampling=SUBSAMPLING_444,
+    ),
+    "download": EncodingProfile(
+        "download",
+        quality=settings.DOWNLOAD_QUALITY,
+        subsampling=SUBSAMPLING_444,
+        optimize=True,
+        progressive=True,
+    ),
+    "download_lossless": EncodingProfile("download_lossless", format="PNG", compress_level=1),
+}
+
+def get_profile(profile: Union[str, EncodingProfile]) -> EncodingProfile:
+    return PROFILES[profile] if isinstance(profile, str) else profile
+
+def _save(img: Image.Image, profile: EncodingProfile, quality: Optional[int] = None) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=profile.format, **profile.save_options(quality))
+    return buf.getvalue()
+
+def encode_array(pixel_array: ImageBuffer, profile: Union[str, EncodingProfile] = "working") -> bytes:
+    return encode_image(pixel_array.to_pil(), profile)
+
+def encode_image(img: Image.Image, profile: Union[str, EncodingProfile] = "working") -> bytes:
+    profile = get_profile(profile)
+    data = _save(img, profile)
+    lossy = profile.format == "JPEG" or (profile.format == "WEBP" and not profile.lossless)
+    if not profile.target_bytes or not lossy or len(data) <= profile.target_bytes:
+        return data
+
+    # Binary search for the highest quality within the target; if even
+    # min_quality is too big, min_quality is the best we can do.
+    low, high = profile.min_quality, profile.quality - 1
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = _save(img, profile, quality)
+        if len(candidate) <= profile.target_bytes:
+            best, low = candidate, quality + 1
+        else:
+            high = quality - 1
+    return best if best is not None else _save(img, profile, profile.min_quality)
@@ -0,0 +1,36 @@
+from collections import OrderedDict
+from typing import Optional
+
+import settings
+
+class FileIdRegistry:
+    """
+    Maps image content keys to the Telegram file_id of an earlier upload, so
+    the same bytes can be re-sent by reference instead of being uploaded again.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            self.misses += 1
+            return None
+        self._file_ids.move_to_end(key)
+        self.hits += 1
+        return file_id
+
+    def put(self, key: str, file_id: str) -> None:
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_entries:
+            self._file_ids.popitem(last=False)
+
+    def forget(self, key: str) -> None:
+        self._file_ids.pop(key, None)
+
+file_id_registry = FileIdRegistry(max_entries=settings.FILE_ID_REGISTRY_SIZE)
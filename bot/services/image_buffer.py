@@ -0,0 +1,53 @@
+import numpy as np
+from PIL import Image
+
+
+class ImageBuffer:
+    """
+    Compact RGB image: a contiguous uint8 array of shape (height, width, 3).
+    Converts to and from PIL images without per-pixel Python objects.
+    """
+
+    __slots__ = ("pixels",)
+
+    def __init__(self, pixels: np.ndarray):
+        if pixels.ndim != 3 or pixels.shape[2] != 3:
+            raise ValueError(f"Expected an HxWx3 array, got shape {pixels.shape}")
+        self.pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+
+    @classmethod
+    def empty(cls, width: int, height: int) -> "ImageBuffer":
+        return cls(np.zeros((height, width, 3), dtype=np.uint8))
+
+    @classmethod
+    def from_pil(cls, img: Image.Image) -> "ImageBuffer":
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return cls(np.asarray(img))
+
+    def to_pil(self) -> Image.Image:
+        # Shares memory with self.pixels; the buffer must outlive the image.
+        return Image.frombuffer(
+            "RGB", (self.width, self.height), self.pixels, "raw", "RGB", 0, 1
+        )
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.pixels.nbytes
+
+    def copy(self) -> "ImageBuffer":
+        return ImageBuffer(self.pixels.copy())
+
+    def __len__(self) -> int:
+        return self.height
+
+    def __repr__(self) -> str:
+        return f"ImageBuffer({self.width}x{self.height})"
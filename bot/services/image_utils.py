@@ -1,48 +1,85 @@
 
 import io
+from typing import Union
+
+import numpy as np
 from PIL import Image
 
-def decode_jpg_to_array(image_bytes: bytes):
+from services.encoding import EncodingProfile, encode_array
+from services.image_buffer import ImageBuffer
+from services.pixelate_engine import block_means, block_starts, expand_blocks
+
+def image_size(image_bytes: bytes) -> tuple[int, int]:
+    """Width and height from the image header, without decoding pixels."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        return img.size
+
+def proxy_scale(width: int, height: int, scale: int, min_side: int = 0) -> int:
+    """
+    Largest power-of-two reduction up to `scale` (1, 2, 4 or 8) that keeps the
+    longer side of the proxy at least `min_side` pixels.
+    """
+    scale = min(8, max(1, scale))
+    while scale > 1 and max(width, height) // scale < min_side:
+        scale //= 2
+    return scale
+
+def decode_jpg_to_array(image_bytes: bytes, scale: int = 1):
+    """
+    scale > 1 decodes a reduced proxy (1/2, 1/4 or 1/8) using the JPEG
+    decoder's DCT scaling, which is far cheaper than a full decode.
+    """
     with Image.open(io.BytesIO(image_bytes)) as img:
-        img = img.convert('RGB')
-        width, height = img.size
-        data = list(img.getdata())
-        pixel_array = [data[i*width:(i+1)*width] for i in range(height)]
-    return width, height, pixel_array
-
-def encode_array_to_jpg(width: int, height: int, pixel_array: list[list[tuple[int,int,int]]]) -> bytes:
-    flat_data = []
-    for row in pixel_array:
-        flat_data.extend(row)
-    new_img = Image.new('RGB', (width, height))
-    new_img.putdata(flat_data)
-    buf = io.BytesIO()
-    new_img.save(buf, format='JPEG')
-    return buf.getvalue()
-
-def apply_brightness(pixel_array: list[list[tuple[int,int,int]]], brightness_value: int):
+        if scale > 1:
+            full_size = img.size
+            img.draft("RGB", (max(1, img.width // scale), max(1, img.height // scale)))
+            if img.size == full_size:
+                # Not a JPEG: fall back to a box reduction
+                img = img.convert("RGB").reduce(scale)
+        pixel_array = ImageBuffer.from_pil(img)
+    return pixel_array.width, pixel_array.height, pixel_array
+
+def encode_array_to_jpg(
+    width: int, height: int, pixel_array: ImageBuffer, profile: Union[str, EncodingProfile] = "working"
+) -> bytes:
+    """Encode with a profile from services.encoding (JPEG unless the profile says otherwise)."""
+    if (pixel_array.width, pixel_array.height) != (width, height):
+        raise ValueError(
+            f"Buffer is {pixel_array.width}x{pixel_array.height}, expected {width}x{height}"
+        )
+    return encode_array(pixel_array, profile)
+
+def apply_lut(pixel_array: ImageBuffer, lut: np.ndarray) -> ImageBuffer:
+    """
+    Map every channel value through a 256-entry table.
+    `lut` is either shape (256,) for all channels or (3, 256) per channel.
+    """
+    lut = np.asarray(lut, dtype=np.uint8)
+    if lut.ndim == 1:
+        return ImageBuffer(lut[pixel_array.pixels])
+    channels = np.arange(3)
+    return ImageBuffer(lut[channels, pixel_array.pixels])
+
+def brightness_lut(brightness_value: int) -> np.ndarray:
+    values = np.arange(256, dtype=np.int32) + brightness_value
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+def contrast_lut(contrast_value: int) -> np.ndarray:
+    factor = 1 + (contrast_value / 100.0)
+    # trunc() matches the int() conversion of the original per-pixel formula
+    values = np.trunc((np.arange(256, dtype=np.float64) - 127.5) * factor + 127.5)
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+def apply_brightness(pixel_array: ImageBuffer, brightness_value: int):
     """
     brightness_value > 0 => lighten
     brightness_value < 0 => darken
     """
     if brightness_value == 0:
         return pixel_array
+    return apply_lut(pixel_array, brightness_lut(brightness_value))
 
-    height = len(pixel_array)
-    width = len(pixel_array[0]) if height else 0
-
-    new_array = []
-    for row in pixel_array:
-        new_row = []
-        for (r, g, b) in row:
-            nr = max(0, min(255, r + brightness_value))
-            ng = max(0, min(255, g + brightness_value))
-            nb = max(0, min(255, b + brightness_value))
-            new_row.append((nr, ng, nb))
-        new_array.append(new_row)
-    return new_array
-
-def apply_contrast(pixel_array: list[list[tuple[int,int,int]]], contrast_value: int):
+def apply_contrast(pixel_array: ImageBuffer, contrast_value: int):
     """
     A simple formula for contrast:
     factor = 1 + (contrast_value / 100)
@@ -50,49 +87,28 @@ def apply_contrast(pixel_array: list[list[tuple[int,int,int]]], contrast_value:
     """
     if contrast_value == 0:
         return pixel_array
+    return apply_lut(pixel_array, contrast_lut(contrast_value))
 
-    factor = 1 + (contrast_value / 100.0)
-    height = len(pixel_array)
-    width = len(pixel_array[0]) if height else 0
-
-    new_array = []
-    for row in pixel_array:
-        new_row = []
-        for (r, g, b) in row:
-            nr = int((r - 127.5) * factor + 127.5)
-            ng = int((g - 127.5) * factor + 127.5)
-            nb = int((b - 127.5) * factor + 127.5)
-            # clamp
-            nr = max(0, min(255, nr))
-            ng = max(0, min(255, ng))
-            nb = max(0, min(255, nb))
-            new_row.append((nr, ng, nb))
-        new_array.append(new_row)
-    return new_array
-
-def pixelate_array(pixel_array, block_size: int):
-    if block_size <= 1:
+def pixelate_array(pixel_array: ImageBuffer, block_size: int, block_height: int = None, anchor: str = "top-left"):
+    """
+    Replace every block_size x block_height block (square by default) with its
+    (floored) mean colour. Edge blocks are averaged over the pixels they
+    actually cover. One pass over the pixels; to try several block sizes on
+    the same image, services.pixelate_engine reuses a summed-area table.
+    """
+    block_height = block_height or block_size
+    if block_size <= 1 and block_height <= 1:
         return pixel_array  # No pixelation
-    height = len(pixel_array)
-    width = len(pixel_array[0]) if height else 0
-
-    new_array = []
-    for row_start in range(0, height, block_size):
-        for row_offset in range(block_size):
-            if row_start + row_offset >= height:
-                break
-            new_row = []
-            for col_start in range(0, width, block_size):
-                block_pixels = []
-                for rr in range(row_start, min(row_start + block_size, height)):
-                    for cc in range(col_start, min(col_start + block_size, width)):
-                        block_pixels.append(pixel_array[rr][cc])
-                avg_r = sum(p[0] for p in block_pixels) // len(block_pixels)
-                avg_g = sum(p[1] for p in block_pixels) // len(block_pixels)
-                avg_b = sum(p[2] for p in block_pixels) // len(block_pixels)
-                for _ in range(block_size):
-                    if len(new_row) < width:
-                        new_row.append((avg_r, avg_g, avg_b))
-            new_row = new_row[:width]
-            new_array.append(new_row)
-    return new_array[:height]
+    height, width = pixel_array.height, pixel_array.width
+    if height == 0 or width == 0:
+        return pixel_array
+
+    row_starts = block_starts(height, max(1, block_height), anchor)
+    col_starts = block_starts(width, max(1, block_size), anchor)
+
+    sums = np.add.reduceat(pixel_array.pixels.astype(np.uint32), row_starts, axis=0)
+    sums = np.add.reduceat(sums, col_starts, axis=1)
+
+    block_h = np.diff(np.append(row_starts, height))
+    block_w = np.diff(np.append(col_starts, width))
+    return expand_blocks(block_means(sums, block_h, block_w), block_h, block_w)
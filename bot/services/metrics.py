@@ -0,0 +1,242 @@
+"""
+In-process metrics with a Prometheus text exposition endpoint.
+
+Stage timings are kept as summaries over a sliding window of recent
+observations (p50/p95/p99 plus running count and sum), labelled by stage,
+handler and op. The handler label comes from `handler_label`, which the
+metrics middleware sets for each update. Code running in a render worker
+process can't reach this registry: jobs are wrapped in collect_stages(),
+and the timings they return are recorded by the RenderService.
+"""
+
+import contextvars
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from aiohttp import web
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+# Name of the handler the current update is routed to
+handler_label: contextvars.ContextVar[str] = contextvars.ContextVar("handler_label", default="")
+# Set while a render job runs under collect_stages()
+_collected: contextvars.ContextVar[Optional[List[Tuple[str, str, float]]]] = contextvars.ContextVar(
+    "collected_stages", default=None
+)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _quantile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value:g}"
+
+class Histogram(_Metric):
+    """Latency distribution per label set; exported as a Prometheus summary."""
+
+    kind = "summary"
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), window: int = 1024):
+        super().__init__(name, help_text, labelnames)
+        self.window = window
+        self._recent: Dict[LabelValues, Deque[float]] = {}
+        self._count: Dict[LabelValues, int] = {}
+        self._sum: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        recent = self._recent.get(key)
+        if recent is None:
+            recent = self._recent[key] = deque(maxlen=self.window)
+        recent.append(value)
+        self._count[key] = self._count.get(key, 0) + 1
+        self._sum[key] = self._sum.get(key, 0.0) + value
+
+    def quantile(self, q: float, **labels) -> float:
+        return _quantile(sorted(self._recent.get(self._key(labels), ())), q)
+
+    def count(self, **labels) -> int:
+        return self._count.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        for key in sorted(self._recent):
+            recent = sorted(self._recent[key])
+            for q in self.QUANTILES:
+                labels = _format_labels(self.labelnames, key, f'quantile="{q}"')
+                yield f"{self.name}{labels} {_quantile(recent, q):.6f}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {self._sum[key]:.6f}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {self._count[key]}"
+
+class Gauge(_Metric):
+    """Value read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        super().__init__(name, help_text)
+        self.read = read
+
+    def samples(self) -> Iterator[str]:
+        yield f"{self.name} {self.read():g}"
+
+class MetricsRegistry:
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f"Metric {metric.name} already registered as a {existing.kind}")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, self.window))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> Gauge:
+        # Re-registering replaces the callback, e.g. for a new dispatcher.
+        gauge = Gauge(name, help_text, read)
+        self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        blocks = []
+        for metric in self._metrics.values():
+            try:
+                blocks.append(metric.render())
+            except Exception:
+                logger.exception("Failed to render metric %s", metric.name)
+        return "\n".join(blocks) + "\n"
+
+registry = MetricsRegistry(window=settings.METRICS_WINDOW)
+
+stage_seconds = registry.histogram(
+    "pixelate_bot_stage_seconds",
+    "Time spent in each stage of handling an update",
+    ("stage", "handler", "op"),
+)
+renders_total = registry.counter(
+    "pixelate_bot_renders_total",
+    "Render jobs run, by job",
+    ("job", "handler"),
+)
+uploaded_bytes_total = registry.counter(
+    "pixelate_bot_uploaded_bytes_total",
+    "Image bytes uploaded to Telegram",
+    ("handler",),
+)
+photo_sends_total = registry.counter(
+    "pixelate_bot_photo_sends_total",
+    "Photos sent or edited in, by whether a file_id was reused",
+    ("handler", "mode"),
+)
+
+outbound_retries_total = registry.counter(
+    "pixelate_bot_outbound_retries_total",
+    "Bot API requests retried after a flood-control RetryAfter",
+    ("method",),
+)
+outbound_coalesced_total = registry.counter(
+    "pixelate_bot_outbound_coalesced_total",
+    "Message edits dropped because a newer edit of the same message replaced them",
+    ("method",),
+)
+
+def observe_stage(stage: str, seconds: float, op: str = "") -> None:
+    collected = _collected.get()
+    if collected is not None:
+        collected.append((stage, op, seconds))
+        return
+    stage_seconds.observe(seconds, stage=stage, handler=handler_label.get(), op=op)
+
+@contextmanager
+def timed_stage(stage: str, op: str = "") -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, op)
+
+def collect_stages(func: Callable[..., Any], *args: Any) -> Tuple[Any, List[Tuple[str, str, float]]]:
+    """Run func(*args), returning its result and the stage timings it recorded."""
+    collected: List[Tuple[str, str, float]] = []
+    token = _collected.set(collected)
+    try:
+        return func(*args), collected
+    finally:
+        _collected.reset(token)
+
+def record_stages(collected: List[Tuple[str, str, float]]) -> None:
+    for stage, op, seconds in collected:
+        observe_stage(stage, seconds, op)
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve registry.render() at http://host:port/metrics."""
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics available at http://%s:%d/metrics", host, port)
+    return runner
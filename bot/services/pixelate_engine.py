@@ -0,0 +1,121 @@
+"""
+Summed-area-table pixelation.
+
+A PixelationEngine builds the integral image of a buffer once; after that any
+block size costs one gather per block corner plus writing the output, instead
+of a full pass over the pixels. Engines are kept in a per-process LRU keyed by
+what produced the buffer, so stepping through pixel sizes on the same image
+reuses the table.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import numpy as np
+
+from services.image_buffer import ImageBuffer
+import settings
+
+ANCHORS = ("top-left", "center")
+# Block sums are taken modulo 2**32; they are exact while they stay below it.
+MAX_BLOCK_SUM = 2 ** 32
+
+def block_starts(length: int, size: int, anchor: str = "top-left") -> np.ndarray:
+    """
+    Start offsets of the blocks covering [0, length). "center" shifts the
+    grid so the partial blocks are split evenly between both edges.
+    """
+    if anchor not in ANCHORS:
+        raise ValueError(f"Unknown anchor: {anchor}")
+    offset = 0
+    if anchor == "center" and length % size:
+        offset = (size - length % size) // 2
+    starts = np.arange(size - offset if offset else 0, length, size)
+    return np.concatenate(([0], starts)) if offset else starts
+
+def block_means(sums: np.ndarray, block_h: np.ndarray, block_w: np.ndarray) -> np.ndarray:
+    """Floored mean colour per block from per-block channel sums."""
+    counts = (block_h[:, None] * block_w[None, :])[:, :, None].astype(sums.dtype)
+    return (sums // counts).astype(np.uint8)
+
+def expand_blocks(means: np.ndarray, block_h: np.ndarray, block_w: np.ndarray) -> ImageBuffer:
+    return ImageBuffer(np.repeat(np.repeat(means, block_h, axis=0), block_w, axis=1))
+
+class PixelationEngine:
+    def __init__(self, pixel_array: ImageBuffer):
+        self.height, self.width = pixel_array.height, pixel_array.width
+        # uint32 wraps on large images, but block sums are differences of
+        # table entries and fit (see MAX_BLOCK_SUM), so modular arithmetic
+        # keeps them exact.
+        sat = np.zeros((self.height + 1, self.width + 1, 3), dtype=np.uint32)
+        np.cumsum(pixel_array.pixels, axis=0, dtype=np.uint32, out=sat[1:, 1:])
+        np.cumsum(sat[1:, 1:], axis=1, dtype=np.uint32, out=sat[1:, 1:])
+        self.sat = sat
+
+    @property
+    def nbytes(self) -> int:
+        return self.sat.nbytes
+
+    def block_sums(self, row_starts: np.ndarray, col_starts: np.ndarray) -> np.ndarray:
+        rows = np.append(row_starts, self.height)
+        cols = np.append(col_starts, self.width)
+        corners = self.sat[rows[:, None], cols[None, :]]
+        return corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+
+    def pixelate(self, block_size: int, block_height: Optional[int] = None, anchor: str = "top-left") -> ImageBuffer:
+        """
+        Replace every block_size x block_height block (square by default) with
+        its floored mean colour; edge blocks average the pixels they cover.
+        """
+        block_width, block_height = max(1, block_size), max(1, block_height or block_size)
+        row_starts = block_starts(self.height, block_height, anchor)
+        col_starts = block_starts(self.width, block_width, anchor)
+        return self.pixelate_grid(row_starts, col_starts)
+
+    def pixelate_grid(self, row_starts: np.ndarray, col_starts: np.ndarray) -> ImageBuffer:
+        """Pixelate with explicit block start offsets; both must begin at 0."""
+        block_h = np.diff(np.append(row_starts, self.height))
+        block_w = np.diff(np.append(col_starts, self.width))
+        if int(block_h.max()) * int(block_w.max()) * 255 >= MAX_BLOCK_SUM:
+            raise ValueError("Block too large for exact uint32 block sums")
+        means = block_means(self.block_sums(row_starts, col_starts), block_h, block_w)
+        return expand_blocks(means, block_h, block_w)
+
+class EngineCache:
+    """Byte-bounded LRU of PixelationEngines."""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self._engines: "OrderedDict[Hashable, PixelationEngine]" = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, pixel_array: ImageBuffer) -> PixelationEngine:
+        """Engine cached under key, or a new one built from pixel_array."""
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None:
+                self._engines.move_to_end(key)
+                self.hits += 1
+                return engine
+            self.misses += 1
+        engine = PixelationEngine(pixel_array)
+        with self._lock:
+            if engine.nbytes <= self.budget and key not in self._engines:
+                self._engines[key] = engine
+                self._nbytes += engine.nbytes
+                while self._nbytes > self.budget:
+                    _, evicted = self._engines.popitem(last=False)
+                    self._nbytes -= evicted.nbytes
+        return engine
+
+    def clear(self) -> None:
+        with self._lock:
+            self._engines.clear()
+            self._nbytes = 0
+
+# Per process: each render worker keeps its own tables.
+engine_cache = EngineCache(settings.PIXELATE_SAT_CACHE_BUDGET)
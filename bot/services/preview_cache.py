@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from models.user_data import UserData
+from services.render_jobs import render_preview
+from services.render_scheduler import Priority, RenderScheduler
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, Hashable]
+
+def _op_key(op: list) -> Hashable:
+    name, params = op
+    return name, tuple(sorted(params.items()))
+
+class _SessionCache:
+    def __init__(self, image_key: Optional[str]):
+        self.image_key = image_key
+        self.entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self.nbytes = 0
+        self.prefetch_task: Optional[asyncio.Task] = None
+        self.prefetch_generation = 0
+
+class PreviewCache:
+    """
+    Rendered previews per chat, keyed by (current image key, op, params).
+
+    A session's entries are dropped as soon as it asks for a different current
+    image. Each session is LRU-bounded by `session_budget` bytes, and whole
+    sessions are evicted least-recently-used first past `total_budget`.
+    """
+
+    def __init__(self, session_budget: int, total_budget: int):
+        self.session_budget = session_budget
+        self.total_budget = total_budget
+        self._sessions: "OrderedDict[int, _SessionCache]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, CacheKey], asyncio.Future] = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _session(self, chat_id: int, image_key: Optional[str]) -> _SessionCache:
+        session = self._sessions.get(chat_id)
+        if session is None:
+            session = self._sessions[chat_id] = _SessionCache(image_key)
+        elif session.image_key != image_key:
+            # Current image changed: nothing cached for the old one is useful.
+            self.nbytes -= session.nbytes
+            session.entries.clear()
+            session.nbytes = 0
+            session.image_key = image_key
+        self._sessions.move_to_end(chat_id)
+        return session
+
+    def get(self, chat_id: int, image_key: str, op: list) -> Optional[bytes]:
+        session = self._session(chat_id, image_key)
+        data = session.entries.get(_op_key(op))
+        if data is None:
+            self.misses += 1
+            return None
+        session.entries.move_to_end(_op_key(op))
+        self.hits += 1
+        return data
+
+    def put(self, chat_id: int, image_key: str, op: list, data: bytes) -> None:
+        if len(data) > self.session_budget:
+            return
+        session = self._session(chat_id, image_key)
+        key = _op_key(op)
+        old = session.entries.pop(key, None)
+        if old is not None:
+            session.nbytes -= len(old)
+            self.nbytes -= len(old)
+        session.entries[key] = data
+        session.nbytes += len(data)
+        self.nbytes += len(data)
+        while session.nbytes > self.session_budget:
+            _, evicted = session.entries.popitem(last=False)
+            session.nbytes -= len(evicted)
+            self.nbytes -= len(evicted)
+        while self.nbytes > self.total_budget and len(self._sessions) > 1:
+            oldest_id = next(iter(self._sessions))
+            if oldest_id == chat_id:
+                break
+            self.drop_session(oldest_id)
+
+    def drop_session(self, chat_id: int) -> None:
+        session = self._sessions.pop(chat_id, None)
+        if session is None:
+            return
+        self.nbytes -= session.nbytes
+        if session.prefetch_task is not None:
+            session.prefetch_task.cancel()
+
+    async def render(self, chat_id: int, user_data: UserData, op: list, render_scheduler: RenderScheduler) -> bytes:
+        """Return the cached preview of op, rendering (or joining a prefetch) on a miss."""
+        image_key = user_data.current_image_key
+        cached = self.get(chat_id, image_key, op)
+        if cached is not None:
+            return cached
+        inflight = self._inflight.get((chat_id, (image_key, _op_key(op))))
+        if inflight is not None:
+            # A cancelled or failed prefetch falls through to a fresh render.
+            await asyncio.wait({inflight})
+            if not inflight.cancelled() and inflight.exception() is None:
+                return inflight.result()
+        return await self._render(chat_id, user_data, op, render_scheduler, Priority.PREVIEW)
+
+    async def _render(
+        self, chat_id: int, user_data: UserData, op: list, render_scheduler: RenderScheduler, priority: Priority
+    ) -> bytes:
+        image_key = user_data.current_image_key
+        flight_key = (chat_id, (image_key, _op_key(op)))
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[flight_key] = future
+        try:
+            source, ops = user_data.render_plan(op)
+            data = await render_scheduler.submit(chat_id, priority, render_preview, source, ops)
+            self.put(chat_id, image_key, op, data)
+            future.set_result(data)
+            return data
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited future doesn't log a warning.
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(flight_key, None)
+
+    def prefetch(self, chat_id: int, user_data: UserData, ops: List[list], render_scheduler: RenderScheduler) -> None:
+        """
+        Render ops in the background, in order, skipping cached ones.
+        Supersedes any prefetch still running for the chat; a render that is
+        already in flight is left to finish, since its result may still be used.
+        """
+        if not user_data.current_image_key:
+            return
+        session = self._session(chat_id, user_data.current_image_key)
+        session.prefetch_generation += 1
+        session.prefetch_task = asyncio.create_task(
+            self._prefetch(chat_id, user_data, ops, render_scheduler, session.prefetch_generation)
+        )
+
+    async def _prefetch(
+        self, chat_id: int, user_data: UserData, ops: List[list], render_scheduler: RenderScheduler, generation: int
+    ) -> None:
+        image_key = user_data.current_image_key
+        for op in ops:
+            flight_key = (chat_id, (image_key, _op_key(op)))
+            session = self._sessions.get(chat_id)
+            if session is None or session.image_key != image_key or session.prefetch_generation != generation:
+                return
+            if _op_key(op) in session.entries or flight_key in self._inflight:
+                continue
+            try:
+                await self._render(chat_id, user_data, op, render_scheduler, Priority.PREFETCH)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.debug("Prefetch of %s failed", op, exc_info=True)
+                return
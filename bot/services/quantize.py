@@ -0,0 +1,181 @@
+"""
+Colour reduction for the pixelate menu: median-cut palettes, ordered and
+Floyd-Steinberg dithering, and black-and-white thresholding.
+
+A PaletteFit runs median cut on a subsample once, up to MAX_COLORS, and
+records the order of its splits; the palette for any smaller colour count is
+the set of boxes alive after that many splits, so changing the count never
+refits. Fits are kept in a per-process LRU keyed by what produced the image.
+Mapping pixels to a palette and Floyd-Steinberg error diffusion are done by
+Pillow's quantizer.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from services.image_buffer import ImageBuffer
+
+DITHERS = ("none", "ordered", "fs")
+# Palettes are fitted to this many colours; the menu offers up to 32
+MAX_COLORS = 64
+SAMPLE_SIZE = 32_768
+
+def _bayer(n: int) -> np.ndarray:
+    """n x n ordered-dither matrix with thresholds in (0, 1)."""
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while matrix.shape[0] < n:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) / matrix.size
+
+BAYER_8 = _bayer(8)
+
+def _bayer_tile(height: int, width: int, row_offset: int = 0) -> np.ndarray:
+    """The Bayer matrix tiled over an image whose first row is row_offset of the whole."""
+    rows = (np.arange(height) + row_offset) % 8
+    cols = np.arange(width) % 8
+    return BAYER_8[rows[:, None], cols[None, :]]
+
+def sample_indices(pixel_count: int, size: int = SAMPLE_SIZE) -> np.ndarray:
+    """Flat indices of the pixels a palette is fitted to."""
+    if pixel_count <= size:
+        return np.arange(pixel_count)
+    # Fixed seed: the same image always gets the same palette.
+    return np.random.default_rng(0).integers(0, pixel_count, size)
+
+def sample_pixels(pixel_array: ImageBuffer, size: int = SAMPLE_SIZE) -> np.ndarray:
+    flat = pixel_array.pixels.reshape(-1, 3)
+    return flat[sample_indices(len(flat), size)]
+
+class PaletteFit:
+    def __init__(self, samples: np.ndarray, max_colors: int = MAX_COLORS):
+        """samples: (n, 3) uint8 colours, e.g. from sample_pixels()."""
+        # Per median-cut box: mean colour, the split that created it and the
+        # split that divided it (never, if it is still a leaf)
+        self._means: List[np.ndarray] = []
+        self._born: List[int] = []
+        self._divided: List[float] = []
+        # Leaves still open to splitting: box -> (score, widest channel, members)
+        leaves = {}
+        self._add_box(leaves, samples, 0)
+        splits = 0
+        while splits < max_colors - 1 and leaves:
+            box = max(leaves, key=lambda leaf: leaves[leaf][0])
+            _, channel, members = leaves.pop(box)
+            members = members[np.argsort(members[:, channel], kind="stable")]
+            half = len(members) // 2
+            splits += 1
+            self._divided[box] = splits
+            self._add_box(leaves, members[:half], splits)
+            self._add_box(leaves, members[half:], splits)
+        self.splits = splits
+        self._means_array = np.array(self._means, dtype=np.uint8)
+        self._born_array = np.array(self._born)
+        self._divided_array = np.array(self._divided)
+
+    def _add_box(self, leaves: dict, members: np.ndarray, born: int) -> None:
+        self._means.append(np.rint(members.mean(axis=0)))
+        self._born.append(born)
+        self._divided.append(np.inf)
+        spread = members.max(axis=0).astype(np.int64) - members.min(axis=0)
+        if spread.max() > 0:
+            # Split the box with the most spread, weighted by how many samples it holds.
+            leaves[len(self._means) - 1] = (int(spread.max()) * len(members), int(spread.argmax()), members)
+
+    def palette(self, colors: int) -> np.ndarray:
+        """(n, 3) uint8 palette of at most `colors` colours."""
+        step = min(max(1, colors) - 1, self.splits)
+        alive = (self._born_array <= step) & (self._divided_array > step)
+        return self._means_array[alive]
+
+class PaletteCache:
+    """Count-bounded LRU of PaletteFits."""
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self._fits: "OrderedDict[Hashable, PaletteFit]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, pixel_array: ImageBuffer) -> PaletteFit:
+        with self._lock:
+            fit = self._fits.get(key)
+            if fit is not None:
+                self._fits.move_to_end(key)
+                self.hits += 1
+                return fit
+            self.misses += 1
+        fit = PaletteFit(sample_pixels(pixel_array))
+        with self._lock:
+            self._fits[key] = fit
+            while len(self._fits) > self.size:
+                self._fits.popitem(last=False)
+        return fit
+
+# Per process, like the pixelation engines
+palette_cache = PaletteCache()
+
+def _palette_image(palette: np.ndarray) -> Image.Image:
+    img = Image.new("P", (1, 1))
+    # Unused entries repeat the first colour, so they never win a lookup.
+    padded = np.concatenate([palette, np.repeat(palette[:1], 256 - len(palette), axis=0)])
+    img.putpalette(padded.astype(np.uint8).tobytes())
+    return img
+
+def quantize_array(
+    pixel_array: ImageBuffer,
+    colors: int,
+    dither: str = "none",
+    fit: Optional[PaletteFit] = None,
+    row_offset: int = 0,
+) -> ImageBuffer:
+    """Reduce to a median-cut palette of `colors` colours, optionally dithered."""
+    if dither not in DITHERS:
+        raise ValueError(f"Unknown dither: {dither}")
+    palette = (fit or PaletteFit(sample_pixels(pixel_array))).palette(colors)
+    pixels = pixel_array.pixels
+    if dither == "ordered":
+        # Spread roughly one palette step, so flat areas alternate between neighbours.
+        spread = 255.0 / max(1.0, round(len(palette) ** (1 / 3)))
+        offset = np.rint((_bayer_tile(pixel_array.height, pixel_array.width, row_offset) - 0.5) * spread).astype(np.int16)
+        pixels = np.clip(pixels + offset[:, :, None], 0, 255).astype(np.uint8)
+    img = Image.fromarray(pixels)
+    method = Image.Dither.FLOYDSTEINBERG if dither == "fs" else Image.Dither.NONE
+    return ImageBuffer.from_pil(img.quantize(palette=_palette_image(palette), dither=method).convert("RGB"))
+
+def threshold_array(pixel_array: ImageBuffer, level: int = 128, dither: str = "none", row_offset: int = 0) -> ImageBuffer:
+    """Black and white: pixels with luma at or above `level` turn white."""
+    if dither not in DITHERS:
+        raise ValueError(f"Unknown dither: {dither}")
+    luma = pixel_array.to_pil().convert("L")
+    if dither == "fs":
+        # Pillow's 1-bit conversion diffuses around 128; shift luma to move the threshold.
+        shifted = np.clip(np.asarray(luma, dtype=np.int16) + (128 - level), 0, 255).astype(np.uint8)
+        return ImageBuffer.from_pil(Image.fromarray(shifted).convert("1").convert("RGB"))
+    luma = np.asarray(luma, dtype=np.int16)
+    if dither == "ordered":
+        luma = luma + np.rint((0.5 - _bayer_tile(pixel_array.height, pixel_array.width, row_offset)) * 255).astype(np.int16)
+    white = luma >= level
+    return ImageBuffer(np.repeat((white * np.uint8(255))[:, :, None], 3, axis=2))
+
+def stylize(
+    pixel_array: ImageBuffer,
+    colors: int = 0,
+    dither: str = "none",
+    bw: int = 0,
+    fit: Optional[PaletteFit] = None,
+    row_offset: int = 0,
+) -> ImageBuffer:
+    """
+    The colour options of a pixelate op: bw > 0 thresholds at that level,
+    otherwise colors > 0 reduces the palette; dither applies to either.
+    """
+    if bw:
+        return threshold_array(pixel_array, bw, dither, row_offset)
+    if colors:
+        return quantize_array(pixel_array, colors, dither, fit, row_offset)
+    return pixel_array
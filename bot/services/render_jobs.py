@@ -0,0 +1,58 @@
+"""
+Top-level render jobs. They take and return encoded image bytes so they can be
+pickled cheaply into worker processes.
+"""
+
+import settings
+from services.contact_sheet import resize
+from services.edit_pipeline import EditPipeline
+from services.encoding import PROFILES, encode_array
+from services.image_utils import decode_jpg_to_array, image_size, proxy_scale
+
+# Bump when a job's output for the same arguments changes, so results cached
+# on disk by an older version are not served.
+CACHE_VERSION = 1
+
+def cache_salt() -> str:
+    """What job outputs depend on besides their arguments, for shared_cache.job_key()."""
+    return repr((
+        CACHE_VERSION,
+        sorted(PROFILES.items()),
+        settings.PREVIEW_SCALE,
+        settings.PREVIEW_MIN_SIDE,
+        settings.COMPARE_SHEET_SIDE,
+        settings.DISPLAY_MAX_SIDE,
+    ))
+
+def render_pipeline(image_bytes: bytes, ops: list, profile: str = "working") -> bytes:
+    """Apply a serialized EditPipeline to image_bytes in one decode/encode."""
+    return EditPipeline.from_list(ops).render(image_bytes, profile=profile)
+
+def _display_scale(width: int, height: int) -> int:
+    """Smallest power-of-two reduction, up to 8, to at most DISPLAY_MAX_SIDE on the longer side."""
+    scale = 1
+    while scale < 8 and max(width, height) / scale > settings.DISPLAY_MAX_SIDE:
+        scale *= 2
+    return scale
+
+def render_preview(image_bytes: bytes, ops: list) -> bytes:
+    """Like render_pipeline, but on a reduced proxy of the image."""
+    width, height = image_size(image_bytes)
+    # Full-resolution documents get a smaller proxy, no bigger than they are shown.
+    scale = max(proxy_scale(width, height, settings.PREVIEW_SCALE, settings.PREVIEW_MIN_SIDE), _display_scale(width, height))
+    return EditPipeline.from_list(ops).render(image_bytes, scale, profile="preview")
+
+def render_contact_sheet(image_bytes: bytes, ops: list, variants: list, labels: list) -> bytes:
+    """Numbered grid of ops followed by each variant op, from one proxy decode."""
+    return EditPipeline.from_list(ops).render_sheet(image_bytes, variants, labels, settings.COMPARE_SHEET_SIDE)
+
+def render_display(image_bytes: bytes) -> bytes:
+    """A JPEG copy to show as a Telegram photo, at most DISPLAY_MAX_SIDE pixels on the longer side."""
+    width, height = image_size(image_bytes)
+    # Cheap proxy decode to the last power of two still over the limit, then resized
+    scale = max(1, _display_scale(width, height) // 2)
+    _, _, arr = decode_jpg_to_array(image_bytes, scale)
+    ratio = settings.DISPLAY_MAX_SIDE / max(arr.width, arr.height)
+    if ratio < 1:
+        arr = resize(arr, max(1, round(arr.width * ratio)), max(1, round(arr.height * ratio)))
+    return encode_array(arr, "working")
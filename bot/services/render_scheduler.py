@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from enum import IntEnum
+from functools import partial
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from services.metrics import handler_label, observe_stage
+from services.render_service import RenderService, RenderTimeoutError
+from services.shared_cache import DiskCache, job_key
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "The bot is busy right now, please try again in a moment."
+
+class SchedulerBusyError(Exception):
+    """The render queue is full; the request was rejected without waiting."""
+
+class Priority(IntEnum):
+    # Lower value runs first
+    SAVE = 0
+    PREVIEW = 1
+    PREFETCH = 2
+
+class _Job:
+    __slots__ = ("chat_id", "priority", "func", "args", "timeout", "cache_key", "future", "waiters", "enqueued_at", "handler")
+
+    def __init__(
+        self,
+        chat_id: int,
+        priority: Priority,
+        func: Callable[..., Any],
+        args: tuple,
+        timeout: Optional[float],
+        cache_key: Optional[str],
+    ):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.timeout = timeout
+        self.cache_key = cache_key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Callers awaiting the result: the submitter and any identical submits
+        self.waiters = 0
+        self.enqueued_at = time.monotonic()
+        # Workers run in their own tasks; carry the metrics label over.
+        self.handler = handler_label.get()
+
+class RenderScheduler:
+    """
+    Single entry point for image work in front of the RenderService.
+
+    Jobs wait in a bounded queue and run on at most `concurrency` pool slots.
+    Higher priorities run first. Within a priority, chats are served
+    round-robin, so one user queueing many renders can't starve the rest.
+    Past `max_queue_depth` queued jobs, submit() fails fast with
+    SchedulerBusyError. Prefetch jobs are only admitted while there is idle
+    capacity. With a cache, a job whose result is cached (for any chat)
+    returns it without queueing, and one identical to a job already queued
+    waits for that job's result; the job is only cancelled once all its
+    callers gave up. `cache_salt` is what results depend on besides the
+    job's arguments.
+    """
+
+    def __init__(
+        self,
+        render_service: RenderService,
+        concurrency: int,
+        max_queue_depth: int,
+        cache: Optional[DiskCache] = None,
+        cache_salt: str = "",
+    ):
+        self.render_service = render_service
+        self.cache = cache
+        self.cache_salt = cache_salt
+        self.concurrency = max(1, concurrency)
+        self.max_queue_depth = max_queue_depth
+        # priority -> chat_id -> queued jobs; chat order is the round-robin order
+        self._queues: Dict[Priority, "OrderedDict[int, Deque[_Job]]"] = {p: OrderedDict() for p in Priority}
+        self._depth = 0
+        self._running = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        # Queued or running cacheable jobs, by cache key
+        self._inflight: Dict[str, _Job] = {}
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.cached = 0
+        # Slots held by jobs that timed out but still run in the pool
+        self.overrunning = 0
+        self.recent_waits: Deque[float] = deque(maxlen=1000)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._depth
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"render-scheduler-{i}")
+            for i in range(self.concurrency)
+        ]
+
+    async def shutdown(self) -> None:
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for queues in self._queues.values():
+            for jobs in queues.values():
+                for job in jobs:
+                    job.future.cancel()
+            queues.clear()
+        self._depth = 0
+
+    async def submit(
+        self,
+        chat_id: int,
+        priority: Priority,
+        func: Callable[..., Any],
+        *args: Any,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """Queue func(*args) for chat_id and await its result."""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = job_key(func, args, self.cache_salt)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                self.cached += 1
+                return cached
+            running = self._inflight.get(cache_key)
+            if running is not None:
+                # The same job is queued for another chat; a failed one falls
+                # through to a job of our own.
+                try:
+                    result = await self._wait(running)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    pass
+                else:
+                    self.cached += 1
+                    return result
+        if not self._workers:
+            self.start()
+        if priority == Priority.PREFETCH and self._depth + self._running >= self.concurrency:
+            raise SchedulerBusyError("No idle capacity for prefetch")
+        if self._depth >= self.max_queue_depth:
+            self.rejected += 1
+            logger.warning("Render queue full (%d jobs), rejecting chat %s", self._depth, chat_id)
+            raise SchedulerBusyError("Render queue is full")
+
+        job = _Job(chat_id, priority, func, args, timeout, cache_key)
+        if cache_key is not None:
+            self._inflight[cache_key] = job
+            job.future.add_done_callback(partial(self._job_done, cache_key))
+        self._queues[priority].setdefault(chat_id, deque()).append(job)
+        self._depth += 1
+        self.submitted += 1
+        self._wakeup.set()
+        return await self._wait(job)
+
+    async def _wait(self, job: _Job) -> Any:
+        job.waiters += 1
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            job.waiters -= 1
+            if not job.waiters:
+                # Every caller gave up: a job that hasn't started is dropped.
+                job.future.cancel()
+                self._discard(job)
+            raise
+
+    def _job_done(self, cache_key: str, future: asyncio.Future) -> None:
+        job = self._inflight.get(cache_key)
+        if job is not None and job.future is future:
+            del self._inflight[cache_key]
+
+    def _discard(self, job: _Job) -> None:
+        """Take a cancelled job out of the queue, so it no longer counts towards its depth."""
+        queues = self._queues[job.priority]
+        jobs = queues.get(job.chat_id)
+        if jobs is None or job not in jobs:
+            return  # Already running, or dropped by shutdown()
+        jobs.remove(job)
+        self._depth -= 1
+        if not jobs:
+            del queues[job.chat_id]
+
+    def _pop_next(self) -> Optional[_Job]:
+        for priority in Priority:
+            queues = self._queues[priority]
+            while queues:
+                chat_id, jobs = next(iter(queues.items()))
+                job = jobs.popleft()
+                self._depth -= 1
+                # Move the chat to the back of the round-robin order.
+                del queues[chat_id]
+                if jobs:
+                    queues[chat_id] = jobs
+                if not job.future.cancelled():
+                    return job
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            job = self._pop_next()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = time.monotonic() - job.enqueued_at
+            self.recent_waits.append(wait)
+            handler_label.set(job.handler)
+            observe_stage("queue", wait)
+            self._running += 1
+            try:
+                result = await self.render_service.run(
+                    job.func, *job.args, timeout=job.timeout, owner=job.chat_id
+                )
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.cancelled():
+                    job.future.set_exception(e)
+                if isinstance(e, RenderTimeoutError) and e.pending is not None:
+                    # The caller has its error, but the job still runs in the
+                    # pool: keep the slot until the worker is free.
+                    self.overrunning += 1
+                    await asyncio.wait({e.pending})
+                    self.overrunning -= 1
+                    if not e.pending.cancelled():
+                        e.pending.exception()  # Retrieved; the result is discarded.
+            else:
+                if job.cache_key is not None and isinstance(result, bytes):
+                    self.cache.put(job.cache_key, result)
+                if not job.future.cancelled():
+                    job.future.set_result(result)
+            finally:
+                self._running -= 1
+                self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.recent_waits)
+        return {
+            "queue_depth": self._depth,
+            "running": self._running,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "cached": self.cached,
+            "overrunning": self.overrunning,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+        }
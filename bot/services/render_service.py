@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional
+
+from services.decode_cache import job_owner
+from services.metrics import collect_stages, handler_label, record_stages, renders_total
+
+logger = logging.getLogger(__name__)
+
+class RenderTimeoutError(Exception):
+    """
+    Raised when a render job does not finish within its timeout. A job can't
+    be stopped once a worker runs it; `pending` completes when it is done and
+    the worker is free again.
+    """
+
+    def __init__(self, message: str, pending: Optional[asyncio.Future] = None):
+        super().__init__(message)
+        self.pending = pending
+
+def _warm_up() -> None:
+    return None
+
+def _run_job(owner: Hashable, func: Callable[..., Any], *args: Any):
+    """Worker-side wrapper: tags the job with its owner and collects stage timings."""
+    job_owner.set(owner)
+    return collect_stages(func, *args)
+
+class RenderService:
+    """
+    Runs CPU-bound image jobs outside the asyncio event loop.
+
+    Jobs go to a process pool when possible, so renders don't contend for the
+    GIL with the dispatcher. If worker processes can't be started (restricted
+    sandboxes, missing semaphores), a thread pool is used instead.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 1,
+        use_processes: bool = True,
+        default_timeout: Optional[float] = None,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.use_processes = use_processes
+        self.default_timeout = default_timeout
+        self._executor: Optional[Executor] = None
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+        if self.use_processes:
+            try:
+                executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                # Fail here rather than on the first user's render.
+                executor.submit(_warm_up).result()
+                self._executor = executor
+                logger.info("Render service started with %d worker processes", self.max_workers)
+                return
+            except (OSError, NotImplementedError, RuntimeError) as e:
+                logger.warning("Process pool unavailable (%s), falling back to threads", e)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="render"
+        )
+        logger.info("Render service started with %d worker threads", self.max_workers)
+
+    async def run(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        timeout: Optional[float] = None,
+        owner: Optional[Hashable] = None,
+    ) -> Any:
+        """
+        Run func(*args) in the pool and await its result. Stage timings the
+        job records are added to the metrics registry under the current handler.
+        owner (the chat) lets worker-side caches drop what it no longer uses.
+        """
+        if self._executor is None:
+            self.start()
+        if timeout is None:
+            timeout = self.default_timeout
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, _run_job, owner, func, *args)
+        try:
+            # Shielded: a timeout must not hide that the job still holds a worker.
+            result, stages = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise RenderTimeoutError(f"{getattr(func, '__name__', func)} timed out after {timeout}s", future) from None
+        record_stages(stages)
+        renders_total.inc(job=getattr(func, "__name__", str(func)), handler=handler_label.get())
+        return result
+
+    async def shutdown(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        # Don't block the loop while pending jobs are cancelled and workers exit.
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: executor.shutdown(wait=True, cancel_futures=True)
+        )
+        logger.info("Render service stopped")
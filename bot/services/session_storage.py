@@ -0,0 +1,255 @@
+"""
+FSM storage that keeps memory bounded as sessions pile up.
+
+Like MemoryStorage, sessions (state and data) live in a dict. Their images
+are blob-store keys, so a session's memory is the bytes of its blobs in the
+blob store's memory tier. On top of that:
+
+- a session over the per-session quota has its older images (history
+  keyframes, the original, album photos) dropped from the memory tier;
+- sessions idle past the TTL, and least recently used sessions while the
+  total is over the global budget, are spilled: their record is written to
+  disk and their images leave the memory tier, but stay referenced on disk;
+- a spilled session is read back on its next access, so a user returning
+  to an old menu carries on where they left off.
+
+Like MemoryStorage's, sessions don't survive a restart: records spilled by an
+earlier run are deleted by clear_spilled() at startup rather than indexed,
+and the blob store lets the images they referenced expire as orphans.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from models.user_data import blob_keys_of
+from services.blob_store import BlobStore
+
+logger = logging.getLogger(__name__)
+
+class _Session:
+    __slots__ = ("state", "data", "last_access")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None):
+        self.state = state
+        self.data: Dict[str, Any] = data or {}
+        self.last_access = time.monotonic()
+
+def _cold_keys(data: Mapping[str, Any]) -> List[str]:
+    """Blob keys a session can do without in memory, least needed first."""
+    keyframes = data.get("keyframes") or {}
+    keys = [keyframes[pos] for pos in sorted(keyframes, key=int)]
+    keys += [data["base_image_key"]] if data.get("base_image_key") else []
+    keys += list(data.get("album_keys") or ())
+    hot = {data.get(name) for name in ("current_image_key", "preview_image_key", "new_image_key")}
+    return [key for key in dict.fromkeys(keys) if key not in hot]
+
+class SpillingMemoryStorage(BaseStorage):
+    def __init__(
+        self,
+        blob_store: BlobStore,
+        directory: str,
+        idle_ttl: float,
+        session_quota: int,
+        memory_budget: int,
+        sweep_interval: float = 60.0,
+    ):
+        self.blob_store = blob_store
+        self.directory = directory
+        self.idle_ttl = idle_ttl
+        self.session_quota = session_quota
+        self.memory_budget = memory_budget
+        self.sweep_interval = sweep_interval
+        # Resident sessions, least recently used first
+        self._sessions: "OrderedDict[StorageKey, _Session]" = OrderedDict()
+        self._spilled: Set[StorageKey] = set()
+        # Sessions whose record is being written to disk
+        self._spilling: Dict[StorageKey, _Session] = {}
+        # Reads of spilled records in progress
+        self._restoring: Dict[StorageKey, asyncio.Task] = {}
+        self._last_sweep = time.monotonic()
+        # Called with the StorageKey of each session spilled, e.g. to drop caches
+        self.on_spill: List[Callable[[StorageKey], None]] = []
+        self.spills = 0
+        self.restores = 0
+
+    def _path(self, key: StorageKey) -> str:
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    async def _session(self, key: StorageKey) -> _Session:
+        # Sweep first, so the session handed out is never spilled under the caller.
+        await self._maybe_sweep()
+        session = self._sessions.get(key)
+        if session is None:
+            # A session still being written out is taken back as it is.
+            session = self._spilling.pop(key, None)
+        if session is None and key in self._spilled:
+            restoring = self._restoring.get(key)
+            if restoring is None:
+                restoring = self._restoring[key] = asyncio.ensure_future(self._restore(key))
+                restoring.add_done_callback(lambda _: self._restoring.pop(key, None))
+            # Finishes even if this caller is cancelled, so the record isn't lost.
+            session = await asyncio.shield(restoring)
+        if session is None:
+            session = _Session()
+        self._sessions[key] = session
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(key)
+        return session
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        (await self._session(key)).state = state.state if isinstance(state, State) else state
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._session(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        session = await self._session(key)
+        session.data = dict(data)
+        self._enforce_quota(session)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._session(key)).data.copy()
+
+    async def close(self) -> None:
+        pass
+
+    def session_bytes(self, data: Mapping[str, Any]) -> int:
+        """Bytes of the session's images held in the blob store's memory tier."""
+        return sum(self.blob_store.resident_size(key) for key in blob_keys_of(data))
+
+    def _enforce_quota(self, session: _Session) -> None:
+        resident = self.session_bytes(session.data)
+        for key in _cold_keys(session.data):
+            if resident <= self.session_quota:
+                break
+            size = self.blob_store.resident_size(key)
+            if size:
+                self.blob_store.evict_from_memory([key])
+                resident -= size
+
+    @staticmethod
+    def _write(path: str, session: _Session) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((session.state, session.data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    async def spill(self, key: StorageKey) -> None:
+        """Move a resident session to disk."""
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return
+        if session.state is None and not session.data:
+            # Nothing to restore; an empty session is recreated on demand.
+            return
+        path = self._path(key)
+        self._spilling[key] = session
+        try:
+            await asyncio.to_thread(self._write, path, session)
+        except BaseException:
+            if self._spilling.pop(key, None) is session:
+                self._sessions[key] = session
+            raise
+        if self._spilling.pop(key, None) is not session:
+            # Accessed while being written: it stays resident.
+            await asyncio.to_thread(self._remove, path)
+            return
+        self._spilled.add(key)
+        # Blob references stay counted, so the images remain on disk.
+        self.blob_store.evict_from_memory(blob_keys_of(session.data))
+        self.spills += 1
+        for callback in self.on_spill:
+            callback(key)
+
+    async def _restore(self, key: StorageKey) -> _Session:
+        try:
+            state, data = await asyncio.to_thread(self._read, self._path(key))
+        except FileNotFoundError:
+            logger.warning("Spilled session %s is missing on disk; starting over", key)
+            session = _Session()
+        else:
+            self.restores += 1
+            session = _Session(state, data)
+        self._spilled.discard(key)
+        self._sessions[key] = session
+        return session
+
+    @staticmethod
+    def _read(path: str) -> tuple:
+        with open(path, "rb") as f:
+            record = pickle.load(f)
+        os.remove(path)
+        return record
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear_spilled(self) -> None:
+        """Delete session records spilled by an earlier run; call at startup."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._spilled.clear()
+
+    async def sweep(self) -> None:
+        """Spill idle sessions, then least recently used ones while over the memory budget."""
+        now = self._last_sweep = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            if now - session.last_access < self.idle_ttl:
+                break
+            await self.spill(key)
+        total = self.memory_bytes
+        for key in list(self._sessions):
+            if total <= self.memory_budget:
+                break
+            session = self._sessions.get(key)
+            if session is not None:
+                total -= self.session_bytes(session.data)
+                await self.spill(key)
+
+    async def _maybe_sweep(self) -> None:
+        if time.monotonic() - self._last_sweep > self.sweep_interval:
+            await self.sweep()
+
+    @property
+    def resident_sessions(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def spilled_sessions(self) -> int:
+        return len(self._spilled)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Image bytes held in memory by all resident sessions."""
+        return sum(self.session_bytes(session.data) for session in self._sessions.values())
+
+    def memory_report(self) -> Dict[StorageKey, int]:
+        """Image bytes in memory per resident session."""
+        return {key: self.session_bytes(session.data) for key, session in self._sessions.items()}
+
+    def stats(self) -> Dict[str, int]:
+        report = self.memory_report()
+        return {
+            "resident_sessions": len(report),
+            "spilled_sessions": self.spilled_sessions,
+            "memory_bytes": sum(report.values()),
+            "largest_session_bytes": max(report.values(), default=0),
+            "spills": self.spills,
+            "restores": self.restores,
+        }
@@ -0,0 +1,212 @@
+"""
+Caches shared by all users, kept on local disk.
+
+Forwarded images reach the bot from many users with the same Telegram
+file_unique_id, and users tend to make the same edits to them. The download
+cache keeps downloaded bytes by file_unique_id, so a second user's copy
+skips the network; the render cache keeps render job results by job and
+arguments (sources by content hash), so an identical render skips the CPU.
+Both are size-bounded LRUs whose files survive a restart and are shared by
+all processes using the same SHARED_CACHE_DIR.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional, Set
+
+import settings
+from services.blob_store import content_key
+
+logger = logging.getLogger(__name__)
+
+def job_key(func: Callable[..., Any], args: tuple, salt: str = "") -> str:
+    """
+    Cache key of func(*args): bytes arguments count by content, the rest by
+    their JSON form. salt covers anything else the result depends on.
+    """
+    digest = hashlib.sha256(f"{func.__module__}.{func.__qualname__}\0{salt}".encode())
+    for arg in args:
+        part = content_key(arg) if isinstance(arg, bytes) else json.dumps(arg, sort_keys=True, default=repr)
+        digest.update(b"\0" + part.encode())
+    return digest.hexdigest()
+
+class DiskCache:
+    """
+    Byte-bounded LRU of bytes values in a directory, one file per entry.
+
+    The directory is the cache: processes sharing it, e.g. webhook workers,
+    read each other's entries, and the budget is checked against the files
+    it holds, so entries left by an earlier run count too. Files are read
+    and written in threads; a put() is readable at once and written behind.
+    A process rescans the directory once it has written the slack above
+    TRIM_RATIO of the budget, so writers sharing it can overshoot the
+    budget by at most that slack each; eviction removes the least recently
+    read files (by mtime) down to TRIM_RATIO of the budget.
+    """
+
+    TRIM_RATIO = 0.9
+
+    def __init__(self, directory: str, budget: int):
+        self.directory = directory
+        self.budget = budget
+        # Size and count of the directory as of the last scan, plus our writes since
+        self._nbytes = 0
+        self._count = 0
+        self._unscanned = 0
+        # Entries written behind, by file name
+        self._pending: Dict[str, bytes] = {}
+        self._writes: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _name(key: str) -> str:
+        # Keys are arbitrary strings (file_unique_ids); names must be safe paths.
+        return content_key(key.encode())
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name[:2], name)
+
+    async def load(self) -> None:
+        """Measure the directory and evict down to the budget; call at startup."""
+        await asyncio.to_thread(self._trim)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        name = self._name(key)
+        data = self._pending.get(name)
+        if data is None:
+            data = await asyncio.to_thread(self._read, name)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def _read(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self._path(name), "rb") as f:
+                data = f.read()
+            # Keeps the LRU order for every process and across restarts.
+            os.utime(self._path(name))
+        except FileNotFoundError:
+            # Never cached, or evicted by any process sharing the directory
+            return None
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.budget:
+            return
+        name = self._name(key)
+        if name in self._pending:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_pending(name, data)
+            return
+        self._pending[name] = data
+        task = loop.create_task(asyncio.to_thread(self._write_pending, name, data))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def _write_pending(self, name: str, data: bytes) -> None:
+        path = self._path(name)
+        try:
+            if os.path.exists(path):
+                # Written by another process: count it as used.
+                os.utime(path)
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            # A full or read-only disk only costs the cache its benefit.
+            logger.warning("Could not write cache entry to %s", path, exc_info=True)
+            return
+        finally:
+            self._pending.pop(name, None)
+        with self._lock:
+            self._nbytes += len(data)
+            self._count += 1
+            self._unscanned += len(data)
+            if self._nbytes <= self.budget and self._unscanned <= self.budget * (1 - self.TRIM_RATIO):
+                return
+        # Other processes' writes are only seen by scanning.
+        self._trim()
+
+    def _trim(self) -> None:
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Evicted by another process meanwhile
+                if file_name.startswith("tmp"):
+                    # Partial write from an interrupted put(), or one in progress
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        nbytes = sum(size for _, _, size in found)
+        count = len(found)
+        if nbytes > self.budget:
+            for _, path, size in sorted(found):
+                if nbytes <= self.budget * self.TRIM_RATIO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                nbytes -= size
+                count -= 1
+        with self._lock:
+            self._nbytes = nbytes
+            self._count = count
+            self._unscanned = 0
+
+    async def flush(self) -> None:
+        """Wait for the disk writes in progress."""
+        while self._writes:
+            await asyncio.wait(set(self._writes))
+
+    async def clear(self) -> None:
+        """Delete every entry, for all processes sharing the directory, and reset the stats."""
+        await self.flush()
+        await asyncio.to_thread(shutil.rmtree, self.directory, True)
+        with self._lock:
+            self._nbytes = 0
+            self._count = 0
+            self._unscanned = 0
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "entries": self._count,
+            "bytes": self._nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+        }
+
+# Nothing is read from disk until load(), which bot.py runs at startup.
+download_cache = DiskCache(os.path.join(settings.SHARED_CACHE_DIR, "downloads"), settings.DOWNLOAD_CACHE_BUDGET)
+render_cache = DiskCache(os.path.join(settings.SHARED_CACHE_DIR, "renders"), settings.RENDER_CACHE_BUDGET)
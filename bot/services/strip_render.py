@@ -0,0 +1,149 @@
+"""
+Rendering of images too large to process whole within a job's memory limit.
+
+The decoded image is held once and every render stage sweeps it in
+horizontal strips, writing each result back in place, so the working memory
+of an op (copies, summed-area tables) is bounded by the strip rather than the
+image. Pixelation strips start on rows of the whole-image block grid, and
+colour reduction fits its palette to the same pixel sample as a whole-image
+render, so the output is identical; the exception is Floyd-Steinberg
+dithering, whose error diffusion restarts at each strip.
+
+Pillow decodes JPEG and PNG in one piece, which makes the decoded image
+itself the floor of what a job needs; images whose floor exceeds the limit
+are refused up front.
+"""
+
+import io
+from typing import Any, Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from services.encoding import EncodingProfile, encode_image
+from services.image_buffer import ImageBuffer
+from services.image_utils import apply_lut
+from services.metrics import timed_stage
+from services.pixelate_engine import PixelationEngine, block_starts
+from services.quantize import PaletteFit, sample_indices, stylize
+
+# Peak bytes per pixel, measured with a brightness + pixelate render. A decoded
+# Pillow RGB image is stored 4 bytes a pixel. A whole-image render holds the
+# decoded array, op outputs and, for pixelation, a 12 byte a pixel summed-area
+# table; a strip needs the same for its own rows, plus the crop it starts from.
+DECODED_BYTES_PER_PIXEL = 4
+WHOLE_BYTES_PER_PIXEL = 32
+STRIP_BYTES_PER_PIXEL = 40
+
+class MemoryLimitError(Exception):
+    """The image can't be rendered within the per-job memory limit."""
+
+def decoded_bytes(width: int, height: int, mode: str = "RGB") -> int:
+    # Other modes are converted to RGB, holding both copies for a moment.
+    return width * height * DECODED_BYTES_PER_PIXEL * (1 if mode == "RGB" else 2)
+
+def fits_whole(width: int, height: int, memory_limit: int) -> bool:
+    return width * height * WHOLE_BYTES_PER_PIXEL <= memory_limit
+
+def strip_rows(width: int, height: int, memory_limit: int, mode: str = "RGB", min_rows: int = 1) -> int:
+    """Rows per strip that keep a render within memory_limit; raises MemoryLimitError."""
+    available = memory_limit - decoded_bytes(width, height, mode)
+    rows = available // (width * STRIP_BYTES_PER_PIXEL) if available > 0 else 0
+    if rows < min(min_rows, height):
+        raise MemoryLimitError(
+            f"{width}x{height} image needs more than {memory_limit // (1024 * 1024)} MB to render"
+        )
+    return max(1, min(rows, height))
+
+def check_renderable(image_bytes: bytes, memory_limit: int) -> None:
+    """Raise MemoryLimitError if image_bytes can't be rendered even in strips."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        strip_rows(img.width, img.height, memory_limit, img.mode)
+
+def min_strip_rows(stages: List[Tuple[str, Any]]) -> int:
+    """Fewest rows a strip may have: one block row of the tallest pixelation."""
+    return max(
+        [(arg.get("block_height") or arg["block_size"]) for op, arg in stages if op == "pixelate"] + [1]
+    )
+
+def _even_strips(height: int, rows: int) -> Iterator[Tuple[int, int]]:
+    for y0 in range(0, height, rows):
+        yield y0, min(height, y0 + rows)
+
+def _aligned_strips(starts: np.ndarray, height: int, rows: int) -> Iterator[Tuple[int, int]]:
+    """Strips of at most `rows` rows (but at least one block) that begin at block starts."""
+    boundaries = np.append(starts, height)
+    i = 0
+    while i < len(starts):
+        # Furthest boundary within budget, but always at least the next one.
+        j = max(i + 1, int(np.searchsorted(boundaries, boundaries[i] + rows, side="right")) - 1)
+        yield int(boundaries[i]), int(boundaries[j])
+        i = j
+
+def _sweep(img: Image.Image, bounds: Iterator[Tuple[int, int]], func) -> None:
+    width = img.width
+    for y0, y1 in bounds:
+        strip = ImageBuffer.from_pil(img.crop((0, y0, width, y1)))
+        img.paste(func(strip, y0, y1).to_pil(), (0, y0))
+
+def _sample_strips(img: Image.Image, rows: int) -> np.ndarray:
+    """quantize.sample_pixels() of the whole image, gathered strip by strip."""
+    width = img.width
+    indices = sample_indices(width * img.height)
+    samples = np.empty((len(indices), 3), dtype=np.uint8)
+    for y0, y1 in _even_strips(img.height, rows):
+        inside = (indices >= y0 * width) & (indices < y1 * width)
+        strip = np.asarray(img.crop((0, y0, width, y1))).reshape(-1, 3)
+        samples[inside] = strip[indices[inside] - y0 * width]
+    return samples
+
+def _pixelate_strips(
+    img: Image.Image,
+    rows: int,
+    block_size: int,
+    block_height: int = None,
+    anchor: str = "top-left",
+    colors: int = 0,
+    dither: str = "none",
+    bw: int = 0,
+):
+    block_width, block_height = max(1, block_size), max(1, block_height or block_size)
+    if block_width > 1 or block_height > 1:
+        row_starts = block_starts(img.height, block_height, anchor)
+        col_starts = block_starts(img.width, block_width, anchor)
+
+        def pixelate(strip: ImageBuffer, y0: int, y1: int) -> ImageBuffer:
+            starts = row_starts[(row_starts >= y0) & (row_starts < y1)] - y0
+            return PixelationEngine(strip).pixelate_grid(starts, col_starts)
+
+        _sweep(img, _aligned_strips(row_starts, img.height, rows), pixelate)
+
+    if colors or bw:
+        fit = None
+        if colors and not bw:
+            fit = PaletteFit(_sample_strips(img, rows))
+        _sweep(
+            img,
+            _even_strips(img.height, rows),
+            lambda strip, y0, y1: stylize(strip, colors, dither, bw, fit, row_offset=y0),
+        )
+
+def render_in_strips(
+    image_bytes: bytes, stages: List[Tuple[str, Any]], profile: EncodingProfile, memory_limit: int
+) -> bytes:
+    """Apply EditPipeline stages to image_bytes strip by strip and encode."""
+    with Image.open(io.BytesIO(image_bytes)) as src:
+        rows = strip_rows(src.width, src.height, memory_limit, src.mode, min_strip_rows(stages))
+        with timed_stage("decode", "strips"):
+            src.load()
+            img = src if src.mode == "RGB" else src.convert("RGB")
+        for op, arg in stages:
+            with timed_stage("op", op):
+                if op == "lut":
+                    _sweep(img, _even_strips(img.height, rows), lambda strip, y0, y1: apply_lut(strip, arg))
+                elif op == "pixelate":
+                    _pixelate_strips(img, rows, **arg)
+                else:
+                    raise ValueError(f"No strip implementation for op: {op}")
+        with timed_stage("encode", profile.name):
+            return encode_image(img, profile)
@@ -0,0 +1,134 @@
+import os
+import tempfile
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# Rendering
+RENDER_WORKERS = _env_int("RENDER_WORKERS", os.cpu_count() or 1)
+RENDER_USE_PROCESSES = _env_bool("RENDER_USE_PROCESSES", True)
+RENDER_TIMEOUT = _env_float("RENDER_TIMEOUT", 30.0)
+# Queued renders beyond this are rejected with a "busy" answer
+RENDER_MAX_QUEUE_DEPTH = _env_int("RENDER_MAX_QUEUE_DEPTH", 32)
+
+# Undo/redo history
+HISTORY_KEYFRAME_INTERVAL = _env_int("HISTORY_KEYFRAME_INTERVAL", 4)
+HISTORY_KEYFRAME_BUDGET = _env_int("HISTORY_KEYFRAME_BUDGET", 8 * 1024 * 1024)
+
+# Image blob storage
+BLOB_STORE_DIR = os.getenv(
+    "BLOB_STORE_DIR", os.path.join(tempfile.gettempdir(), "pixelate_bot", "blobs")
+)
+BLOB_MEMORY_BUDGET = _env_int("BLOB_MEMORY_BUDGET", 256 * 1024 * 1024)
+BLOB_ORPHAN_GRACE = _env_float("BLOB_ORPHAN_GRACE", 600.0)
+
+# FSM sessions (services/session_storage.py). Sessions idle for SESSION_IDLE_TTL
+# seconds, or the least recently used ones while all sessions together hold more
+# than SESSION_MEMORY_BUDGET bytes of images in memory, are spilled to disk and
+# restored on their next update. A session holding more than
+# SESSION_MEMORY_QUOTA bytes keeps only its newest images in memory.
+SESSION_IDLE_TTL = _env_float("SESSION_IDLE_TTL", 1800.0)
+SESSION_MEMORY_QUOTA = _env_int("SESSION_MEMORY_QUOTA", 16 * 1024 * 1024)
+SESSION_MEMORY_BUDGET = _env_int("SESSION_MEMORY_BUDGET", 192 * 1024 * 1024)
+SESSION_SWEEP_INTERVAL = _env_float("SESSION_SWEEP_INTERVAL", 60.0)
+
+# Previews are rendered on a 1/PREVIEW_SCALE proxy (1, 2, 4 or 8), but never
+# smaller than PREVIEW_MIN_SIDE pixels on the longer side
+PREVIEW_SCALE = _env_int("PREVIEW_SCALE", 2)
+PREVIEW_MIN_SIDE = _env_int("PREVIEW_MIN_SIDE", 480)
+
+# Summed-area tables kept per render process for pixelating the same image
+# at several block sizes
+PIXELATE_SAT_CACHE_BUDGET = _env_int("PIXELATE_SAT_CACHE_BUDGET", 64 * 1024 * 1024)
+
+# Memory one render job may use. Full-size renders of larger images are done
+# in strips; images too big even for that are refused
+RENDER_JOB_MEMORY_LIMIT = _env_int("RENDER_JOB_MEMORY_LIMIT", 256 * 1024 * 1024)
+
+# Largest image file accepted as a document (the Bot API serves up to 20 MB)
+MAX_DOCUMENT_BYTES = _env_int("MAX_DOCUMENT_BYTES", 20 * 1024 * 1024)
+# Telegram refuses photos over PHOTO_MAX_BYTES. Images over that, or with a side
+# over DISPLAY_MAX_SIDE (Telegram's largest photo size), are shown as a reduced
+# copy and kept at full resolution for renders and Download.
+PHOTO_MAX_BYTES = _env_int("PHOTO_MAX_BYTES", 10 * 1024 * 1024)
+DISPLAY_MAX_SIDE = _env_int("DISPLAY_MAX_SIDE", 2560)
+
+# Decoded images kept per render process, so previews of the same image
+# skip the JPEG decode
+DECODE_CACHE_BUDGET = _env_int("DECODE_CACHE_BUDGET", 96 * 1024 * 1024)
+
+# Output encoding (services/encoding.py). Previews may be JPEG or WEBP and are
+# re-encoded at lower quality to fit PREVIEW_TARGET_BYTES (0 for no target)
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "JPEG").upper()
+PREVIEW_QUALITY = _env_int("PREVIEW_QUALITY", 80)
+PREVIEW_TARGET_BYTES = _env_int("PREVIEW_TARGET_BYTES", 150 * 1024)
+WORKING_QUALITY = _env_int("WORKING_QUALITY", 92)
+DOWNLOAD_QUALITY = _env_int("DOWNLOAD_QUALITY", 95)
+
+# Compare mode: values shown side by side in one contact sheet, and the
+# sheet's longer side in pixels
+COMPARE_CELLS = _env_int("COMPARE_CELLS", 6)
+COMPARE_SHEET_SIDE = _env_int("COMPARE_SHEET_SIDE", 1280)
+
+# Rendered preview cache
+PREVIEW_CACHE_SESSION_BUDGET = _env_int("PREVIEW_CACHE_SESSION_BUDGET", 4 * 1024 * 1024)
+PREVIEW_CACHE_TOTAL_BUDGET = _env_int("PREVIEW_CACHE_TOTAL_BUDGET", 128 * 1024 * 1024)
+
+# Caches shared by all users on local disk (services/shared_cache.py):
+# downloads by Telegram file_unique_id and render results by their inputs
+SHARED_CACHE_DIR = os.getenv(
+    "SHARED_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pixelate_bot", "shared")
+)
+DOWNLOAD_CACHE_BUDGET = _env_int("DOWNLOAD_CACHE_BUDGET", 512 * 1024 * 1024)
+RENDER_CACHE_BUDGET = _env_int("RENDER_CACHE_BUDGET", 512 * 1024 * 1024)
+
+# Telegram file_ids remembered for re-sending uploaded images by reference
+FILE_ID_REGISTRY_SIZE = _env_int("FILE_ID_REGISTRY_SIZE", 100_000)
+
+# Alternative Bot API server (e.g. a local test server); empty for api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+
+# Outbound Bot API requests (middlewares/outbound.py). Telegram allows about
+# one message a second per chat, with short bursts, and 30 a second overall
+OUTBOUND_CHAT_RATE = _env_float("OUTBOUND_CHAT_RATE", 1.0)
+OUTBOUND_CHAT_BURST = _env_float("OUTBOUND_CHAT_BURST", 3.0)
+# For the whole bot token: webhook workers each get 1/WEBHOOK_WORKERS of it
+OUTBOUND_GLOBAL_RATE = _env_float("OUTBOUND_GLOBAL_RATE", 30.0)
+OUTBOUND_GLOBAL_BURST = _env_float("OUTBOUND_GLOBAL_BURST", 30.0)
+# Attempts after a RetryAfter answer before the error reaches the handler
+OUTBOUND_MAX_RETRIES = _env_int("OUTBOUND_MAX_RETRIES", 3)
+# Connections kept open to the Bot API server
+BOT_API_CONNECTIONS = _env_int("BOT_API_CONNECTIONS", 100)
+
+# Seconds of +/- inactivity before the menu caption is updated
+CAPTION_DEBOUNCE_DELAY = _env_float("CAPTION_DEBOUNCE_DELAY", 0.4)
+
+# Seconds without a further photo of a media group before the album is handled
+ALBUM_COLLECT_DELAY = _env_float("ALBUM_COLLECT_DELAY", 0.6)
+
+# Prometheus-style metrics at http://METRICS_HOST:METRICS_PORT/metrics; port 0 disables
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = _env_int("METRICS_PORT", 9108)
+# Recent observations per label set used for the p50/p95/p99 quantiles
+METRICS_WINDOW = _env_int("METRICS_WINDOW", 1024)
+
+# Webhook mode (webhook.py): one listener feeding WEBHOOK_WORKERS processes
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = _env_int("WEBHOOK_PORT", 8080)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Public base URL registered with Telegram on startup; empty to skip set_webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Checked against the X-Telegram-Bot-Api-Secret-Token header when set
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = _env_int("WEBHOOK_WORKERS", os.cpu_count() or 1)
@@ -1,18 +1,176 @@
+import asyncio
 import io
-from aiogram.types import Message, BufferedInputFile
+from typing import Dict, List, Optional, Union
 
-async def download_photo_to_bytes(message: Message) -> bytes:
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, BufferedInputFile, InputMediaPhoto
+
+import settings
+from middlewares.outbound import REPLACED_EDIT
+from services.blob_store import content_key
+from services.file_id_registry import file_id_registry
+from services.image_utils import image_size
+from services.metrics import handler_label, photo_sends_total, timed_stage, uploaded_bytes_total
+from services.shared_cache import download_cache
+
+# Downloads in progress by file_unique_id, joined by requests for the same file
+_pending_downloads: Dict[str, asyncio.Task] = {}
+
+async def _fetch(bot: Bot, file_id: str, file_unique_id: str) -> bytes:
     file_in_io = io.BytesIO()
-    await message.bot.download(
-        file=message.photo[-1].file_id,
-        destination=file_in_io
-    )
-    return file_in_io.getvalue()
+    with timed_stage("download"):
+        await bot.download(file=file_id, destination=file_in_io)
+    image_bytes = file_in_io.getvalue()
+    download_cache.put(file_unique_id, image_bytes)
+    return image_bytes
+
+async def _download(message: Message, file_id: str, file_unique_id: str) -> bytes:
+    """
+    The file's bytes. Files already downloaded, for any user, come from the
+    shared cache; a file being downloaded for someone else is waited for.
+    """
+    image_bytes = await download_cache.get(file_unique_id)
+    if image_bytes is not None:
+        return image_bytes
+    task = _pending_downloads.get(file_unique_id)
+    if task is None:
+        task = _pending_downloads[file_unique_id] = asyncio.create_task(_fetch(message.bot, file_id, file_unique_id))
+        task.add_done_callback(lambda _: _pending_downloads.pop(file_unique_id, None))
+    # One waiter giving up doesn't cancel the download for the others.
+    return await asyncio.shield(task)
+
+async def download_photo_to_bytes(message: Message) -> bytes:
+    photo = message.photo[-1]
+    image_bytes = await _download(message, photo.file_id, photo.file_unique_id)
+    # Telegram already has these exact bytes; sending them back needs no upload.
+    file_id_registry.put(content_key(image_bytes), photo.file_id)
+    return image_bytes
+
+async def download_document_to_bytes(message: Message) -> bytes:
+    return await _download(message, message.document.file_id, message.document.file_unique_id)
+
+def fits_photo(image_bytes: bytes) -> bool:
+    """Whether image_bytes can be sent as a photo as they are (see settings.DISPLAY_MAX_SIDE)."""
+    if len(image_bytes) > settings.PHOTO_MAX_BYTES:
+        return False
+    return max(image_size(image_bytes)) <= settings.DISPLAY_MAX_SIDE
+
+def photo_input(image_bytes: bytes, filename: str = "image.jpg") -> Union[str, BufferedInputFile]:
+    """file_id of an earlier upload of these bytes, or the bytes to upload."""
+    file_id = file_id_registry.get(content_key(image_bytes))
+    return file_id if file_id else BufferedInputFile(image_bytes, filename=filename)
+
+def count_photo(photo: Union[str, BufferedInputFile]) -> None:
+    handler = handler_label.get()
+    if isinstance(photo, BufferedInputFile):
+        uploaded_bytes_total.inc(len(photo.data), handler=handler)
+        photo_sends_total.inc(handler=handler, mode="upload")
+    else:
+        photo_sends_total.inc(handler=handler, mode="file_id")
+
+def remember_photo(image_bytes: bytes, sent: Union[Message, bool, None]) -> None:
+    if isinstance(sent, Message) and sent.photo:
+        file_id_registry.put(content_key(image_bytes), sent.photo[-1].file_id)
 
 async def send_photo_from_bytes(message: Message, image_bytes: bytes, caption: str = "", reply_markup=None):
-    file_upload = BufferedInputFile(image_bytes, filename="image.jpg")
-    return await message.answer_photo(
-        photo=file_upload,
-        caption=caption,
-        reply_markup=reply_markup
-    )
+    photo = photo_input(image_bytes)
+    try:
+        with timed_stage("send"):
+            sent = await message.answer_photo(photo=photo, caption=caption, reply_markup=reply_markup)
+    except TelegramBadRequest:
+        if isinstance(photo, BufferedInputFile):
+            raise
+        # Stale file_id: forget it and upload the bytes.
+        file_id_registry.forget(content_key(image_bytes))
+        photo = BufferedInputFile(image_bytes, filename="image.jpg")
+        with timed_stage("send"):
+            sent = await message.answer_photo(photo=photo, caption=caption, reply_markup=reply_markup)
+    count_photo(photo)
+    remember_photo(image_bytes, sent)
+    return sent
+
+async def send_album_from_bytes(message: Message, images: List[bytes], caption: str = "") -> List[Message]:
+    """Send images as one media group, captioned on the first photo."""
+    media = [photo_input(image_bytes, f"image{i}.jpg") for i, image_bytes in enumerate(images)]
+
+    def group():
+        return [InputMediaPhoto(media=m, caption=caption if i == 0 else None) for i, m in enumerate(media)]
+
+    try:
+        with timed_stage("send"):
+            sent = await message.answer_media_group(media=group())
+    except TelegramBadRequest:
+        if all(isinstance(m, BufferedInputFile) for m in media):
+            raise
+        # A stale file_id fails the whole group: upload everything that was sent by reference.
+        for i, image_bytes in enumerate(images):
+            if not isinstance(media[i], BufferedInputFile):
+                file_id_registry.forget(content_key(image_bytes))
+                media[i] = BufferedInputFile(image_bytes, filename=f"image{i}.jpg")
+        with timed_stage("send"):
+            sent = await message.answer_media_group(media=group())
+    for photo, image_bytes, sent_message in zip(media, images, sent):
+        count_photo(photo)
+        remember_photo(image_bytes, sent_message)
+    return sent
+
+async def send_document_from_bytes(message: Message, data: bytes, filename: str, caption: str = ""):
+    """Send data as a file, which Telegram delivers without recompressing it."""
+    # Documents have their own file_ids; keep them apart from photos.
+    registry_key = "document:" + content_key(data)
+    file_id = file_id_registry.get(registry_key)
+    document = file_id if file_id else BufferedInputFile(data, filename=filename)
+    try:
+        with timed_stage("send"):
+            sent = await message.answer_document(document=document, caption=caption)
+    except TelegramBadRequest:
+        if isinstance(document, BufferedInputFile):
+            raise
+        file_id_registry.forget(registry_key)
+        document = BufferedInputFile(data, filename=filename)
+        with timed_stage("send"):
+            sent = await message.answer_document(document=document, caption=caption)
+    count_photo(document)
+    if isinstance(sent, Message) and sent.document:
+        file_id_registry.put(registry_key, sent.document.file_id)
+    return sent
+
+async def edit_photo_from_bytes(
+    message: Message,
+    image_bytes: bytes,
+    caption: Optional[str] = None,
+    reply_markup=None,
+    filename: str = "edited.jpg",
+):
+    """
+    Replace the photo of `message`, re-using a file_id when these bytes were
+    uploaded before. None if the message was left as it was or a newer edit
+    replaced this one.
+    """
+    media = photo_input(image_bytes, filename)
+    try:
+        with timed_stage("edit"):
+            result = await message.edit_media(
+                media=InputMediaPhoto(media=media, caption=caption),
+                reply_markup=reply_markup
+            )
+    except TelegramBadRequest as e:
+        if "message is not modified" in e.message:
+            # Same file_id, caption and keyboard as already shown
+            return None
+        if isinstance(media, BufferedInputFile):
+            raise
+        file_id_registry.forget(content_key(image_bytes))
+        media = BufferedInputFile(image_bytes, filename=filename)
+        with timed_stage("edit"):
+            result = await message.edit_media(
+                media=InputMediaPhoto(media=media, caption=caption),
+                reply_markup=reply_markup
+            )
+    if result is REPLACED_EDIT:
+        # A newer edit of the message went out instead; these bytes were never sent.
+        return None
+    count_photo(media)
+    remember_photo(image_bytes, result)
+    return result
@@ -1,19 +1,38 @@
 from aiogram.fsm.context import FSMContext
-from models.user_data import UserData
+from models.user_data import BLOB_FIELDS, UserData, blob_keys_of
+from services.blob_store import blob_store
+from services.metrics import timed_stage
 
 async def load_user_data(state: FSMContext) -> UserData:
     """
     Loads user data from state, ignoring ephemeral fields like 'pixel_preview_stage'.
+    The images most handlers use are read from the blob store in a thread;
+    others only when first accessed.
     """
     data = await state.get_data()
-
-    # Convert remaining data into UserData
-    user_data = UserData(**data) if data else UserData()
+    user_data = UserData.from_state(data)
+    await user_data.prefetch(user_data.working_keys())
     return user_data
 
 async def save_user_data(state: FSMContext, user_data: UserData):
-    """Dump user data back into the FSM state."""
-    # Convert user_data to dict
-    user_data_dict = user_data.__dict__.copy()
-    # ephemeral keys are not in user_data_dict anyway
-    await state.update_data(**user_data_dict)
+    """
+    Write the fields changed since load (or the previous save) into the FSM state.
+    Image fields are blob-store keys; references are moved from the previous
+    values to the new ones so unreferenced images can be reclaimed.
+    """
+    changes = user_data.pop_changes()
+    if not changes:
+        return
+
+    with timed_stage("save_state"):
+        blob_changes = {name: value for name, value in changes.items() if name in BLOB_FIELDS}
+        if blob_changes:
+            previous = await state.get_data()
+            old_keys = blob_keys_of({name: previous.get(name) for name in blob_changes})
+            new_keys = blob_keys_of(blob_changes)
+
+        await state.update_data(**changes)
+
+        if blob_changes:
+            blob_store.incref((new_keys - old_keys).elements())
+            blob_store.decref((old_keys - new_keys).elements())
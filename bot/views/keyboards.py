@@ -24,27 +24,33 @@ def main_menu_keyboard(can_undo: bool, can_redo: bool) -> InlineKeyboardMarkup:
     else:
         builder.button(text="Redo (unavailable)", callback_data="noop")
 
-    # Download
+    # Download: high-quality photo, or a lossless PNG file
     builder.button(text="Download", callback_data="download_image")
+    builder.button(text="Download PNG", callback_data="download_lossless")
 
-    # Example layout: 5 buttons in the first row, 1 in the second row
-    builder.adjust(5, 1)
+    # Example layout: 5 buttons in the first row, 2 in the second row
+    builder.adjust(5, 2)
 
     return builder.as_markup()
 
 #
 # PIXELATE MENU
 #
-def pixelate_menu_keyboard(preview_stage: int = 0) -> InlineKeyboardMarkup:
+def pixelate_menu_keyboard(preview_stage: int = 0, colors: int = 0, dither: str = "none", bw: int = 0) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="+", callback_data="pixel_plus")
     builder.button(text="-", callback_data="pixel_minus")
+    # Each colour option cycles through its values
+    builder.button(text=f"Colors: {colors or 'all'}", callback_data="pixel_colors")
+    builder.button(text=f"Dither: {dither}", callback_data="pixel_dither")
+    builder.button(text=f"B&W: {'on' if bw else 'off'}", callback_data="pixel_bw")
     builder.button(
         text="Preview" if preview_stage == 0 else "Save",
         callback_data="pixel_preview"
     )
+    builder.button(text="Compare", callback_data="pixel_compare")
     builder.button(text="Back to Main", callback_data="pixel_back_to_main")
-    builder.adjust(2, 1, 1)
+    builder.adjust(2, 3, 2, 1)
     return builder.as_markup()
 
 def brightness_menu_keyboard(preview_stage: int = 0) -> InlineKeyboardMarkup:
@@ -55,8 +61,9 @@ def brightness_menu_keyboard(preview_stage: int = 0) -> InlineKeyboardMarkup:
         text="Preview" if preview_stage == 0 else "Save",
         callback_data="brightness_preview"
     )
+    builder.button(text="Compare", callback_data="brightness_compare")
     builder.button(text="Back to Main", callback_data="brightness_back_to_main")
-    builder.adjust(2, 1, 1)
+    builder.adjust(2, 2, 1)
     return builder.as_markup()
 
 def contrast_menu_keyboard(preview_stage: int = 0) -> InlineKeyboardMarkup:
@@ -67,8 +74,37 @@ def contrast_menu_keyboard(preview_stage: int = 0) -> InlineKeyboardMarkup:
         text="Preview" if preview_stage == 0 else "Save",
         callback_data="contrast_preview"
     )
+    builder.button(text="Compare", callback_data="contrast_compare")
     builder.button(text="Back to Main", callback_data="contrast_back_to_main")
-    builder.adjust(2, 1, 1)
+    builder.adjust(2, 2, 1)
+    return builder.as_markup()
+
+#
+# ALBUM MENU
+#
+def album_menu_keyboard(has_edits: bool) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(text="Pixel +", callback_data="album_pixel_plus")
+    builder.button(text="Pixel -", callback_data="album_pixel_minus")
+    builder.button(text="Brightness +", callback_data="album_brightness_plus")
+    builder.button(text="Brightness -", callback_data="album_brightness_minus")
+    builder.button(text="Contrast +", callback_data="album_contrast_plus")
+    builder.button(text="Contrast -", callback_data="album_contrast_minus")
+    if has_edits:
+        builder.button(text="Reset", callback_data="album_reset")
+        builder.button(text="Save", callback_data="album_save")
+    builder.adjust(2, 2, 2, 2)
+    return builder.as_markup()
+
+#
+# COMPARE (contact sheet) in the pixelate, brightness and contrast menus
+#
+def compare_keyboard(prefix: str, values: list) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for i, value in enumerate(values):
+        builder.button(text=f"{i + 1}: {value}", callback_data=f"{prefix}_pick:{value}")
+    builder.button(text="Back to Main", callback_data=f"{prefix}_back_to_main")
+    builder.adjust(*([3] * ((len(values) + 2) // 3)), 1)
     return builder.as_markup()
 
 def confirm_save_keyboard() -> InlineKeyboardMarkup:
@@ -1,14 +1,39 @@
 def main_menu_caption() -> str:
     return "Main Menu: Choose an operation below."
 
+DITHER_NAMES = {"none": "No", "ordered": "Ordered", "fs": "Floyd-Steinberg"}
+
 def pixelate_menu_caption() -> str:
     return "Pixelate Menu: Adjust pixel size, color count, or B&W. Then Preview/Save."
 
+def pixel_settings(pixel_size: int, colors: int = 0, dither: str = "none", bw: int = 0) -> str:
+    parts = [f"Pixel size: {pixel_size}"]
+    if bw:
+        parts.append("B&W")
+    elif colors:
+        parts.append(f"{colors} colors")
+    if (bw or colors) and dither != "none":
+        parts.append(f"{DITHER_NAMES[dither]} dither")
+    return ", ".join(parts)
+
 def brightness_menu_caption() -> str:
     return "Brightness Menu: Use + or - then Preview/Save."
 
 def contrast_menu_caption() -> str:
     return "Contrast Menu: Use + or - then Preview/Save."
 
+def compare_caption(name: str, values: list) -> str:
+    return f"{name}: {', '.join(map(str, values))}. Tap a number to preview that value."
+
 def downloaded_image_caption() -> str:
     return "Here is your image. You can save it locally."
+
+def image_too_large_message(max_bytes: int) -> str:
+    return f"This image is too large to edit. Please send a smaller one (at most {max_bytes // (1024 * 1024)} MB)."
+
+def album_menu_caption(photo_count: int, ops: list) -> str:
+    applied = ", ".join(f"{name} {next(iter(params.values()))}" for name, params in ops) or "none"
+    return (
+        f"Album of {photo_count} photos. Edits: {applied}.\n"
+        "Shown on the first photo; Save applies them to every photo."
+    )
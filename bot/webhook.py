@@ -0,0 +1,187 @@
+"""
+Webhook entry point: one aiohttp listener in front of N worker processes.
+
+Each worker runs its own Bot and Dispatcher. Updates are routed by chat id, so
+a chat always lands on the same worker and its FSM state, preview cache and
+blob store stay local to that process. The download and render caches are
+files in SHARED_CACHE_DIR, shared by all workers. Long polling is still available
+through bot.py.
+
+    python webhook.py --workers 4 --port 8080
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def route_chat_id(update: Dict[str, Any]) -> int:
+    """Chat id an update belongs to, or the sender's id when it has no chat."""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        sender = event.get("from") or event.get("user")
+        if sender:
+            return sender["id"]
+    return 0
+
+def worker_index(update: Dict[str, Any], workers: int) -> int:
+    return route_chat_id(update) % workers
+
+def _worker_main(index: int, workers: int, updates: multiprocessing.Queue) -> None:
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format=f"[worker {index}] %(levelname)s %(name)s: %(message)s")
+    # The parent handles Ctrl+C and stops workers through the queue.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, workers, updates))
+
+async def _run_worker(index: int, workers: int, updates: multiprocessing.Queue) -> None:
+    from bot import create_bot, create_dispatcher
+    from services.blob_store import blob_store
+    from services.metrics import start_metrics_server
+
+    # Orphan sweeps in one worker must not delete another worker's blobs.
+    blob_store.directory = os.path.join(settings.BLOB_STORE_DIR, f"worker-{index}")
+
+    # Telegram's global limit is per token, shared by all workers.
+    bot = create_bot(processes=workers)
+    dp = create_dispatcher(render_workers=max(1, settings.RENDER_WORKERS // workers))
+    if settings.METRICS_PORT:
+        # One endpoint per worker: METRICS_PORT, METRICS_PORT + 1, ...
+        metrics_runner = await start_metrics_server(settings.METRICS_HOST, settings.METRICS_PORT + index)
+        dp.shutdown.register(metrics_runner.cleanup)
+    await dp.emit_startup(bot=bot)
+
+    loop = asyncio.get_running_loop()
+    pending = set()
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+            task = asyncio.create_task(dp.feed_raw_update(bot, json.loads(raw)))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+class WebhookFrontend:
+    """Accepts webhook requests and hands each update to its chat's worker."""
+
+    def __init__(self, workers: int, secret: str = ""):
+        self.workers = max(1, workers)
+        self.secret = secret
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+
+    def start_workers(self) -> None:
+        # spawn: workers start from a clean interpreter instead of a fork of
+        # the listener, and may start render processes of their own.
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.workers):
+            updates = context.Queue()
+            process = context.Process(
+                target=_worker_main, args=(index, self.workers, updates), name=f"bot-worker-{index}"
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+        logger.info("Started %d bot workers", self.workers)
+
+    async def stop_workers(self, timeout: float = 30.0) -> None:
+        for updates in self._queues:
+            updates.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in time, terminating", process.name)
+                process.terminate()
+        self._queues.clear()
+        self._processes.clear()
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        raw = await request.read()
+        try:
+            update = json.loads(raw)
+        except ValueError:
+            return web.Response(status=400)
+        self._queues[worker_index(update, self.workers)].put(raw)
+        return web.Response()
+
+    def create_app(self, path: str) -> web.Application:
+        app = web.Application()
+        app.router.add_post(path, self.handle_update)
+        return app
+
+async def run_webhook(
+    host: str,
+    port: int,
+    path: str,
+    workers: int,
+    secret: str = "",
+    public_url: str = "",
+    stop: Optional[asyncio.Event] = None,
+) -> None:
+    frontend = WebhookFrontend(workers, secret)
+    frontend.start_workers()
+    runner = web.AppRunner(frontend.create_app(path), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Listening for updates on http://%s:%d%s", host, port, path)
+
+    if public_url:
+        from bot import create_bot
+
+        bot = create_bot()
+        try:
+            await bot.set_webhook(url=public_url.rstrip("/") + path, secret_token=secret or None)
+        finally:
+            await bot.session.close()
+
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await frontend.stop_workers()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the bot behind a webhook with several worker processes.")
+    parser.add_argument("--host", default=settings.WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=settings.WEBHOOK_PORT)
+    parser.add_argument("--path", default=settings.WEBHOOK_PATH)
+    parser.add_argument("--workers", type=int, default=settings.WEBHOOK_WORKERS)
+    parser.add_argument("--url", default=settings.WEBHOOK_URL, help="public base URL to register with Telegram")
+    args = parser.parse_args()
+    asyncio.run(run_webhook(args.host, args.port, args.path, args.workers, settings.WEBHOOK_SECRET, args.url))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    main()
@@ -0,0 +1,27 @@
+"""Test setup: the bot's import path and throwaway storage directories."""
+
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot")
+if BOT_DIR not in sys.path:
+    sys.path.insert(0, BOT_DIR)
+# Before settings is imported: keep test blobs and caches out of the bot's real stores.
+_TEST_DIR = tempfile.mkdtemp(prefix="pixelate_tests_")
+os.environ.setdefault("BLOB_STORE_DIR", os.path.join(_TEST_DIR, "blobs"))
+os.environ.setdefault("SHARED_CACHE_DIR", os.path.join(_TEST_DIR, "shared"))
+
+def make_jpeg(width: int = 64, height: int = 48, color=(200, 100, 50)) -> bytes:
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buf, format="JPEG")
+    return buf.getvalue()
+
+@pytest.fixture
+def jpeg() -> bytes:
+    return make_jpeg()
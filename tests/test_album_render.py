@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from controllers import CONTRAST_RANGE
+from controllers import album_controller
+from controllers.album_controller import _render_album, _step_ops
+from models.user_data import UserData
+from services.render_scheduler import RenderScheduler
+from services.render_service import RenderService
+
+from conftest import make_jpeg
+
+class _Scheduler:
+    """Records how many album jobs are in flight; the job for `fail_on` fails."""
+
+    def __init__(self, fail_on: bytes = None, concurrency: int = 2):
+        self.fail_on = fail_on
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.peak = 0
+        self.started = 0
+        self.cancelled = 0
+
+    async def submit(self, chat_id, priority, func, source, ops):
+        self.in_flight += 1
+        self.started += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if source == self.fail_on:
+                raise RuntimeError("render failed")
+            await asyncio.sleep(0.05)
+            return source
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+def _album(count: int) -> UserData:
+    user_data = UserData()
+    user_data.reset_album([make_jpeg(color=(i * 20, 0, 0)) for i in range(count)])
+    return user_data
+
+def test_album_renders_hold_a_bounded_number_of_jobs():
+    user_data = _album(6)
+    scheduler = _Scheduler()
+    images = asyncio.run(_render_album(1, user_data, scheduler))
+    assert images == [source for source, _ in user_data.album_plan()]
+    assert scheduler.peak == scheduler.concurrency
+
+def test_album_render_failure_cancels_the_rest():
+    user_data = _album(6)
+    sources = [source for source, _ in user_data.album_plan()]
+    scheduler = _Scheduler(fail_on=sources[0])
+    with pytest.raises(RuntimeError):
+        asyncio.run(_render_album(1, user_data, scheduler))
+    # Jobs already submitted were cancelled and the rest never submitted.
+    assert scheduler.in_flight == 0
+    assert scheduler.cancelled == scheduler.started - 1
+    assert scheduler.started < len(sources)
+
+def test_album_contrast_uses_the_contrast_menu_bounds():
+    ops = []
+    for _ in range(30):
+        ops = _step_ops(ops, "contrast", -10)
+    assert ops == [["contrast", {"value": CONTRAST_RANGE[0]}]]
+
+def test_album_takes_about_as_long_as_its_slowest_photo(monkeypatch):
+    user_data = _album(6)
+    slowest = user_data.album_plan()[0][0]
+
+    def render(source, ops):
+        time.sleep(0.4 if source == slowest else 0.1)
+        return source
+
+    monkeypatch.setattr(album_controller, "render_pipeline", render)
+
+    async def scenario():
+        service = RenderService(max_workers=6, use_processes=False)
+        scheduler = RenderScheduler(service, concurrency=6, max_queue_depth=16)
+        started = time.monotonic()
+        try:
+            await _render_album(1, user_data, scheduler)
+            return time.monotonic() - started
+        finally:
+            await scheduler.shutdown()
+            await service.shutdown()
+
+    # Serially this would take 0.9 s.
+    assert asyncio.run(scenario()) < 0.6
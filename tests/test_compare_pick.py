@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from controllers import picked_value
+from controllers.brightness_controller import brightness_pick_callback
+from controllers.contrast_controller import contrast_pick_callback
+from controllers.pixelate_controller import pixel_pick_callback
+
+class _Callback:
+    def __init__(self, data: str):
+        self.data = data
+        self.answers = []
+
+    async def answer(self, text=None, **kwargs):
+        self.answers.append(text)
+
+def test_picked_value():
+    assert picked_value("pixel_pick:12") == 12
+    assert picked_value("brightness_pick:-40") == -40
+    assert picked_value("pixel_pick") is None
+    assert picked_value("pixel_pick:12x") is None
+
+@pytest.mark.parametrize("handler, prefix", [
+    (pixel_pick_callback, "pixel_pick"),
+    (brightness_pick_callback, "brightness_pick"),
+    (contrast_pick_callback, "contrast_pick"),
+])
+def test_malformed_pick_is_answered(handler, prefix):
+    callback = _Callback(f"{prefix}:abc")
+    # Nothing else is touched: the session is never loaded.
+    asyncio.run(handler(callback, None, None, None, None))
+    assert callback.answers == ["Nothing to change."]
@@ -0,0 +1,45 @@
+import io
+
+import numpy as np
+from PIL import Image, JpegImagePlugin
+
+from services.encoding import SUBSAMPLING_444, EncodingProfile, _save, encode_array
+from services.image_buffer import ImageBuffer
+
+def _noise(width=96, height=64) -> ImageBuffer:
+    # Noise compresses badly, so quality visibly changes the size.
+    return ImageBuffer(np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+def _open(data: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img
+
+def test_default_profile_is_a_full_chroma_jpeg_close_to_the_source():
+    image = _noise()
+    decoded = _open(encode_array(image))
+    assert decoded.format == "JPEG"
+    assert JpegImagePlugin.get_sampling(decoded) == SUBSAMPLING_444
+    error = np.abs(np.asarray(decoded, dtype=np.int16) - image.pixels).mean()
+    assert error < 20
+
+def test_lossless_download_keeps_every_pixel():
+    image = _noise()
+    decoded = _open(encode_array(image, "download_lossless"))
+    assert decoded.format == "PNG"
+    assert np.array_equal(np.asarray(decoded.convert("RGB")), image.pixels)
+
+def test_target_bytes_picks_the_highest_quality_that_fits():
+    image = _noise()
+    profile = EncodingProfile("test", quality=95, min_quality=10)
+    sizes = {q: len(_save(image.to_pil(), profile, q)) for q in range(10, 96)}
+    target = sizes[60]
+    data = encode_array(image, EncodingProfile("test", quality=95, min_quality=10, target_bytes=target))
+    assert len(data) <= target
+    best = max(q for q, size in sizes.items() if size <= target)
+    assert data == _save(image.to_pil(), profile, best)
+
+def test_unreachable_target_falls_back_to_min_quality():
+    image = _noise()
+    profile = EncodingProfile("test", quality=90, min_quality=30, target_bytes=100)
+    assert encode_array(image, profile) == _save(image.to_pil(), profile, 30)
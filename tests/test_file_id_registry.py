@@ -0,0 +1,57 @@
+import asyncio
+import datetime
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendPhoto
+from aiogram.types import BufferedInputFile, Chat, Message, PhotoSize
+
+from services.file_id_registry import FileIdRegistry
+from utils import file_utils
+
+from conftest import make_jpeg
+
+class _Chat:
+    """Stands in for a Message's answer_photo; each upload gets a new file_id."""
+
+    def __init__(self, stale=()):
+        self.sent = []
+        self.stale = set(stale)
+
+    async def answer_photo(self, photo, caption=None, reply_markup=None):
+        self.sent.append(photo)
+        if photo in self.stale:
+            raise TelegramBadRequest(method=SendPhoto(chat_id=1, photo=photo), message="wrong file identifier")
+        file_id = photo if isinstance(photo, str) else f"uploaded-{len(self.sent)}"
+        return Message(
+            message_id=len(self.sent), date=datetime.datetime.now(), chat=Chat(id=1, type="private"),
+            photo=[PhotoSize(file_id=file_id, file_unique_id=file_id, width=1, height=1)],
+        )
+
+def test_registry_is_a_bounded_lru():
+    registry = FileIdRegistry(max_entries=2)
+    registry.put("a", "A")
+    registry.put("b", "B")
+    assert registry.get("a") == "A"
+    registry.put("c", "C")
+    assert registry.get("b") is None
+    assert (registry.get("a"), registry.get("c")) == ("A", "C")
+
+def test_resent_image_goes_by_file_id_and_stale_ids_are_uploaded(monkeypatch):
+    monkeypatch.setattr(file_utils, "file_id_registry", FileIdRegistry(max_entries=10))
+    image = make_jpeg()
+
+    async def scenario():
+        chat = _Chat()
+        await file_utils.send_photo_from_bytes(chat, image)
+        await file_utils.send_photo_from_bytes(chat, image)
+        assert isinstance(chat.sent[0], BufferedInputFile)
+        assert chat.sent[1] == "uploaded-1"
+
+        # Telegram no longer knows the file_id: the bytes are uploaded again.
+        chat = _Chat(stale={"uploaded-1"})
+        await file_utils.send_photo_from_bytes(chat, image)
+        assert chat.sent[0] == "uploaded-1"
+        assert isinstance(chat.sent[1], BufferedInputFile)
+        assert file_utils.file_id_registry.get(file_utils.content_key(image)) == "uploaded-2"
+
+    asyncio.run(scenario())
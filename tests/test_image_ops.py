@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from services.image_buffer import ImageBuffer
+from services.image_utils import apply_brightness, apply_contrast, pixelate_array
+
+# The per-pixel list implementations the ImageBuffer ops replaced
+
+def _reference_brightness(pixel_array, brightness_value):
+    return [[tuple(max(0, min(255, c + brightness_value)) for c in pixel) for pixel in row] for row in pixel_array]
+
+def _reference_contrast(pixel_array, contrast_value):
+    factor = 1 + (contrast_value / 100.0)
+    return [
+        [tuple(max(0, min(255, int((c - 127.5) * factor + 127.5))) for c in pixel) for pixel in row]
+        for row in pixel_array
+    ]
+
+def _reference_pixelate(pixel_array, block_size):
+    height, width = len(pixel_array), len(pixel_array[0])
+    new_array = []
+    for row_start in range(0, height, block_size):
+        for row_offset in range(block_size):
+            if row_start + row_offset >= height:
+                break
+            new_row = []
+            for col_start in range(0, width, block_size):
+                block = [
+                    pixel_array[rr][cc]
+                    for rr in range(row_start, min(row_start + block_size, height))
+                    for cc in range(col_start, min(col_start + block_size, width))
+                ]
+                mean = tuple(sum(p[i] for p in block) // len(block) for i in range(3))
+                new_row.extend([mean] * block_size)
+            new_array.append(new_row[:width])
+    return new_array
+
+def _random_image(width=23, height=17, seed=0) -> ImageBuffer:
+    return ImageBuffer(np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+def _as_lists(pixel_array: ImageBuffer):
+    return [[tuple(int(c) for c in pixel) for pixel in row] for row in pixel_array.pixels]
+
+@pytest.mark.parametrize("value", [-255, -40, -1, 1, 37, 255])
+def test_brightness_matches_the_per_pixel_formula(value):
+    image = _random_image()
+    assert _as_lists(apply_brightness(image, value)) == _reference_brightness(_as_lists(image), value)
+
+@pytest.mark.parametrize("value", [-100, -35, -1, 1, 50, 200])
+def test_contrast_matches_the_per_pixel_formula(value):
+    image = _random_image()
+    assert _as_lists(apply_contrast(image, value)) == _reference_contrast(_as_lists(image), value)
+
+@pytest.mark.parametrize("block_size", [2, 3, 5, 8, 17, 40])
+def test_pixelate_matches_the_per_pixel_formula(block_size):
+    image = _random_image()
+    assert _as_lists(pixelate_array(image, block_size)) == _reference_pixelate(_as_lists(image), block_size)
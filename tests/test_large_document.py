@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+import io
+import itertools
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageMedia, GetFile, SendDocument, SendPhoto
+from aiogram.types import BufferedInputFile, CallbackQuery, Chat, Document, File, Message, PhotoSize, Update, User
+from PIL import Image
+
+import settings
+from utils.state_utils import load_user_data
+
+from conftest import make_jpeg
+
+CHAT = Chat(id=1, type="private")
+USER = User(id=1, is_bot=False, first_name="Test")
+
+class _RecordingSession(BaseSession):
+    """Answers every Bot API call and keeps the files the bot uploads."""
+
+    def __init__(self, files):
+        super().__init__()
+        self.files = files
+        self.uploads = []
+        self._ids = itertools.count(100)
+
+    def _message(self) -> Message:
+        message_id = next(self._ids)
+        return Message(
+            message_id=message_id, date=datetime.datetime.now(), chat=CHAT,
+            photo=[PhotoSize(file_id=f"sent-{message_id}", file_unique_id=f"sent-{message_id}", width=1, height=1)],
+        )
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, GetFile):
+            return File(file_id=method.file_id, file_unique_id=method.file_id, file_path=method.file_id)
+        media = getattr(method, "photo", None) or getattr(method, "document", None)
+        if isinstance(method, EditMessageMedia):
+            media = method.media.media
+        if isinstance(media, BufferedInputFile):
+            self.uploads.append((type(method), media.data))
+        if isinstance(method, (SendPhoto, SendDocument, EditMessageMedia)):
+            return self._message()
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield self.files[url.rsplit("/", 1)[-1]]
+
+    async def close(self):
+        pass
+
+def _size(image_bytes: bytes):
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        return img.size
+
+def test_large_document_is_shown_reduced_and_kept_at_full_resolution(monkeypatch):
+    monkeypatch.setattr(settings, "RENDER_USE_PROCESSES", False)
+    monkeypatch.setattr(settings, "RENDER_WORKERS", 1)
+    import bot as bot_module
+
+    full_size = (6000, 4000)
+    original = make_jpeg(*full_size)
+    ids = itertools.count(1)
+
+    def document():
+        message = Message(
+            message_id=next(ids), date=datetime.datetime.now(), chat=CHAT, from_user=USER,
+            document=Document(file_id="big", file_unique_id="big", mime_type="image/jpeg", file_size=len(original)),
+        )
+        return Update(update_id=next(ids), message=message)
+
+    def tap(data: str):
+        query = CallbackQuery(id=str(next(ids)), from_user=USER, chat_instance="c", data=data, message=document().message)
+        return Update(update_id=next(ids), callback_query=query)
+
+    async def scenario():
+        session = _RecordingSession({"big": original})
+        bot = Bot(token="1:x", session=session)
+        dp = bot_module.create_dispatcher()
+        try:
+            await dp.feed_update(bot, document())
+            [(method, shown)] = session.uploads
+            assert method is SendPhoto
+            assert max(_size(shown)) == settings.DISPLAY_MAX_SIDE
+
+            # Renders and Download work on the original.
+            for data in ("menu_brightness", "brightness_plus", "brightness_preview", "brightness_preview"):
+                await dp.feed_update(bot, tap(data))
+            state = dp.fsm.get_context(bot, CHAT.id, USER.id)
+            user_data = await load_user_data(state)
+            assert user_data.history_ops == [["brightness", {"value": 10}]]
+            assert _size(user_data.current_image_data) == full_size
+            assert all(max(_size(data)) <= settings.DISPLAY_MAX_SIDE for _, data in session.uploads)
+
+            await dp.feed_update(bot, tap("download_image"))
+            method, downloaded = session.uploads[-1]
+            assert method is SendDocument
+            assert _size(downloaded) == full_size
+        finally:
+            await dp.emit_shutdown()
+            await bot.session.close()
+
+    asyncio.run(scenario())
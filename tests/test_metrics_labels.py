@@ -0,0 +1,28 @@
+from aiogram.types import Update
+
+from middlewares.metrics import handler_name
+
+USER = {"id": 1, "is_bot": False, "first_name": "Test"}
+CHAT = {"id": 1, "type": "private"}
+
+def _text(text: str) -> Update:
+    return Update.model_validate(
+        {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": CHAT, "from": USER, "text": text}}
+    )
+
+def _callback(data: str) -> Update:
+    return Update.model_validate(
+        {"update_id": 1, "callback_query": {"id": "1", "from": USER, "chat_instance": "c", "data": data}}
+    )
+
+def test_commands_map_to_a_fixed_set():
+    assert handler_name(_text("/start")) == "/start"
+    assert handler_name(_text("/start@pixel_bot payload")) == "/start"
+    assert handler_name(_text("/whatever")) == "other_command"
+    assert handler_name(_text("/x1")) == handler_name(_text("/x2"))
+    assert handler_name(_text("hello")) == "message"
+
+def test_callback_arguments_are_dropped():
+    assert handler_name(_callback("pixel_plus")) == "pixel_plus"
+    assert handler_name(_callback("pixel_pick:12")) == "pixel_pick"
+    assert handler_name(_callback("brightness_pick:-30")) == "brightness_pick"
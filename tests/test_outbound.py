@@ -0,0 +1,104 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageMedia, SendMessage
+from aiogram.types import InputMediaPhoto
+
+import settings
+from middlewares.outbound import REPLACED_EDIT, OutboundRequestMiddleware
+from services.file_id_registry import FileIdRegistry
+from utils import file_utils
+
+from conftest import make_jpeg
+
+def _middleware() -> OutboundRequestMiddleware:
+    return OutboundRequestMiddleware(chat_rate=1.0, chat_burst=3.0, global_rate=30.0, global_burst=30.0, max_retries=1)
+
+_real_sleep = asyncio.sleep
+
+async def _no_sleep(seconds, *args, **kwargs):
+    # RetryAfter waits are skipped; the buckets still record them.
+    await _real_sleep(0)
+
+def _flood_once(retry_after: int = 1):
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(method)
+        if len(calls) == 1:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=retry_after)
+        return True
+
+    return make_request, calls
+
+def test_webhook_workers_share_the_global_rate(monkeypatch):
+    monkeypatch.setenv("BOT_TOKEN", "1:x")
+    from bot import create_bot
+
+    async def scenario():
+        bot = create_bot(processes=4)
+        try:
+            [outbound] = [m for m in bot.session.middleware if isinstance(m, OutboundRequestMiddleware)]
+            assert outbound.global_bucket.rate == settings.OUTBOUND_GLOBAL_RATE / 4
+            assert outbound.global_bucket.burst == settings.OUTBOUND_GLOBAL_BURST / 4
+        finally:
+            await bot.session.close()
+
+    asyncio.run(scenario())
+
+def test_retry_after_holds_back_the_global_bucket(monkeypatch):
+    monkeypatch.setattr(asyncio, "sleep", _no_sleep)
+
+    async def scenario():
+        # A chat's flood control spends the global burst...
+        outbound = _middleware()
+        make_request, calls = _flood_once()
+        assert await outbound(make_request, None, SendMessage(chat_id=1, text="hi"))
+        assert len(calls) == 2
+        assert outbound.global_bucket.tokens < 1
+        assert outbound.global_bucket.delay() > 0
+
+        # ...and flood control on a request to no chat pauses everything.
+        outbound = _middleware()
+        make_request, calls = _flood_once(retry_after=5)
+        assert await outbound(make_request, None, AnswerCallbackQuery(callback_query_id="1"))
+        assert outbound.global_bucket.delay() > 4
+
+    asyncio.run(scenario())
+
+def _edit(file_id: str) -> EditMessageMedia:
+    return EditMessageMedia(chat_id=1, message_id=7, media=InputMediaPhoto(media=file_id))
+
+def test_replaced_edit_gets_no_result_of_the_newer_one():
+    async def scenario():
+        outbound = _middleware()
+        outbound._chat_bucket(1).tokens = 0  # The edits wait for their turn.
+        sent = []
+
+        async def make_request(bot, method):
+            sent.append(method.media.media)
+            if method.media.media == "bad":
+                raise TelegramBadRequest(method=method, message="wrong file identifier")
+            return True
+
+        older = asyncio.create_task(outbound(make_request, None, _edit("old")))
+        await asyncio.sleep(0)
+        newer = await asyncio.gather(outbound(make_request, None, _edit("bad")), return_exceptions=True)
+        assert isinstance(newer[0], TelegramBadRequest)
+        # Neither the newer edit's error nor a retry of the stale one
+        assert await older is REPLACED_EDIT
+        assert sent == ["bad"]
+
+    asyncio.run(scenario())
+
+def test_replaced_photo_edit_is_not_registered(monkeypatch):
+    registry = FileIdRegistry(max_entries=10)
+    monkeypatch.setattr(file_utils, "file_id_registry", registry)
+
+    class _Message:
+        async def edit_media(self, media, reply_markup=None):
+            return REPLACED_EDIT
+
+    image = make_jpeg()
+    assert asyncio.run(file_utils.edit_photo_from_bytes(_Message(), image)) is None
+    assert registry.get(file_utils.content_key(image)) is None
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from services.image_buffer import ImageBuffer
+from services.image_utils import pixelate_array
+from controllers import PIXEL_SIZE_RANGE
+from services import pixelate_engine
+from services.pixelate_engine import MAX_BLOCK_SUM, PixelationEngine
+
+def _random_image(width=29, height=19, seed=1) -> ImageBuffer:
+    return ImageBuffer(np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+def _block_ids(length: int, size: int, anchor: str) -> np.ndarray:
+    offset = (size - length % size) // 2 if anchor == "center" and length % size else 0
+    return (np.arange(length) + offset) // size
+
+def _brute_force(image: ImageBuffer, block_width: int, block_height: int, anchor: str) -> np.ndarray:
+    """Floored mean of every pixel's block, found by block index alone."""
+    pixels = image.pixels.astype(np.int64)
+    rows = _block_ids(image.height, block_height, anchor)
+    cols = _block_ids(image.width, block_width, anchor)
+    out = np.empty_like(image.pixels)
+    for r in np.unique(rows):
+        for c in np.unique(cols):
+            block = pixels[rows == r][:, cols == c]
+            out[np.ix_(rows == r, cols == c)] = block.reshape(-1, 3).sum(axis=0) // (block.size // 3)
+    return out
+
+@pytest.mark.parametrize("anchor", ["top-left", "center"])
+@pytest.mark.parametrize("block_width, block_height", [(2, 2), (3, 3), (4, 7), (7, 4), (10, 10), (29, 19), (40, 40)])
+def test_engine_matches_brute_force_and_single_pass(block_width, block_height, anchor):
+    image = _random_image()
+    expected = _brute_force(image, block_width, block_height, anchor)
+    engine = PixelationEngine(image)
+    assert np.array_equal(engine.pixelate(block_width, block_height, anchor).pixels, expected)
+    assert np.array_equal(pixelate_array(image, block_width, block_height, anchor).pixels, expected)
+
+def test_block_sums_stay_exact_when_the_table_wraps():
+    image = _random_image()
+    engine = PixelationEngine(image)
+    expected = engine.pixelate(5, anchor="center").pixels
+    # Entries of a large image's table exceed 2**32 and wrap. A wrapped table
+    # is the exact one plus multiples of 2**32; an offset linear in row and
+    # column pushes every entry past the wrap while cancelling out of each
+    # block's four-corner sum, as the wrapped multiples do.
+    rows, cols = np.indices(engine.sat.shape[:2], dtype=np.uint64)
+    offset = (rows * 3_000_000_019 + cols * 2_000_000_011 + 4_000_000_007) % 2**32
+    engine.sat += offset.astype(np.uint32)[:, :, None]
+    assert np.array_equal(engine.pixelate(5, anchor="center").pixels, expected)
+
+def test_largest_blocks_fit_in_32_bits():
+    # The menu's largest block on an all-white image has the largest sum.
+    assert 255 * PIXEL_SIZE_RANGE[1] ** 2 < MAX_BLOCK_SUM
+    white = ImageBuffer(np.full((PIXEL_SIZE_RANGE[1], PIXEL_SIZE_RANGE[1], 3), 255, dtype=np.uint8))
+    assert (PixelationEngine(white).pixelate(PIXEL_SIZE_RANGE[1]).pixels == 255).all()
+
+def test_blocks_whose_sums_could_wrap_are_refused(monkeypatch):
+    engine = PixelationEngine(_random_image())
+    # As if the 29x19 image were one block of a huge image
+    monkeypatch.setattr(pixelate_engine, "MAX_BLOCK_SUM", 255 * 29 * 19)
+    with pytest.raises(ValueError):
+        engine.pixelate(29, 19)
+    engine.pixelate(29, 18)
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+from controllers.pixelate_controller import _pixelate_op, _prefetch_neighbours
+from models.user_data import UserData
+from services.preview_cache import PreviewCache
+from services.render_scheduler import Priority
+
+from conftest import make_jpeg
+
+class _Scheduler:
+    """Renders instantly and records what was asked for, at which priority."""
+
+    def __init__(self):
+        self.jobs = []
+
+    async def submit(self, chat_id, priority, func, source, ops):
+        self.jobs.append((priority, ops))
+        return repr(ops).encode()
+
+def test_plus_tap_preview_is_served_from_the_prefetch():
+    async def scenario():
+        cache = PreviewCache(session_budget=1 << 20, total_budget=1 << 20)
+        scheduler = _Scheduler()
+        user_data = UserData()
+        user_data.reset_history(make_jpeg())
+        user_data.pixel_size = 5
+        callback = SimpleNamespace(message=SimpleNamespace(chat=SimpleNamespace(id=1)))
+
+        # The menu opens at 5 and warms 5, 7 and 3.
+        _prefetch_neighbours(callback, user_data, cache, scheduler)
+        await cache._sessions[1].prefetch_task
+        assert [priority for priority, _ in scheduler.jobs] == [Priority.PREFETCH] * 3
+
+        # + to 7, then Preview: a hit, rendered by the prefetch.
+        user_data.pixel_size = 7
+        preview = await cache.render(1, user_data, _pixelate_op(user_data), scheduler)
+        assert preview == repr(user_data.render_plan(_pixelate_op(user_data))[1]).encode()
+        assert (cache.hits, cache.misses, len(scheduler.jobs)) == (1, 0, 3)
+
+        # Jumping past the prefetched values is a miss rendered at preview priority.
+        user_data.pixel_size = 11
+        await cache.render(1, user_data, _pixelate_op(user_data), scheduler)
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert scheduler.jobs[-1][0] == Priority.PREVIEW
+
+        # A saved edit changes the current image: its previews no longer apply.
+        user_data.push_undo_data(make_jpeg(color=(0, 0, 0)), _pixelate_op(user_data))
+        user_data.pixel_size = 7
+        await cache.render(1, user_data, _pixelate_op(user_data), scheduler)
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    asyncio.run(scenario())
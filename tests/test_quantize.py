@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from services.image_buffer import ImageBuffer
+from services.quantize import DITHERS, PaletteFit, quantize_array, sample_pixels, threshold_array
+
+def _gradient(width=48, height=32) -> ImageBuffer:
+    rows, cols = np.indices((height, width))
+    pixels = np.stack([cols * 255 // (width - 1), rows * 255 // (height - 1), (rows + cols) * 4 % 256], axis=2)
+    return ImageBuffer(pixels.astype(np.uint8))
+
+def _colours(image: ImageBuffer) -> set:
+    return set(map(tuple, image.pixels.reshape(-1, 3).tolist()))
+
+@pytest.mark.parametrize("dither", DITHERS)
+@pytest.mark.parametrize("colors", [2, 5, 16])
+def test_quantize_keeps_the_shape_and_stays_within_the_palette(colors, dither):
+    image = _gradient()
+    fit = PaletteFit(sample_pixels(image))
+    palette = fit.palette(colors)
+    assert 1 < len(palette) <= colors
+
+    result = quantize_array(image, colors, dither, fit)
+    assert result.pixels.shape == image.pixels.shape
+    assert _colours(result) <= set(map(tuple, palette.tolist()))
+
+def test_smaller_palettes_come_from_the_same_fit():
+    fit = PaletteFit(sample_pixels(_gradient()))
+    sizes = [len(fit.palette(colors)) for colors in (1, 2, 4, 8, 16, 32)]
+    assert sizes == sorted(sizes) and sizes[0] == 1
+
+@pytest.mark.parametrize("dither", DITHERS)
+def test_black_and_white_has_two_colours(dither):
+    image = _gradient()
+    result = threshold_array(image, 128, dither)
+    assert result.pixels.shape == image.pixels.shape
+    assert _colours(result) <= {(0, 0, 0), (255, 255, 255)}
+
+def test_ordered_dither_is_seamless_across_strips():
+    image = _gradient()
+    fit = PaletteFit(sample_pixels(image))
+    whole = quantize_array(image, 8, "ordered", fit).pixels
+    top = quantize_array(ImageBuffer(image.pixels[:13]), 8, "ordered", fit).pixels
+    bottom = quantize_array(ImageBuffer(image.pixels[13:]), 8, "ordered", fit, row_offset=13).pixels
+    assert np.array_equal(np.concatenate([top, bottom]), whole)
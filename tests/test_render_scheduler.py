@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+
+from services.render_scheduler import Priority, RenderScheduler, SchedulerBusyError
+from services.render_service import RenderService, RenderTimeoutError
+from services.shared_cache import DiskCache
+
+def _sleep(seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+def test_timed_out_job_keeps_its_slot_until_the_pool_is_free():
+    async def scenario():
+        service = RenderService(max_workers=1, use_processes=False)
+        scheduler = RenderScheduler(service, concurrency=1, max_queue_depth=4)
+        started = time.monotonic()
+        try:
+            with pytest.raises(RenderTimeoutError):
+                await scheduler.submit(1, Priority.SAVE, _sleep, 0.5, timeout=0.1)
+            # The caller heard back on time, but the pool's only worker is still busy.
+            assert time.monotonic() - started < 0.4
+            assert scheduler.running == 1
+            assert scheduler.stats()["overrunning"] == 1
+
+            # Saturated: prefetches are refused and the next job waits its turn.
+            with pytest.raises(SchedulerBusyError):
+                await scheduler.submit(3, Priority.PREFETCH, _sleep, 0.0)
+            assert await scheduler.submit(2, Priority.SAVE, _sleep, 0.0) == 0.0
+            assert time.monotonic() - started >= 0.5
+            assert scheduler.running == 0
+        finally:
+            await scheduler.shutdown()
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+def test_superseded_jobs_leave_the_queue():
+    async def scenario():
+        service = RenderService(max_workers=1, use_processes=False)
+        scheduler = RenderScheduler(service, concurrency=1, max_queue_depth=2)
+        try:
+            busy = asyncio.create_task(scheduler.submit(1, Priority.SAVE, _sleep, 0.2))
+            await asyncio.sleep(0.05)
+            superseded = [asyncio.create_task(scheduler.submit(1, Priority.PREVIEW, _sleep, 0.0)) for _ in range(2)]
+            await asyncio.sleep(0)
+            assert scheduler.queue_depth == 2
+            for task in superseded:
+                task.cancel()
+            await asyncio.gather(*superseded, return_exceptions=True)
+            assert scheduler.queue_depth == 0
+
+            # The queue isn't full of dead jobs: another chat is admitted.
+            assert await scheduler.submit(2, Priority.PREVIEW, _sleep, 0.0) == 0.0
+            await busy
+        finally:
+            await scheduler.shutdown()
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+_renders = []
+
+def _render(data: bytes) -> bytes:
+    _renders.append(data)
+    time.sleep(0.1)
+    return data[::-1]
+
+def test_shared_job_outlives_the_chat_that_submitted_it(tmp_path):
+    async def scenario():
+        service = RenderService(max_workers=1, use_processes=False)
+        scheduler = RenderScheduler(service, concurrency=1, max_queue_depth=4, cache=DiskCache(str(tmp_path), 1 << 20))
+        try:
+            busy = asyncio.create_task(scheduler.submit(3, Priority.SAVE, _sleep, 0.1))
+            first = asyncio.create_task(scheduler.submit(1, Priority.PREVIEW, _render, b"abc"))
+            await asyncio.sleep(0.02)
+            second = asyncio.create_task(scheduler.submit(2, Priority.PREVIEW, _render, b"abc"))
+            await asyncio.sleep(0.02)
+            first.cancel()
+            # The other chat still waits for it: the queued job is kept.
+            assert await second == b"cba"
+            assert _renders == [b"abc"]
+            assert scheduler.submitted == 2
+            assert first.cancelled()
+            await busy
+        finally:
+            await scheduler.shutdown()
+            await service.shutdown()
+
+    asyncio.run(scenario())
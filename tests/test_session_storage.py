@@ -0,0 +1,99 @@
+import asyncio
+import os
+import threading
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from services.blob_store import BlobStore
+from services.session_storage import SpillingMemoryStorage
+
+from conftest import make_jpeg
+
+KEY = StorageKey(bot_id=1, chat_id=1, user_id=1)
+
+def _storage(tmp_path, blob_store=None) -> SpillingMemoryStorage:
+    blob_store = blob_store or BlobStore(str(tmp_path / "blobs"), memory_budget=1 << 20)
+    return SpillingMemoryStorage(
+        blob_store, str(tmp_path / "sessions"), idle_ttl=0, session_quota=1 << 20, memory_budget=1 << 20,
+        sweep_interval=3600,
+    )
+
+def test_session_accessed_while_spilling_stays_resident(tmp_path):
+    async def scenario():
+        storage = _storage(tmp_path)
+        await storage.set_data(KEY, {"brightness_value": 10})
+        spill = asyncio.create_task(storage.spill(KEY))
+        await asyncio.sleep(0)  # The record is being written in a thread.
+        await storage.set_data(KEY, {"brightness_value": 20})
+        await spill
+        assert storage.resident_sessions == 1
+        assert storage.spilled_sessions == 0
+        assert await storage.get_data(KEY) == {"brightness_value": 20}
+        assert not any(files for _, _, files in os.walk(storage.directory))
+
+        await storage.spill(KEY)
+        assert storage.spilled_sessions == 1
+        assert await storage.get_data(KEY) == {"brightness_value": 20}
+
+    asyncio.run(scenario())
+
+def test_startup_drops_what_an_earlier_run_left(tmp_path):
+    async def earlier_run():
+        blob_store = BlobStore(str(tmp_path / "blobs"), memory_budget=1 << 20)
+        storage = _storage(tmp_path, blob_store)
+        key = blob_store.put(make_jpeg())
+        blob_store.incref([key])
+        await storage.set_data(KEY, {"current_image_key": key})
+        await storage.sweep()
+        await blob_store.flush()
+        return key
+
+    key = asyncio.run(earlier_run())
+    blob_store = BlobStore(str(tmp_path / "blobs"), memory_budget=1 << 20, orphan_grace=0.01)
+    storage = _storage(tmp_path, blob_store)
+    assert key in blob_store
+
+    storage.clear_spilled()
+    blob_store.adopt_orphans()
+    time.sleep(0.02)
+    blob_store.sweep()
+    assert not os.path.exists(storage.directory)
+    assert key not in blob_store
+
+def test_blob_written_behind_is_readable_at_once(tmp_path):
+    async def scenario():
+        blob_store = BlobStore(str(tmp_path / "blobs"), memory_budget=0)
+        data = make_jpeg()
+        key = blob_store.put(data)
+        # Too big for the memory tier and maybe not on disk yet
+        assert blob_store.get(key) == data
+        await blob_store.flush()
+        assert os.path.exists(blob_store._path(key))
+        assert blob_store.get(key) == data
+
+    asyncio.run(scenario())
+
+def test_spilled_session_is_read_back_off_the_event_loop(tmp_path, monkeypatch):
+    reads = []
+    read = SpillingMemoryStorage._read
+
+    def recording_read(path):
+        reads.append(threading.current_thread() is threading.main_thread())
+        return read(path)
+
+    monkeypatch.setattr(SpillingMemoryStorage, "_read", staticmethod(recording_read))
+
+    async def scenario():
+        storage = _storage(tmp_path)
+        await storage.set_data(KEY, {"brightness_value": 10})
+        await storage.spill(KEY)
+        # Both accesses wait for the same read.
+        first, second = await asyncio.gather(storage.get_data(KEY), storage.get_data(KEY))
+        assert first == second == {"brightness_value": 10}
+        assert reads == [False]
+        assert storage.restores == 1
+        assert storage.resident_sessions == 1
+        assert storage.spilled_sessions == 0
+
+    asyncio.run(scenario())
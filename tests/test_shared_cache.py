@@ -0,0 +1,40 @@
+import asyncio
+import os
+
+from services.shared_cache import DiskCache
+
+def _files(directory: str):
+    return [name for _, _, files in os.walk(directory) for name in files]
+
+def test_workers_sharing_a_directory_share_entries_and_budget(tmp_path):
+    async def scenario():
+        directory = str(tmp_path / "cache")
+        first, second = DiskCache(directory, budget=1000), DiskCache(directory, budget=1000)
+        await first.load()
+        await second.load()
+
+        first.put("a", b"a" * 400)
+        # Readable before it reaches the disk, and by the other worker after.
+        assert await first.get("a") == b"a" * 400
+        await first.flush()
+        assert await second.get("a") == b"a" * 400
+
+        second.put("b", b"b" * 400)
+        await second.flush()
+        os.utime(second._path(second._name("b")), (0, 0))
+        # Each worker alone is under budget; the directory is not.
+        first.put("c", b"c" * 400)
+        await first.flush()
+        assert len(_files(directory)) == 2
+        assert await first.get("b") is None
+        assert await second.get("a") == b"a" * 400
+        assert first.nbytes <= first.budget
+
+        # A restart finds what the workers left.
+        restarted = DiskCache(directory, budget=1000)
+        await restarted.load()
+        assert restarted.stats()["entries"] == 2
+        await restarted.clear()
+        assert not os.path.exists(directory)
+
+    asyncio.run(scenario())
@@ -0,0 +1,32 @@
+import asyncio
+import datetime
+
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from middlewares.tap_coalescing import SupersededError, TapCoalescingMiddleware
+
+CHAT = Chat(id=1, type="private")
+USER = User(id=1, is_bot=False, first_name="Test")
+
+def _tap(data: str) -> Update:
+    message = Message(message_id=1, date=datetime.datetime.now(), chat=CHAT)
+    return Update(update_id=1, callback_query=CallbackQuery(id="1", from_user=USER, chat_instance="c", data=data, message=message))
+
+def test_contact_sheet_pick_supersedes_an_earlier_preview():
+    async def scenario():
+        middleware = TapCoalescingMiddleware({"pixel_preview", "pixel_pick"}, set(), debounce_delay=0.01)
+        outcomes = []
+
+        async def render(event, data):
+            try:
+                outcomes.append(await data["render_ticket"].run(asyncio.sleep(0.2, "rendered")))
+            except SupersededError:
+                outcomes.append("superseded")
+
+        preview = asyncio.create_task(middleware(render, _tap("pixel_preview"), {"event_chat": CHAT}))
+        await asyncio.sleep(0.01)
+        await middleware(render, _tap("pixel_pick:12"), {"event_chat": CHAT})
+        await preview
+        assert outcomes == ["superseded", "rendered"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import asyncio
+import json
+import threading
+
+import settings
+from models.user_data import UserData
+from services.blob_store import blob_store
+
+from conftest import make_jpeg
+
+def _json_round_trip(data: dict) -> dict:
+    # What a JSON-backed FSM storage (e.g. Redis) hands back
+    return json.loads(json.dumps(data))
+
+def test_keyframes_survive_json_storage():
+    user_data = UserData()
+    user_data.reset_history(make_jpeg())
+    steps = settings.HISTORY_KEYFRAME_INTERVAL + 1
+    for i in range(steps):
+        user_data.push_undo_data(make_jpeg(color=(i * 20, 0, 0)), ["brightness", {"value": i + 1}])
+    assert settings.HISTORY_KEYFRAME_INTERVAL in user_data.keyframes
+
+    loaded = UserData.from_state(_json_round_trip(user_data.pop_changes()))
+
+    assert loaded.keyframes == user_data.keyframes
+    source, ops = loaded.render_plan()
+    assert source == user_data._blob(user_data.keyframes[settings.HISTORY_KEYFRAME_INTERVAL])
+    assert len(ops) == steps - settings.HISTORY_KEYFRAME_INTERVAL
+    # Undoing onto the keyframe reads it instead of requiring a replay.
+    assert loaded.undo()
+    assert loaded.current_image_data == source
+
+def test_loaded_session_reads_its_working_images_off_the_event_loop(monkeypatch):
+    user_data = UserData()
+    user_data.reset_history(make_jpeg())
+    user_data.push_undo_data(make_jpeg(color=(0, 0, 0)), ["brightness", {"value": 10}])
+    asyncio.run(blob_store.flush())
+    loaded = UserData.from_state(_json_round_trip(user_data.pop_changes()))
+    blob_store.evict_from_memory(loaded.blob_keys())
+
+    reads = []
+    read_disk = blob_store._read_disk
+
+    def recording_read(key):
+        reads.append(threading.current_thread() is threading.main_thread())
+        return read_disk(key)
+
+    monkeypatch.setattr(blob_store, "_read_disk", recording_read)
+    asyncio.run(loaded.prefetch(loaded.working_keys()))
+    assert reads and not any(reads)
+    # Nothing left to read on the event loop.
+    assert loaded.current_image_data == user_data.current_image_data
+    assert loaded.render_plan()[0] == user_data.base_image_data
+    assert len(reads) == 2